@@ -3,6 +3,41 @@ import numpy as np
 import torch
 import torch.nn as nn
 
+# encoded features of each feature file, loaded once per process or handed over by the parent of a sweep worker
+_features = {}
+
+
+def _feature_file(config, key):
+    return os.path.join(os.path.abspath(config['data_path'] + config['dataset']), config[key])
+
+
+def load_features(config):
+    r"""``(v_feat, t_feat)`` float CPU tensors of the dataset, ``None`` for a missing file.
+
+    Every file is read once per process, the models of a sweep share the tensors.
+    """
+    loaded = []
+    for key in ('vision_feature_file', 'text_feature_file'):
+        path = _feature_file(config, key)
+        if path not in _features:
+            _features[path] = torch.from_numpy(np.load(path, allow_pickle=True)).type(torch.FloatTensor) \
+                if os.path.isfile(path) else None
+        loaded.append(_features[path])
+    return tuple(loaded)
+
+
+def share_features(config):
+    r"""Features of :func:`load_features` moved to shared memory, for :func:`set_shared_features` in workers."""
+    load_features(config)
+    for feat in _features.values():
+        if feat is not None:
+            feat.share_memory_()
+    return dict(_features)
+
+
+def set_shared_features(features):
+    _features.update(features)
+
 
 class AbstractRecommender(nn.Module):
     r"""Base class for all models
@@ -13,6 +48,19 @@ class AbstractRecommender(nn.Module):
     def post_epoch_processing(self):
         pass
 
+    def post_step_processing(self):
+        r"""Called after every optimizer step, e.g. to drop results derived from the parameters."""
+        pass
+
+    def train_batches(self, train_data):
+        r"""Training batches of an epoch, the batches of ``train_data`` unless the model attaches per-batch state.
+        """
+        return train_data
+
+    def close_train_batches(self):
+        r"""Release what :meth:`train_batches` kept across epochs, called once training ends."""
+        pass
+
     def calculate_loss(self, interaction):
         r"""Calculate the training loss for a batch data.
 
@@ -86,15 +134,10 @@ class GeneralRecommender(AbstractRecommender):
         # load encoded features here
         self.v_feat, self.t_feat = None, None
         if not config['end2end'] and config['is_multimodal_model']:
-            dataset_path = os.path.abspath(config['data_path'] + config['dataset'])
-            # if file exist?
-            v_feat_file_path = os.path.join(dataset_path, config['vision_feature_file'])
-            t_feat_file_path = os.path.join(dataset_path, config['text_feature_file'])
-            if os.path.isfile(v_feat_file_path):
-                self.v_feat = torch.from_numpy(np.load(v_feat_file_path, allow_pickle=True)).type(torch.FloatTensor).to(
-                    self.device)
-            if os.path.isfile(t_feat_file_path):
-                self.t_feat = torch.from_numpy(np.load(t_feat_file_path, allow_pickle=True)).type(torch.FloatTensor).to(
-                    self.device)
+            v_feat, t_feat = load_features(config)
+            if v_feat is not None:
+                self.v_feat = v_feat.to(self.device)
+            if t_feat is not None:
+                self.t_feat = t_feat.to(self.device)
 
             assert self.v_feat is not None or self.t_feat is not None, 'Features all NONE'
@@ -0,0 +1,113 @@
+import os
+import random
+import hashlib
+import threading
+import numpy as np
+import torch
+
+
+# config keys that do not change what a run trains, so its checkpoints stay valid when they change;
+# warm_start only picks the initial weights, which a resumed checkpoint replaces
+_RUN_ONLY_KEYS = ('device', 'gpu_id', 'use_gpu', 'resume', 'warm_start', 'checkpoint_dir', 'checkpoint_step',
+                  'sweep_workers', 'sweep_threads', 'artifact_cache_dir', 'artifact_cache_size',
+                  'save_recommended_topk', 'recommend_topk')
+
+
+def checkpoint_file(config, hyper_tuple, kind='latest'):
+    r"""Checkpoint path of one hyper-parameter combination.
+
+    Args:
+        config (Config): the run config; all of its keys but the ones of ``_RUN_ONLY_KEYS`` go into the hash.
+        hyper_tuple (tuple): values of ``config['hyper_parameters']``, replacing the ones in ``config``.
+        kind (str): ``latest`` for the periodic training state, ``best`` for the weights of the best validation.
+
+    Returns:
+        str: ``{checkpoint_dir}/{model}-{dataset}-{config hash}-{kind}.pth``
+    """
+    effective = {k: v for k, v in config.final_config_dict.items() if k not in _RUN_ONLY_KEYS}
+    effective.update(zip(config['hyper_parameters'], hyper_tuple))
+    tag = hashlib.sha1(repr(sorted(effective.items())).encode()).hexdigest()[:12]
+    return os.path.join(config['checkpoint_dir'], '{}-{}-{}-{}.pth'.format(
+        config['model'], config['dataset'], tag, kind))
+
+
+def snapshot(obj):
+    r"""Copy of a (nested) state with every tensor detached and moved to CPU, safe to write from another thread."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return {k: snapshot(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(v) for v in obj)
+    return obj
+
+
+def get_rng_state():
+    state = {'random': random.getstate(), 'numpy': np.random.get_state(), 'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def atomic_save(state, path):
+    # write next to the target and rename, a crash never leaves a truncated checkpoint behind
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+
+class AsyncCheckpointWriter(object):
+    r"""Writes checkpoints on a background thread so that training never waits on I/O.
+
+    :meth:`submit` only queues an already snapshotted state. If a newer state for the same path arrives before the
+    previous one was written, only the newer one is written. :meth:`close` writes what is queued and ends the
+    thread.
+    """
+    def __init__(self):
+        self.pending = {}
+        self.closed = False
+        self.error = None
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def submit(self, path, state):
+        with self.cond:
+            self._raise_error()
+            self.pending[path] = state
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _work(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed:
+                    self.cond.wait()
+                if not self.pending:
+                    return
+                path = next(iter(self.pending))
+                state = self.pending.pop(path)
+            try:
+                os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                atomic_save(state, path)
+            except Exception as e:
+                self.error = e
@@ -10,7 +10,8 @@ from time import time
 from logging import getLogger
 
 from utils_package.utils import get_local_time, early_stopping, dict2str
-from utils_package.topk_evaluator import TopKEvaluator
+from utils_package.topk_evaluator import TopKEvaluator, full_sort_topk
+from common.checkpoint import (checkpoint_file, snapshot, get_rng_state, set_rng_state, AsyncCheckpointWriter)
 
 
 class AbstractTrainer(object):
@@ -96,6 +97,20 @@ class Trainer(AbstractTrainer):
 
         self.item_tensor = None
         self.tot_item_num = None
+        # items scored per block in evaluation, for models exposing full_sort_factors; 0 scores all items at once
+        self.eval_item_tile = config['eval_item_tile'] or 0
+        # score the union of validation and test users once per evaluation
+        self.eval_shared_users = config['eval_shared_users']
+        # rung tracker of a sweep scheduler (see utils_package.sweep_scheduler), may stop training early
+        self.sweep_trial = None
+
+        # checkpoints of this hyper-parameter combination: the full training state every checkpoint_step epochs
+        # and the weights of the best validation, written by a background thread
+        self.checkpoint_step = config['checkpoint_step'] or 0
+        hyper_tuple = tuple(config[k] for k in config['hyper_parameters'])
+        self.checkpoint_file = checkpoint_file(config, hyper_tuple, 'latest')
+        self.best_checkpoint_file = checkpoint_file(config, hyper_tuple, 'best')
+        self.checkpoint_writer = None
 
     def _build_optimizer(self):
         r"""Init the Optimizer
@@ -136,7 +151,7 @@ class Trainer(AbstractTrainer):
         loss_func = loss_func or self.model.calculate_loss
         total_loss = None
         loss_batches = []
-        for batch_idx, interaction in enumerate(train_data):
+        for batch_idx, interaction in enumerate(self.model.train_batches(train_data)):
             self.optimizer.zero_grad()
             losses = loss_func(interaction)
             if isinstance(losses, tuple):
@@ -153,6 +168,7 @@ class Trainer(AbstractTrainer):
             if self.clip_grad_norm:
                 clip_grad_norm_(self.model.parameters(), **self.clip_grad_norm)
             self.optimizer.step()
+            self.model.post_step_processing()
             loss_batches.append(loss.detach())
             # for test
             #if batch_idx == 0:
@@ -186,6 +202,60 @@ class Trainer(AbstractTrainer):
             train_loss_output += 'train loss: %.4f' % losses
         return train_loss_output + ']'
 
+    def _save_checkpoint(self, epoch_idx, train_data, finished=False):
+        state = {
+            'epoch': epoch_idx,
+            'finished': finished,
+            'model': self.model.state_dict(),
+            'optimizer': self.optimizer.state_dict(),
+            'lr_scheduler': self.lr_scheduler.state_dict(),
+            'rng': get_rng_state(),
+            'cur_step': self.cur_step,
+            'best_valid_score': self.best_valid_score,
+            'best_valid_result': self.best_valid_result,
+            'best_test_upon_valid': self.best_test_upon_valid,
+            'train_loss_dict': self.train_loss_dict,
+            'train_data': train_data.state_dict(),
+        }
+        # copied on the training thread so that later steps cannot change what gets written
+        self.checkpoint_writer.submit(self.checkpoint_file, snapshot(state))
+
+    def _save_best_checkpoint(self, epoch_idx):
+        self.checkpoint_writer.submit(self.best_checkpoint_file,
+                                      snapshot({'epoch': epoch_idx, 'model': self.model.state_dict()}))
+
+    def resume_checkpoint(self, train_data, path=None):
+        r"""Restore the training state saved by the periodic checkpoints, training continues after its epoch.
+
+        Returns:
+            bool: whether the checkpoint comes from a finished training, nothing is left to train then
+        """
+        path = path or self.checkpoint_file
+        state = torch.load(path, map_location=self.device, weights_only=False)
+        self.model.load_state_dict(state['model'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.lr_scheduler.load_state_dict(state['lr_scheduler'])
+        set_rng_state(state['rng'])
+        train_data.load_state_dict(state['train_data'])
+        self.start_epoch = state['epoch'] + 1
+        self.cur_step = state['cur_step']
+        self.best_valid_score = state['best_valid_score']
+        self.best_valid_result = state['best_valid_result']
+        self.best_test_upon_valid = state['best_test_upon_valid']
+        self.train_loss_dict = state['train_loss_dict']
+        self.logger.info('Resumed from {} after epoch {}'.format(path, state['epoch']))
+        return state['finished']
+
+    def warm_start(self, path):
+        r"""Initialize the model from the best weights of another combination; tensors whose shape differs
+        (e.g. another ``embedding_size``) keep their fresh initialization.
+        """
+        weights = torch.load(path, map_location=self.device, weights_only=False)['model']
+        own = self.model.state_dict()
+        weights = {k: v for k, v in weights.items() if k in own and own[k].shape == v.shape}
+        self.model.load_state_dict(weights, strict=False)
+        self.logger.info('Warm start from {}: {}/{} tensors'.format(path, len(weights), len(own)))
+
     def fit(self, train_data, valid_data=None, test_data=None, saved=False, verbose=True):
         r"""Train the model based on the train data and the valid data.
 
@@ -195,11 +265,33 @@ class Trainer(AbstractTrainer):
                                                If it's None, the early_stopping is invalid.
             test_data (DataLoader, optional): None
             verbose (bool, optional): whether to write training and evaluation information to logger, default: True
-            saved (bool, optional): whether to save the model parameters, default: True
+            saved (bool, optional): whether to write checkpoints: the training state every ``checkpoint_step``
+                                    epochs, and the best weights when ``checkpoint_step`` or ``warm_start`` is set
 
         Returns:
              (float, dict): best valid score and best valid result. If valid_data is None, it returns (-1, None)
         """
+        if self.config['resume']:
+            if not os.path.isfile(self.checkpoint_file):
+                self.logger.warning('No checkpoint to resume at {}, training from scratch'.format(self.checkpoint_file))
+            elif self.resume_checkpoint(train_data):
+                return self.best_valid_score, self.best_valid_result, self.best_test_upon_valid
+        if self.config['warm_start'] and not saved:
+            self.logger.warning('warm_start is set but checkpoints are not saved, later combinations cannot warm start')
+        # the best weights are what warm_start starts later combinations from
+        if saved and (self.checkpoint_step or self.config['warm_start']):
+            self.checkpoint_writer = AsyncCheckpointWriter()
+        try:
+            self._fit(train_data, valid_data, test_data, verbose)
+        finally:
+            self.model.close_train_batches()
+            if self.checkpoint_writer is not None:
+                self.checkpoint_writer.close()
+                self.checkpoint_writer = None
+        return self.best_valid_score, self.best_valid_result, self.best_test_upon_valid
+
+    def _fit(self, train_data, valid_data, test_data, verbose):
+        last_epoch = None       # set when training ends normally, as opposed to on a nan loss
         for epoch_idx in range(self.start_epoch, self.epochs):
             # train
             training_start_time = time()
@@ -216,6 +308,8 @@ class Trainer(AbstractTrainer):
             training_end_time = time()
             train_loss_output = \
                 self._generate_train_loss_output(epoch_idx, training_start_time, training_end_time, train_loss)
+            if getattr(train_data, 'prefetch_depth', 0):
+                train_loss_output += ' [batch wait: %.2fs]' % train_data.stall_time
             post_info = self.model.post_epoch_processing()
             if verbose:
                 self.logger.info(train_loss_output)
@@ -225,7 +319,11 @@ class Trainer(AbstractTrainer):
             # eval: To ensure the test result is the best model under validation data, set self.eval_step == 1
             if (epoch_idx + 1) % self.eval_step == 0:
                 valid_start_time = time()
-                valid_score, valid_result = self._valid_epoch(valid_data)
+                if self.eval_shared_users:
+                    valid_result, test_result = self.evaluate_shared([valid_data, test_data])
+                    valid_score = valid_result[self.valid_metric] if self.valid_metric else valid_result['NDCG@20']
+                else:
+                    valid_score, valid_result = self._valid_epoch(valid_data)
                 self.best_valid_score, self.cur_step, stop_flag, update_flag = early_stopping(
                     valid_score, self.best_valid_score, self.cur_step,
                     max_step=self.stopping_step, bigger=self.valid_metric_bigger)
@@ -234,7 +332,8 @@ class Trainer(AbstractTrainer):
                                      (epoch_idx, valid_end_time - valid_start_time, valid_score)
                 valid_result_output = 'valid result: \n' + dict2str(valid_result)
                 # test
-                _, test_result = self._valid_epoch(test_data)
+                if not self.eval_shared_users:
+                    _, test_result = self._valid_epoch(test_data)
                 if verbose:
                     self.logger.info(valid_score_output)
                     self.logger.info(valid_result_output)
@@ -245,15 +344,48 @@ class Trainer(AbstractTrainer):
                         self.logger.info(update_output)
                     self.best_valid_result = valid_result
                     self.best_test_upon_valid = test_result
+                    if self.checkpoint_writer is not None:
+                        self._save_best_checkpoint(epoch_idx)
 
                 if stop_flag:
                     stop_output = '+++++Finished training, best eval result in epoch %d' % \
                                   (epoch_idx - self.cur_step * self.eval_step)
                     if verbose:
                         self.logger.info(stop_output)
+                    last_epoch = epoch_idx
                     break
-        return self.best_valid_score, self.best_valid_result, self.best_test_upon_valid
-
+                if self.sweep_trial is not None and self.sweep_trial.should_stop(epoch_idx, self.best_valid_score):
+                    stop_output = '+++++Stopped by the sweep scheduler at epoch %d, best eval result in epoch %d' % \
+                                  (epoch_idx, epoch_idx - self.cur_step * self.eval_step)
+                    if verbose:
+                        self.logger.info(stop_output)
+                    last_epoch = epoch_idx
+                    break
+            if self.checkpoint_writer is not None and self.checkpoint_step \
+                    and (epoch_idx + 1) % self.checkpoint_step == 0:
+                self._save_checkpoint(epoch_idx, train_data)
+        else:
+            last_epoch = self.epochs - 1
+        if self.checkpoint_writer is not None and self.checkpoint_step and last_epoch is not None:
+            self._save_checkpoint(last_epoch, train_data, finished=True)
+
+
+    def _score_topk(self, batched_data):
+        # top-k item index of the batch users, training positives excluded
+        masked_items = batched_data[1]
+        if self.eval_item_tile and hasattr(self.model, 'full_sort_factors'):
+            # score item tiles, mask pos items in each and keep a running top-k
+            user_tensor, item_tensor = self.model.full_sort_factors(batched_data)
+            _, topk_index = full_sort_topk(user_tensor, item_tensor, max(self.config['topk']), masked_items,
+                                           self.eval_item_tile)
+            return topk_index
+        # predict: interaction without item ids
+        scores = self.model.full_sort_predict(batched_data)
+        # mask out pos items
+        scores[masked_items[0], masked_items[1]] = -1e10
+        # rank and get top-k
+        _, topk_index = torch.topk(scores, max(self.config['topk']), dim=-1)  # nusers x topk
+        return topk_index
 
     @torch.no_grad()
     def evaluate(self, eval_data, is_test=False, idx=0):
@@ -266,16 +398,43 @@ class Trainer(AbstractTrainer):
         # batch full users
         batch_matrix_list = []
         for batch_idx, batched_data in enumerate(eval_data):
-            # predict: interaction without item ids
-            scores = self.model.full_sort_predict(batched_data)
-            masked_items = batched_data[1]
-            # mask out pos items
-            scores[masked_items[0], masked_items[1]] = -1e10
-            # rank and get top-k
-            _, topk_index = torch.topk(scores, max(self.config['topk']), dim=-1)  # nusers x topk
-            batch_matrix_list.append(topk_index)
+            batch_matrix_list.append(self._score_topk(batched_data))
         return self.evaluator.evaluate(batch_matrix_list, eval_data, is_test=is_test, idx=idx)
 
+    @torch.no_grad()
+    def evaluate_shared(self, eval_data_list, is_test=False, idx=0):
+        r"""Evaluate several eval data (e.g. validation and test) that share the training positives, scoring every
+        user of their union once.
+
+        The masked top-k of the union users is computed batch by batch like :meth:`evaluate` and the rows of each
+        eval data are gathered from it, so the metrics are those of :meth:`evaluate` on each of them.
+
+        Returns:
+            list: the eval result dict of each eval data
+        """
+        self.model.eval()
+        item_num = eval_data_list[0].dataset.get_item_num()
+        union_u = torch.unique(torch.cat([eval_data.eval_u for eval_data in eval_data_list]))
+        # training positives of the union users, as sorted (union row, item) keys without duplicates
+        keys = []
+        for eval_data in eval_data_list:
+            rows, items = eval_data.pos_items_per_u
+            keys.append(torch.searchsorted(union_u, eval_data.eval_u[rows]) * item_num + items)
+        keys = torch.unique(torch.cat(keys))
+        batch_size = eval_data_list[0].step
+        starts = torch.arange(0, len(union_u) + batch_size, batch_size, device=keys.device)
+        bounds = torch.searchsorted(keys, starts * item_num).tolist()
+
+        batch_matrix_list = []
+        for b, start in enumerate(range(0, len(union_u), batch_size)):
+            batch_keys = keys[bounds[b]: bounds[b + 1]]
+            batch_mask_matrix = torch.stack((batch_keys // item_num - start, batch_keys % item_num))
+            batch_matrix_list.append(self._score_topk([union_u[start: start + batch_size], batch_mask_matrix]))
+        topk_index = torch.cat(batch_matrix_list, dim=0)
+
+        return [self.evaluator.evaluate([topk_index[torch.searchsorted(union_u, eval_data.eval_u)]], eval_data,
+                                        is_test=is_test, idx=idx) for eval_data in eval_data_list]
+
     def plot_train_loss(self, show=True, save_path=None):
         r"""Plot the train loss in each epoch
 
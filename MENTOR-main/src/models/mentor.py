@@ -1,7 +1,7 @@
 # coding: utf-8
 #
-# user-graph need to be generated by the following script
-# tools/generate-u-u-matrix.py
+# user-graph is built from the training interactions on first use, or taken from the output of
+# utils_package/generate-u-u-matrix.py
 import os
 import numpy as np
 import scipy.sparse as sp
@@ -9,13 +9,19 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from torch_geometric.nn import GATConv
-from torch_geometric.nn.conv import MessagePassing
 from torch_geometric.utils import remove_self_loops, add_self_loops, degree
 import torch_geometric
 
 from common.abstract_recommender import GeneralRecommender
 from common.loss import BPRLoss, EmbLoss
 from common.init import xavier_uniform_initialization
+from utils_package.user_graph import (load_user_graph, read_user_graph_inputs, read_train_edges, inter_matrix,
+                                      build_user_graph)
+from utils_package.artifact_cache import ArtifactCache, file_digest, array_digest, sparse_to_csr, csr_to_sparse
+from utils_package.knn import knn_backends, knn_recall
+from utils_package.subgraph_sampler import SubgraphSampler, ClusterSampler
+from utils_package.graph_partition import load_partition
+from logging import getLogger
 from torch.nn import MultiheadAttention
 
 class MENTOR(GeneralRecommender):
@@ -30,6 +36,13 @@ class MENTOR(GeneralRecommender):
         self.n_layers = config['n_mm_layers']
         self.knn_k = config['knn_k']
         self.mm_image_weight = config['mm_image_weight']
+        self.knn_memory_budget = config['knn_memory_budget'] or 1024
+        self.knn_threads = config['knn_threads'] or 1
+        self.knn_backend = config['knn_backend'] or 'exact'
+        if self.knn_backend not in knn_backends:
+            raise ValueError('knn_backend [{}] should be one of {}'.format(self.knn_backend, list(knn_backends)))
+        self.knn_backend_params = config['knn_backend_params'] or {}
+        self.knn_recall_sample = config['knn_recall_sample']
 
         self.batch_size = batch_size
         self.num_user = num_user
@@ -44,7 +57,19 @@ class MENTOR(GeneralRecommender):
         self.mask_weight_g = config['mask_weight_g']
         self.mask_weight_f = config['mask_weight_f']
         self.temp = config['temp']
-        self.drop_rate = 0.1
+        self.cl_mode = config['cl_mode'] or 'full'
+        if self.cl_mode not in ('full', 'batch', 'chunked'):
+            raise ValueError('cl_mode [{}] should be one of full, batch, chunked'.format(self.cl_mode))
+        self.cl_num_negatives = config['cl_num_negatives'] or 0
+        self.cl_tile = config['cl_tile'] or 4096
+        self.mask_mode = config['mask_mode'] or 'full'
+        if self.mask_mode not in ('full', 'batch', 'sample'):
+            raise ValueError('mask_mode [{}] should be one of full, batch, sample'.format(self.mask_mode))
+        self.mask_sample_size = config['mask_sample_size'] or 4096
+        self.train_mode = config['train_mode'] or 'full'
+        if self.train_mode not in ('full', 'sampled', 'cluster'):
+            raise ValueError('train_mode [{}] should be one of full, sampled, cluster'.format(self.train_mode))
+        self.sample_fanouts = config['sample_fanouts'] or [10, 10]
 
         # rep=>表示representation
         self.v_rep = None
@@ -59,10 +84,31 @@ class MENTOR(GeneralRecommender):
         self.mlp = nn.Linear(2*dim_x, 2*dim_x)
 
         dataset_path = os.path.abspath(config['data_path'] + config['dataset'])
-        self.user_graph_dict = np.load(os.path.join(dataset_path, config['user_graph_dict_file']),
-                                       allow_pickle=True).item()
-
-        mm_adj_file = os.path.join(dataset_path, 'mm_adj_{}.pt'.format(self.knn_k))
+        # derived graphs are cached under a hash of everything they are built from
+        self.artifact_cache = ArtifactCache(config['artifact_cache_dir'] or os.path.join('saved', 'artifacts'),
+                                            config['artifact_cache_size'])
+        # CSR user-user graph, memory-mapped from the cache and keyed on the interactions it is built from; the
+        # user_graph_file of generate-u-u-matrix.py is taken when it records the same inputs, else it is rebuilt
+        inter_file = os.path.join(dataset_path, config['inter_file_name'])
+        user_graph_inputs = {'interactions': file_digest(inter_file), 'topk': config['user_graph_topk'] or 200}
+        user_graph_key = self.artifact_cache.key('user_graph', **user_graph_inputs)
+        user_graph = self.artifact_cache.load_csr(user_graph_key)
+        if user_graph is None:
+            user_graph_path = os.path.join(dataset_path, config['user_graph_file'])
+            if os.path.isdir(user_graph_path) and read_user_graph_inputs(user_graph_path) == user_graph_inputs:
+                user_graph = load_user_graph(user_graph_path)
+            else:
+                edges, n_users, n_items = read_train_edges(inter_file, config['USER_ID_FIELD'], config['ITEM_ID_FIELD'],
+                                                           config['field_separator'], config['inter_splitting_label'])
+                user_graph = build_user_graph(inter_matrix(edges, n_users, n_items), user_graph_inputs['topk'])
+            self.artifact_cache.save_csr(user_graph_key, *user_graph, inputs=user_graph_inputs)
+            user_graph = self.artifact_cache.load_csr(user_graph_key)
+        self.user_graph_indptr, self.user_graph_indices, self.user_graph_weights = user_graph
+        # padded top-k table of the user graph, and the current epoch's sample; both built on first use
+        self._user_graph_table = None
+        self._epoch_user_graph = None
+        # (user_rep, item_rep) of the last inference pass, dropped whenever the parameters may have changed
+        self._inference_cache = None
 
         if self.v_feat is not None:
             self.image_embedding = nn.Embedding.from_pretrained(self.v_feat, freeze=False)
@@ -71,8 +117,18 @@ class MENTOR(GeneralRecommender):
             self.text_embedding = nn.Embedding.from_pretrained(self.t_feat, freeze=False)
             self.text_trs = nn.Linear(self.t_feat.shape[1], self.feat_embed_dim)
 
-        if os.path.exists(mm_adj_file):
-            self.mm_adj = torch.load(mm_adj_file)
+        mm_adj_inputs = {
+            'vision': file_digest(os.path.join(dataset_path, config['vision_feature_file']))
+            if self.v_feat is not None else None,
+            'text': file_digest(os.path.join(dataset_path, config['text_feature_file']))
+            if self.t_feat is not None else None,
+            'mm_image_weight': self.mm_image_weight if self.v_feat is not None and self.t_feat is not None else None,
+            'knn_k': self.knn_k, 'knn_backend': self.knn_backend, 'knn_backend_params': self.knn_backend_params,
+            'normalization': 'sym'}
+        mm_adj_key = self.artifact_cache.key('mm_adj', **mm_adj_inputs)
+        mm_adj = self.artifact_cache.load_csr(mm_adj_key)
+        if mm_adj is not None:
+            self.mm_adj = csr_to_sparse(*mm_adj, device=self.device)
         else:
             if self.v_feat is not None:
                 # 通过knn计算图的邻接矩阵
@@ -87,7 +143,8 @@ class MENTOR(GeneralRecommender):
 
                 del text_adj
                 del image_adj
-            torch.save(self.mm_adj, mm_adj_file)
+            self.mm_adj = self.mm_adj.coalesce()
+            self.artifact_cache.save_csr(mm_adj_key, *sparse_to_csr(self.mm_adj), inputs=mm_adj_inputs)
 
         # 新增1：多头注意力机制相关的初始化
         # self.num_heads = 4  # 可从配置中获取头的数量，默认为4
@@ -98,6 +155,7 @@ class MENTOR(GeneralRecommender):
         # packing interaction in training into edge_index
         train_interactions = dataset.inter_matrix(form='coo').astype(np.float32)
         edge_index = self.pack_edge_index(train_interactions)
+        edges_digest = array_digest(edge_index)
         self.edge_index = torch.tensor(edge_index, dtype=torch.long).t().contiguous().to(self.device)
         self.edge_index = torch.cat((self.edge_index, self.edge_index[[1, 0]]), dim=1)
 
@@ -111,46 +169,15 @@ class MENTOR(GeneralRecommender):
             torch.tensor(np.random.randn(self.num_item, 2, 1), dtype=torch.float32, requires_grad=True)))
         self.weight_i.data = F.softmax(self.weight_i, dim=1)
 
-        self.item_index = torch.zeros([self.num_item], dtype=torch.long)
-        index = []
-        for i in range(self.num_item):
-            self.item_index[i] = i
-            index.append(i)
-        self.drop_percent = self.drop_rate
-        self.single_percent = 1
-        self.double_percent = 0
-
-        # 生成部分节点的屏蔽索引，随即划分成单模态屏蔽
-        drop_item = torch.tensor(
-            np.random.choice(self.item_index, int(self.num_item * self.drop_percent), replace=False))
-        drop_item_single = drop_item[:int(self.single_percent * len(drop_item))]
-
-        self.dropv_node_idx_single = drop_item_single[:int(len(drop_item_single) * 1 / 3)]
-        self.dropt_node_idx_single = drop_item_single[int(len(drop_item_single) * 2 / 3):]
-
-        self.dropv_node_idx = self.dropv_node_idx_single
-        self.dropt_node_idx = self.dropt_node_idx_single
-
-        mask_cnt = torch.zeros(self.num_item, dtype=int).tolist()
-        for edge in edge_index:
-            mask_cnt[edge[1] - self.num_user] += 1
-        mask_dropv = []
-        mask_dropt = []
-        for idx, num in enumerate(mask_cnt):
-            temp_false = [False] * num
-            temp_true = [True] * num
-            mask_dropv.extend(temp_false) if idx in self.dropv_node_idx else mask_dropv.extend(temp_true)
-            mask_dropt.extend(temp_false) if idx in self.dropt_node_idx else mask_dropt.extend(temp_true)
-
-        edge_index = edge_index[np.lexsort(edge_index.T[1, None])]
-        edge_index_dropv = edge_index[mask_dropv]
-        edge_index_dropt = edge_index[mask_dropt]
-
-        self.edge_index_dropv = torch.tensor(edge_index_dropv).t().contiguous().to(self.device)
-        self.edge_index_dropt = torch.tensor(edge_index_dropt).t().contiguous().to(self.device)
-
-        self.edge_index_dropv = torch.cat((self.edge_index_dropv, self.edge_index_dropv[[1, 0]]), dim=1)
-        self.edge_index_dropt = torch.cat((self.edge_index_dropt, self.edge_index_dropt[[1, 0]]), dim=1)
+        # normalized adjacency, built once since the graph is fixed from here on
+        graph_inputs = {'edges': edges_digest, 'num_nodes': num_user + num_item, 'normalization': 'sym'}
+        graph_key = self.artifact_cache.key('norm_adj', **graph_inputs)
+        graph = self.artifact_cache.load_csr(graph_key)
+        if graph is None:
+            self.graph = GraphOperator(self.edge_index, num_user + num_item)
+            self.artifact_cache.save_csr(graph_key, *self.graph.csr(), inputs=graph_inputs)
+        else:
+            self.graph = GraphOperator.from_csr(*graph, device=self.device)
 
         #简单的全连接层对用户-物品特征进行映射
         self.MLP_user = nn.Linear(self.dim_latent * 2, self.dim_latent)
@@ -176,30 +203,68 @@ class MENTOR(GeneralRecommender):
                                                 requires_grad=True), gain=1).to(self.device))
         self.id_gcn = GCN(self.dataset, batch_size, num_user, num_item, dim_x, self.aggr_mode,
                           dim_latent=64, device=self.device, features=self.id_feat)
-
+        # user preference tables of the views, registered here so that the state dict does not change on forward
+        if self.v_feat is not None:
+            self.v_preference = self.v_gcn.preference
+        if self.t_feat is not None:
+            self.t_preference = self.t_gcn.preference
+        self.id_preference = self.id_gcn.preference
+
+        # all views propagate over the same normalized user-item adjacency, so do it in one pass
+        self.propagation = MultiViewPropagation(self.graph, n_layers=2)
+        # sampled mode trains each batch on the computation graph of its users and items only, cluster mode each
+        # step on the subgraph induced by a few parts of a partition of the user-item graph
+        self.subgraph_sampler = None
+        self._subgraph = None
+        if self.train_mode == 'cluster':
+            n_parts = config['cluster_parts'] or 32
+            ui_csr = self.graph.csr()
+            # kept with the dataset, keyed by the training edges and the partitioning arguments
+            parts = load_partition(dataset_path, edges_digest[:12], ui_csr[0], ui_csr[1], n_parts, n_first=num_user)
+            edge_parts = parts[edge_index]
+            getLogger().info('cluster partition: {} parts of at most {} nodes, {:.2%} of the interactions inside a '
+                             'part'.format(n_parts, np.bincount(parts).max(),
+                                           np.mean(edge_parts[:, 0] == edge_parts[:, 1])))
+            self.subgraph_sampler = ClusterSampler(
+                ui_csr, sparse_to_csr(self.mm_adj), num_user, parts, edge_index - np.array([0, num_user]),
+                config['clusters_per_batch'] or 1, self.propagation.n_layers, self.n_layers)
+        if self.train_mode == 'sampled':
+            if len(self.sample_fanouts) != self.propagation.n_layers:
+                raise ValueError('sample_fanouts should have {} entries, one per propagation layer, got {}'.format(
+                    self.propagation.n_layers, self.sample_fanouts))
+            # a CUDA-initialized process may not be forked
+            self.subgraph_sampler = SubgraphSampler(self.graph.csr(), sparse_to_csr(self.mm_adj), num_user,
+                                                    self.sample_fanouts, self.n_layers,
+                                                    config['sample_workers'] or 0, config['sample_queue_depth'] or 4,
+                                                    'forkserver' if self.device.type == 'cuda' else 'fork')
+
+        # plain tensors until forward replaces them, on every device
         # 总的融合嵌入
-        self.result_embed = nn.Parameter(
-            nn.init.xavier_normal_(torch.tensor(np.random.randn(num_user + num_item, dim_x)))).to(self.device)
+        self.result_embed = nn.init.xavier_normal_(
+            torch.tensor(np.random.randn(num_user + num_item, dim_x))).to(self.device)
         # 模态引导的嵌入
-        self.result_embed_guide = nn.Parameter(
-            nn.init.xavier_normal_(torch.tensor(np.random.randn(num_user + num_item, dim_x)))).to(self.device)
+        self.result_embed_guide = nn.init.xavier_normal_(
+            torch.tensor(np.random.randn(num_user + num_item, dim_x))).to(self.device)
         # 单模态的嵌入
-        self.result_embed_v = nn.Parameter(
-            nn.init.xavier_normal_(torch.tensor(np.random.randn(num_user + num_item, dim_x)))).to(self.device)
-        self.result_embed_t = nn.Parameter(
-            nn.init.xavier_normal_(torch.tensor(np.random.randn(num_user + num_item, dim_x)))).to(self.device)
+        self.result_embed_v = nn.init.xavier_normal_(
+            torch.tensor(np.random.randn(num_user + num_item, dim_x))).to(self.device)
+        self.result_embed_t = nn.init.xavier_normal_(
+            torch.tensor(np.random.randn(num_user + num_item, dim_x))).to(self.device)
         # 多层的嵌入
-        self.result_embed_n1 = nn.Parameter(
-            nn.init.xavier_normal_(torch.tensor(np.random.randn(num_user + num_item, dim_x)))).to(self.device)
-        self.result_embed_n2 = nn.Parameter(
-            nn.init.xavier_normal_(torch.tensor(np.random.randn(num_user + num_item, dim_x)))).to(self.device)
+        self.result_embed_n1 = nn.init.xavier_normal_(
+            torch.tensor(np.random.randn(num_user + num_item, dim_x))).to(self.device)
+        self.result_embed_n2 = nn.init.xavier_normal_(
+            torch.tensor(np.random.randn(num_user + num_item, dim_x))).to(self.device)
 
     def get_knn_adj_mat(self, mm_embeddings):
-        context_norm = mm_embeddings.div(torch.norm(mm_embeddings, p=2, dim=-1, keepdim=True))
-        sim = torch.mm(context_norm, context_norm.transpose(1, 0))
-        _, knn_ind = torch.topk(sim, self.knn_k, dim=-1)
-        adj_size = sim.size()
-        del sim
+        # similarity is computed block by block, never as a full n_items x n_items matrix
+        knn_ind = knn_backends[self.knn_backend](mm_embeddings, self.knn_k, self.knn_memory_budget,
+                                                 self.knn_threads, **self.knn_backend_params)
+        if self.knn_backend != 'exact' and self.knn_recall_sample:
+            recall = knn_recall(mm_embeddings, knn_ind, self.knn_k, self.knn_recall_sample, self.knn_memory_budget)
+            getLogger().info('{} kNN graph: recall@{} {:.4f} against exact on {} sampled items'.format(
+                self.knn_backend, self.knn_k, recall, min(self.knn_recall_sample, mm_embeddings.shape[0])))
+        adj_size = torch.Size((mm_embeddings.shape[0], mm_embeddings.shape[0]))
         # construct sparse adj
         indices0 = torch.arange(knn_ind.shape[0]).to(self.device)
         indices0 = torch.unsqueeze(indices0, 1)
@@ -218,8 +283,53 @@ class MENTOR(GeneralRecommender):
         return torch.sparse.FloatTensor(indices, values, adj_size)
 
     def pre_epoch_processing(self):
-        self.epoch_user_graph, self.user_weight_matrix = self.topk_sample(self.k)
-        self.user_weight_matrix = self.user_weight_matrix.to(self.device)
+        # the epoch's user graph sample is drawn lazily, when epoch_user_graph / user_weight_matrix is read
+        self._epoch_user_graph = None
+
+    def train_batches(self, train_data):
+        if self.subgraph_sampler is None:
+            return train_data
+        return self._sampled_batches(train_data)
+
+    def close_train_batches(self):
+        if isinstance(self.subgraph_sampler, SubgraphSampler):
+            self.subgraph_sampler.close()
+
+    def _sampled_batches(self, train_data):
+        # forward reads the subgraph of the batch being yielded
+        try:
+            for interaction, subgraph in self.subgraph_sampler.prefetch(train_data):
+                self._subgraph = self.subgraph_to_device(subgraph)
+                yield interaction.to(self.device)
+        finally:
+            self._subgraph = None
+
+    def subgraph_to_device(self, subgraph):
+        r"""Tensors of a :meth:`SubgraphSampler.sample` result, its blocks as :class:`GraphOperator`."""
+        def to_blocks(blocks):
+            return [GraphOperator.from_csr(indptr, indices, values, self.device, size)
+                    for indptr, indices, values, size in blocks]
+
+        return {'nodes': torch.from_numpy(subgraph['nodes']).to(self.device), 'n_users': subgraph['n_users'],
+                'ui_blocks': to_blocks(subgraph['ui_blocks']), 'mm_blocks': to_blocks(subgraph['mm_blocks']),
+                'user_rows': torch.from_numpy(subgraph['user_rows']).to(self.device),
+                'item_rows': torch.from_numpy(subgraph['item_rows']).to(self.device)}
+
+    @property
+    def epoch_user_graph(self):
+        if self._epoch_user_graph is None:
+            self._sample_epoch_user_graph()
+        return self._epoch_user_graph[0]
+
+    @property
+    def user_weight_matrix(self):
+        if self._epoch_user_graph is None:
+            self._sample_epoch_user_graph()
+        return self._epoch_user_graph[1]
+
+    def _sample_epoch_user_graph(self):
+        user_graph_index, user_weight_matrix = self.topk_sample(self.k)
+        self._epoch_user_graph = (user_graph_index, user_weight_matrix.to(self.device))
 
     def pack_edge_index(self, inter_mat):
         rows = inter_mat.row
@@ -227,10 +337,13 @@ class MENTOR(GeneralRecommender):
         # ndarray([598918, 2]) for ml-imdb
         return np.column_stack((rows, cols))
 
-    def InfoNCE(self, view1, view2, temp):
+    def InfoNCE(self, view1, view2, temp, negatives=None):
         view1, view2 = F.normalize(view1, dim=1), F.normalize(view2, dim=1)
         pos_score = (view1 * view2).sum(dim=-1)
         pos_score = torch.exp(pos_score / temp)
+        if negatives is not None:
+            # extra negatives only enter the denominator
+            view2 = torch.cat((view2, F.normalize(negatives, dim=1)), dim=0)
         ttl_score = torch.matmul(view1, view2.transpose(0, 1))
         ttl_score = torch.exp(ttl_score / temp).sum(dim=1)
         cl_loss = -torch.log(pos_score / ttl_score)
@@ -243,17 +356,35 @@ class MENTOR(GeneralRecommender):
         pos_item_nodes += self.n_users
         neg_item_nodes += self.n_users
 
-        # GCN for id, v, t modalities
-        self.v_rep, self.v_preference = self.v_gcn(self.edge_index_dropv, self.edge_index, self.v_feat)
-        self.t_rep, self.t_preference = self.t_gcn(self.edge_index_dropt, self.edge_index, self.t_feat)
-        self.id_rep, self.id_preference = self.id_gcn(self.edge_index_dropt, self.edge_index, self.id_feat)
+        # on a sampled subgraph, the representations below only cover the targets of the subgraph
+        subgraph = self._subgraph if self.training else None
+        nodes = ui_blocks = mm_blocks = None
+        if subgraph is not None:
+            nodes, ui_blocks, mm_blocks = subgraph['nodes'], subgraph['ui_blocks'], subgraph['mm_blocks']
 
+        # GCN for id, v, t modalities
         # 引入的随机噪声进行扰动
         # random noise GCN for v and t
-        self.v_rep_n1, _ = self.v_gcn_n1(self.edge_index_dropv, self.edge_index, self.v_feat, perturbed=True)
-        self.t_rep_n1, _ = self.t_gcn_n1(self.edge_index_dropt, self.edge_index, self.t_feat, perturbed=True)
-        self.v_rep_n2, _ = self.v_gcn_n2(self.edge_index_dropv, self.edge_index, self.v_feat, perturbed=True)
-        self.t_rep_n2, _ = self.t_gcn_n2(self.edge_index_dropt, self.edge_index, self.t_feat, perturbed=True)
+        # the seven views are stacked column-wise and propagated together
+        views = [(self.v_gcn, self.v_feat, False), (self.t_gcn, self.t_feat, False),
+                 (self.id_gcn, self.id_feat, False),
+                 (self.v_gcn_n1, self.v_feat, True), (self.t_gcn_n1, self.t_feat, True),
+                 (self.v_gcn_n2, self.v_feat, True), (self.t_gcn_n2, self.t_feat, True)]
+        (self.v_rep, self.t_rep, self.id_rep,
+         self.v_rep_n1, self.t_rep_n1, self.v_rep_n2, self.t_rep_n2) = self.propagation(
+            [gcn.embed(features, nodes) for gcn, features, _ in views], [perturbed for _, _, perturbed in views],
+            ui_blocks)
+
+        # rows of the users and of the positive / negative items in the representations
+        if subgraph is None:
+            n_user_rows, weight_u = self.num_user, self.weight_u
+            user_rows, pos_rows, neg_rows = user_nodes, pos_item_nodes, neg_item_nodes
+        else:
+            n_user_rows = subgraph['n_users']
+            weight_u = self.weight_u[nodes[:n_user_rows]]
+            user_rows = subgraph['user_rows']
+            pos_rows, neg_rows = torch.split(subgraph['item_rows'] + n_user_rows, len(user_rows))
+        self.batch_rows = (user_rows, torch.cat((pos_rows, neg_rows)))
 
         # v, t, id, and vt modalities
         representation = torch.cat((self.v_rep, self.t_rep), dim=1)
@@ -271,8 +402,8 @@ class MENTOR(GeneralRecommender):
         self.id_rep = torch.unsqueeze(self.id_rep, 2)
 
         # 用户向量表示，使用权重weight_u进行调整
-        user_rep = torch.cat((self.v_rep[:self.num_user], self.t_rep[:self.num_user]), dim=2)
-        user_rep = self.weight_u.transpose(1, 2) * user_rep
+        user_rep = torch.cat((self.v_rep[:n_user_rows], self.t_rep[:n_user_rows]), dim=2)
+        user_rep = weight_u.transpose(1, 2) * user_rep
         user_rep = torch.cat((user_rep[:, :, 0], user_rep[:, :, 1]), dim=1)
 
         # # 新增1：多头注意力机制
@@ -298,63 +429,65 @@ class MENTOR(GeneralRecommender):
         # self.mm_adj = v_contribution.unsqueeze(1) * image_adj + t_contribution.unsqueeze(1) * text_adj
 
         # 引导用户向量表示
-        guide_user_rep = torch.cat((self.id_rep[:self.num_user], self.id_rep[:self.num_user]), dim=2)
-        guide_user_rep = self.weight_u.transpose(1, 2) * guide_user_rep
+        guide_user_rep = torch.cat((self.id_rep[:n_user_rows], self.id_rep[:n_user_rows]), dim=2)
+        guide_user_rep = weight_u.transpose(1, 2) * guide_user_rep
         guide_user_rep = torch.cat((guide_user_rep[:, :, 0], guide_user_rep[:, :, 1]), dim=1)
 
         # v用户向量表示
-        v_user_rep = torch.cat((self.v_rep[:self.num_user], self.v_rep[:self.num_user]), dim=2)
-        v_user_rep = self.weight_u.transpose(1, 2) * v_user_rep
+        v_user_rep = torch.cat((self.v_rep[:n_user_rows], self.v_rep[:n_user_rows]), dim=2)
+        v_user_rep = weight_u.transpose(1, 2) * v_user_rep
         v_user_rep = torch.cat((v_user_rep[:, :, 0], v_user_rep[:, :, 1]), dim=1)
 
         # t用户向量表示
-        t_user_rep = torch.cat((self.t_rep[:self.num_user], self.t_rep[:self.num_user]), dim=2)
-        t_user_rep = self.weight_u.transpose(1, 2) * t_user_rep
+        t_user_rep = torch.cat((self.t_rep[:n_user_rows], self.t_rep[:n_user_rows]), dim=2)
+        t_user_rep = weight_u.transpose(1, 2) * t_user_rep
         t_user_rep = torch.cat((t_user_rep[:, :, 0], t_user_rep[:, :, 1]), dim=1)
 
         # 噪声的用户向量表示
         # noise rep1
         self.v_rep_n1 = torch.unsqueeze(self.v_rep_n1, 2)
         self.t_rep_n1 = torch.unsqueeze(self.t_rep_n1, 2)
-        user_rep_n1 = torch.cat((self.v_rep_n1[:self.num_user], self.t_rep_n1[:self.num_user]), dim=2)
-        user_rep_n1 = self.weight_u.transpose(1, 2) * user_rep_n1
+        user_rep_n1 = torch.cat((self.v_rep_n1[:n_user_rows], self.t_rep_n1[:n_user_rows]), dim=2)
+        user_rep_n1 = weight_u.transpose(1, 2) * user_rep_n1
         user_rep_n1 = torch.cat((user_rep_n1[:, :, 0], user_rep_n1[:, :, 1]), dim=1)
 
         # noise rep2
         self.v_rep_n2 = torch.unsqueeze(self.v_rep_n2, 2)
         self.t_rep_n2 = torch.unsqueeze(self.t_rep_n2, 2)
-        user_rep_n2 = torch.cat((self.v_rep_n2[:self.num_user], self.t_rep_n2[:self.num_user]), dim=2)
-        user_rep_n2 = self.weight_u.transpose(1, 2) * user_rep_n2
+        user_rep_n2 = torch.cat((self.v_rep_n2[:n_user_rows], self.t_rep_n2[:n_user_rows]), dim=2)
+        user_rep_n2 = weight_u.transpose(1, 2) * user_rep_n2
         user_rep_n2 = torch.cat((user_rep_n2[:, :, 0], user_rep_n2[:, :, 1]), dim=1)
 
         # item 物品相关的表示
-        item_rep = representation[self.num_user:]
-        item_rep_n1 = representation_n1[self.num_user:]
-        item_rep_n2 = representation_n2[self.num_user:]
+        item_rep = representation[n_user_rows:]
+        item_rep_n1 = representation_n1[n_user_rows:]
+        item_rep_n2 = representation_n2[n_user_rows:]
 
 
         # 引导物品向量表示
-        guide_item_rep = guide_representation[self.num_user:]
-        v_item_rep = v_representation[self.num_user:]
-        t_item_rep = t_representation[self.num_user:]
+        guide_item_rep = guide_representation[n_user_rows:]
+        v_item_rep = v_representation[n_user_rows:]
+        t_item_rep = t_representation[n_user_rows:]
 
         # build item-item graph 项目项目图能够捕捉语义之间的联系
-        h = self.buildItemGraph(item_rep)
-        h_guide = self.buildItemGraph(guide_item_rep)
-        h_v = self.buildItemGraph(v_item_rep)
-        h_t = self.buildItemGraph(t_item_rep)
-        h_n1 = self.buildItemGraph(item_rep_n1)
-        h_n2 = self.buildItemGraph(item_rep_n2)
-
+        h = self.buildItemGraph(item_rep, mm_blocks)
+        h_guide = self.buildItemGraph(guide_item_rep, mm_blocks)
+        h_v = self.buildItemGraph(v_item_rep, mm_blocks)
+        h_t = self.buildItemGraph(t_item_rep, mm_blocks)
+        h_n1 = self.buildItemGraph(item_rep_n1, mm_blocks)
+        h_n2 = self.buildItemGraph(item_rep_n2, mm_blocks)
+
+        # the item graph keeps the rows of its targets, the batch items on a sampled subgraph
+        n_item_rows = h.shape[0]
         user_rep = user_rep
-        item_rep = item_rep + h
+        item_rep = item_rep[:n_item_rows] + h
 
-        item_rep_n1 = item_rep_n1 + h_n1
-        item_rep_n2 = item_rep_n2 + h_n2
+        item_rep_n1 = item_rep_n1[:n_item_rows] + h_n1
+        item_rep_n2 = item_rep_n2[:n_item_rows] + h_n2
 
-        guide_item_rep = guide_item_rep + h_guide
-        v_item_rep = v_item_rep + h_v
-        t_item_rep = t_item_rep + h_t
+        guide_item_rep = guide_item_rep[:n_item_rows] + h_guide
+        v_item_rep = v_item_rep[:n_item_rows] + h_v
+        t_item_rep = t_item_rep[:n_item_rows] + h_t
 
         # build result embedding
         self.user_rep = user_rep
@@ -382,16 +515,16 @@ class MENTOR(GeneralRecommender):
         self.result_embed_n2 = torch.cat((user_rep_n2, item_rep_n2), dim=0)
 
         # calculate pos and neg scores
-        user_tensor = self.result_embed[user_nodes]
-        pos_item_tensor = self.result_embed[pos_item_nodes]
-        neg_item_tensor = self.result_embed[neg_item_nodes]
+        user_tensor = self.result_embed[user_rows]
+        pos_item_tensor = self.result_embed[pos_rows]
+        neg_item_tensor = self.result_embed[neg_rows]
         pos_scores = torch.sum(user_tensor * pos_item_tensor, dim=1)
         neg_scores = torch.sum(user_tensor * neg_item_tensor, dim=1)
         return pos_scores, neg_scores
 
-    def buildItemGraph(self, h):
+    def buildItemGraph(self, h, blocks=None):
         for i in range(self.n_layers):
-            h = torch.sparse.mm(self.mm_adj, h)
+            h = torch.sparse.mm(self.mm_adj, h) if blocks is None else blocks[i] @ h
         return h
 
     def fit_Gaussian_dis(self):
@@ -406,9 +539,45 @@ class MENTOR(GeneralRecommender):
         t_mean = torch.mean(self.result_embed_t)
         return r_var, r_mean, g_var, g_mean, v_var, v_mean, t_var, t_mean
 
+    def chunked_InfoNCE(self, view1, view2, temp):
+        r"""Same loss and gradients as :meth:`InfoNCE`, with ``-log(exp(pos / temp) / sum(exp(...)))`` rewritten as
+        ``logsumexp - pos / temp`` and the logsumexp taken by :class:`ChunkedLogSumExp` over tiles of ``cl_tile``.
+        """
+        view1, view2 = F.normalize(view1, dim=1), F.normalize(view2, dim=1)
+        pos_score = (view1 * view2).sum(dim=-1) / temp
+        cl_loss = ChunkedLogSumExp.apply(view1, view2, temp, self.cl_tile) - pos_score
+        return torch.mean(cl_loss)
+
+    def batch_InfoNCE(self, nodes, offset, num):
+        r"""Graph-noise InfoNCE restricted to the unique ``nodes`` of a batch (rows of ``result_embed``), plus
+        ``cl_num_negatives`` random nodes of ``[offset, offset + num)`` as extra negatives.
+        """
+        nodes = torch.unique(nodes)
+        negatives = None
+        if self.cl_num_negatives:
+            negatives = torch.randint(num, (self.cl_num_negatives,), device=nodes.device) + offset
+            negatives = self.result_embed_n2[negatives]
+        return self.InfoNCE(self.result_embed_n1[nodes], self.result_embed_n2[nodes], self.temp, negatives)
+
+    def mask_rows(self, users, items):
+        r"""User and item rows of the mask-consistency loss, ``None`` for all rows.
+
+        ``full`` takes all rows, ``batch`` the unique users and positive/negative items of the batch and ``sample``
+        ``mask_sample_size`` random users and as many random items.
+        """
+        if self.mask_mode == 'batch':
+            return torch.unique(users), torch.unique(items)
+        if self.mask_mode == 'sample':
+            return (torch.randint(self.user_rep.shape[0], (self.mask_sample_size,), device=users.device),
+                    torch.randint(self.item_rep.shape[0], (self.mask_sample_size,), device=users.device))
+        return None, None
+
     def calculate_loss(self, interaction):
         user = interaction[0]
         pos_scores, neg_scores = self.forward(interaction)
+        # rows of the batch in the result tables, which only hold the batch nodes on a sampled subgraph
+        user_rows, item_rows = self.batch_rows
+        n_user_rows = self.user_rep.shape[0]
 
         # BPR loss 贝叶斯个性化排名损失，利用正负样本的计算
         loss_value = -torch.mean(torch.log2(torch.sigmoid(pos_scores - neg_scores)))
@@ -423,14 +592,12 @@ class MENTOR(GeneralRecommender):
         # 掩码一致性损失，超参数mask_weight_f的调整
         # mask
         with torch.no_grad():
-            u_temp, i_temp = self.user_rep.clone(), self.item_rep.clone()
-            u_temp2, i_temp2 = self.user_rep.clone(), self.item_rep.clone()
-            u_temp.detach()
-            i_temp.detach()
-            u_temp2.detach()
-            i_temp2.detach()
-            u_temp2 = self.mlp(u_temp2)
-            i_temp2 = self.mlp(i_temp2)
+            # dropout and mlp already return new tensors, the rows need no clone
+            u_rows, i_rows = self.mask_rows(user_rows, item_rows - n_user_rows)
+            u_temp = self.user_rep if u_rows is None else self.user_rep[u_rows]
+            i_temp = self.item_rep if i_rows is None else self.item_rep[i_rows]
+            u_temp2 = self.mlp(u_temp)
+            i_temp2 = self.mlp(i_temp)
             u_temp = F.dropout(u_temp, self.dropout)
             i_temp = F.dropout(i_temp, self.dropout)
         mask_loss_u = 1 - F.cosine_similarity(u_temp, u_temp2).mean()
@@ -495,59 +662,146 @@ class MENTOR(GeneralRecommender):
 
         # 图噪音cl 图扰动的噪声损失，超参数mask_weight_g的调整
         # inspired by SimGCL
-        mask_g_loss = (self.InfoNCE(self.result_embed_n1[:self.n_users], self.result_embed_n2[:self.n_users], self.temp)
-                       + self.InfoNCE(self.result_embed_n1[self.n_users:], self.result_embed_n2[self.n_users:], self.temp))
+        if self.cl_mode == 'batch':
+            mask_g_loss = (self.batch_InfoNCE(user_rows, 0, n_user_rows)
+                           + self.batch_InfoNCE(item_rows, n_user_rows, self.item_rep.shape[0]))
+        else:
+            info_nce = self.chunked_InfoNCE if self.cl_mode == 'chunked' else self.InfoNCE
+            mask_g_loss = (info_nce(self.result_embed_n1[:n_user_rows], self.result_embed_n2[:n_user_rows], self.temp)
+                           + info_nce(self.result_embed_n1[n_user_rows:], self.result_embed_n2[n_user_rows:], self.temp))
 
         mask_g_loss = mask_g_loss * self.mask_weight_g
 
         # loss_value 是BPR损失，reg_loss是正则化损失，align_loss是对齐损失，mask_f_loss是掩码损失，mask_g_loss是图噪音cl损失，
         return loss_value + reg_loss + align_loss + mask_f_loss + mask_g_loss
 
-    def full_sort_predict(self, interaction):
-        user_tensor = self.result_embed[:self.n_users]
-        item_tensor = self.result_embed[self.n_users:]
+    @torch.no_grad()
+    def inference(self):
+        r"""Fused user / item representations that rank items, as in :meth:`forward` but without the guide,
+        single-modality and noise views, which do not affect ranking.
+
+        The result is cached, so that validation and test of one epoch share a single pass, and dropped by
+        :meth:`train`, :meth:`post_step_processing`, ``load_state_dict`` and device moves.
+
+        Returns:
+            tuple: ``(user_rep, item_rep)``
+        """
+        if self._inference_cache is None:
+            v_rep, t_rep = self.propagation([self.v_gcn.embed(self.v_feat), self.t_gcn.embed(self.t_feat)],
+                                            [False, False])
+            user_rep = torch.cat((v_rep[:self.num_user].unsqueeze(2), t_rep[:self.num_user].unsqueeze(2)), dim=2)
+            user_rep = self.weight_u.transpose(1, 2) * user_rep
+            user_rep = torch.cat((user_rep[:, :, 0], user_rep[:, :, 1]), dim=1)
+            item_rep = torch.cat((v_rep, t_rep), dim=1)[self.num_user:]
+            item_rep = item_rep + self.buildItemGraph(item_rep)
+            self._inference_cache = (user_rep, item_rep)
+        return self._inference_cache
+
+    def train(self, mode=True):
+        if mode:
+            self._inference_cache = None
+        return super().train(mode)
+
+    def post_step_processing(self):
+        self._inference_cache = None
+
+    def load_state_dict(self, state_dict, strict=True):
+        self._inference_cache = None
+        return super().load_state_dict(state_dict, strict)
+
+    def _apply(self, fn, *args, **kwargs):
+        self._inference_cache = None
+        return super()._apply(fn, *args, **kwargs)
+
+    def full_sort_factors(self, interaction):
+        r"""Representations of the batch users and of all items, whose dot products are :meth:`full_sort_predict`."""
+        user_tensor, item_tensor = self.inference()
+        return user_tensor[interaction[0], :], item_tensor
 
-        temp_user_tensor = user_tensor[interaction[0], :]
+    def full_sort_predict(self, interaction):
+        temp_user_tensor, item_tensor = self.full_sort_factors(interaction)
         score_matrix = torch.matmul(temp_user_tensor, item_tensor.t())
         return score_matrix
 
+    def get_user_graph_table(self, k):
+        r"""Deterministic part of :meth:`topk_sample`, computed once per ``k``.
+
+        Returns:
+            tuple: ``(num, index, numer, weight)``: the number of real neighbors of each user (at most ``k``),
+            the ``num_user x k`` neighbor table padded with 0, the softmax numerators of the neighbor weights
+            (0 on padding) and the softmax weights, exact for users with at least ``k`` neighbors.
+        """
+        if self._user_graph_table is None or self._user_graph_table[0] != k:
+            indptr = np.asarray(self.user_graph_indptr)
+            num = np.minimum(np.diff(indptr), k)
+            valid = np.arange(k) < num[:, None]
+            pos = np.where(valid, indptr[:-1, None] + np.arange(k), 0)
+            index = np.where(valid, self.user_graph_indices[pos], 0).astype(np.int64)
+            valid = torch.from_numpy(valid)
+            weight = torch.from_numpy(self.user_graph_weights[pos].astype(np.float32)).masked_fill(~valid, -np.inf)
+            row_max = weight.max(dim=1, keepdim=True)[0]
+            row_max = row_max.masked_fill(torch.isinf(row_max), 0)  # users without neighbors
+            numer = torch.exp(weight - row_max)
+            denom = numer.sum(dim=1, keepdim=True)
+            weight = torch.where(denom > 0, numer / denom, torch.zeros_like(numer))
+            self._user_graph_table = (k, (num, index, numer, weight))
+        return self._user_graph_table[1]
+
     def topk_sample(self, k):
-        user_graph_index = []
-        count_num = 0
-        user_weight_matrix = torch.zeros(len(self.user_graph_dict), k)
-        tasike = []
-        for i in range(k):
-            tasike.append(0)
-        for i in range(len(self.user_graph_dict)):
-            if len(self.user_graph_dict[i][0]) < k:
-                count_num += 1
-                if len(self.user_graph_dict[i][0]) == 0:
-                    # pdb.set_trace()
-                    user_graph_index.append(tasike)
-                    continue
-                user_graph_sample = self.user_graph_dict[i][0][:k]
-                user_graph_weight = self.user_graph_dict[i][1][:k]
-                while len(user_graph_sample) < k:
-                    rand_index = np.random.randint(0, len(user_graph_sample))
-                    user_graph_sample.append(user_graph_sample[rand_index])
-                    user_graph_weight.append(user_graph_weight[rand_index])
-                user_graph_index.append(user_graph_sample)
-
-                user_weight_matrix[i] = F.softmax(torch.tensor(user_graph_weight), dim=0)  # softmax
-                continue
-            user_graph_sample = self.user_graph_dict[i][0][:k]
-            user_graph_weight = self.user_graph_dict[i][1][:k]
-
-            user_weight_matrix[i] = F.softmax(torch.tensor(user_graph_weight), dim=0)  # softmax
-            user_graph_index.append(user_graph_sample)
+        num, index, numer, weight = self.get_user_graph_table(k)
+        user_graph_index, user_weight_matrix = index.copy(), weight.clone()
+        # short neighbor lists are padded with random repeats, redrawn on every call
+        short = np.flatnonzero((num > 0) & (num < k))
+        if len(short):
+            cols = np.arange(k)
+            pad = (np.random.rand(len(short), k) * num[short, None]).astype(np.int64)
+            pick = np.where(cols < num[short, None], cols, pad)
+            user_graph_index[short] = index[short[:, None], pick]
+            short_numer = numer[torch.from_numpy(short[:, None]), torch.from_numpy(pick)]
+            user_weight_matrix[torch.from_numpy(short)] = short_numer / short_numer.sum(dim=1, keepdim=True)  # softmax
 
-        # pdb.set_trace()
         return user_graph_index, user_weight_matrix
 
     def print_embd(self):
         return self.result_embed_v, self.result_embed_t
 
 
+class ChunkedLogSumExp(torch.autograd.Function):
+    r"""``logsumexp(view1 @ view2.T / temp, dim=1)`` without materializing the ``N x M`` logits.
+
+    The forward pass streams ``view2`` in tiles of ``tile`` rows and keeps a running max and rescaled sum per row.
+    The backward pass recomputes each tile's softmax from the saved logsumexp, so memory stays ``O(N * tile)``.
+    """
+    @staticmethod
+    def forward(ctx, view1, view2, temp, tile):
+        row_max = torch.full((view1.shape[0],), -np.inf, dtype=view1.dtype, device=view1.device)
+        row_sum = torch.zeros_like(row_max)
+        for start in range(0, view2.shape[0], tile):
+            logits = torch.matmul(view1, view2[start: start + tile].transpose(0, 1)) / temp
+            new_max = torch.maximum(row_max, logits.max(dim=1)[0])
+            row_sum = row_sum * torch.exp(row_max - new_max) + torch.exp(logits - new_max.unsqueeze(1)).sum(dim=1)
+            row_max = new_max
+        lse = row_max + torch.log(row_sum)
+        ctx.save_for_backward(view1, view2, lse)
+        ctx.temp, ctx.tile = temp, tile
+        return lse
+
+    @staticmethod
+    def backward(ctx, grad_lse):
+        view1, view2, lse = ctx.saved_tensors
+        temp, tile = ctx.temp, ctx.tile
+        grad_view1 = torch.zeros_like(view1)
+        grad_view2 = torch.empty_like(view2)
+        # d lse_i / d logit_ij = softmax_ij, weighted by the incoming gradient of row i
+        scale = (grad_lse / temp).unsqueeze(1)
+        for start in range(0, view2.shape[0], tile):
+            block = view2[start: start + tile]
+            prob = torch.exp(torch.matmul(view1, block.transpose(0, 1)) / temp - lse.unsqueeze(1)) * scale
+            grad_view1 += torch.matmul(prob, block)
+            grad_view2[start: start + tile] = torch.matmul(prob.transpose(0, 1), view1)
+        return grad_view1, grad_view2, None, None
+
+
 class GCN(torch.nn.Module):
     def __init__(self, datasets, batch_size, num_user, num_item, dim_id, aggr_mode,
                  dim_latent=None, device=None, features=None):
@@ -568,66 +822,107 @@ class GCN(torch.nn.Module):
                 gain=1).to(self.device))
             self.MLP = nn.Linear(self.dim_feat, 4 * self.dim_latent)
             self.MLP_1 = nn.Linear(4 * self.dim_latent, self.dim_latent)
-            self.conv_embed_1 = Base_gcn(self.dim_latent, self.dim_latent, aggr=self.aggr_mode)
-
-
         else:
             self.preference = nn.Parameter(nn.init.xavier_normal_(torch.tensor(
                 np.random.randn(num_user, self.dim_feat), dtype=torch.float32, requires_grad=True),
                 gain=1).to(self.device))
-            self.conv_embed_1 = Base_gcn(self.dim_latent, self.dim_latent, aggr=self.aggr_mode)
 
-    def forward(self, edge_index_drop, edge_index, features, perturbed=False):
+    def embed(self, features, nodes=None):
+        if nodes is not None:
+            # rows of the given user / item (offset by num_user) nodes only, in their order
+            order = torch.argsort((nodes >= self.num_user).to(torch.int8), stable=True)
+            n_users = int((nodes < self.num_user).sum())
+            features = features[nodes[order[n_users:]] - self.num_user]
+            temp_features = self.MLP_1(F.leaky_relu(self.MLP(features))) if self.dim_latent else features
+            x = torch.cat((self.preference[nodes[order[:n_users]]], temp_features), dim=0)[torch.argsort(order)]
+            return F.normalize(x)
         temp_features = self.MLP_1(F.leaky_relu(self.MLP(features))) if self.dim_latent else features
         x = torch.cat((self.preference, temp_features), dim=0).to(self.device)
-        x = F.normalize(x).to(self.device)
-
-        h = self.conv_embed_1(x, edge_index)
-
-        if perturbed:
-            random_noise = torch.rand_like(h).cuda()
-            h += torch.sign(h) * F.normalize(random_noise, dim=-1) * 0.1
-        h_1 = self.conv_embed_1(h, edge_index)
-
-        if perturbed:
-            random_noise = torch.rand_like(h).cuda()
-            h_1 += torch.sign(h_1) * F.normalize(random_noise, dim=-1) * 0.1
-        # h_2 = self.conv_embed_1(h_1, edge_index)
-
-        x_hat = x + h + h_1
-        return x_hat, self.preference
-
-
-class Base_gcn(MessagePassing):
-    def __init__(self, in_channels, out_channels, normalize=True, bias=True, aggr='add', **kwargs):
-        super(Base_gcn, self).__init__(aggr=aggr, **kwargs)
-        self.aggr = aggr
-        self.in_channels = in_channels
-        self.out_channels = out_channels
-
-    def forward(self, x, edge_index, size=None):
-        # pdb.set_trace()
-        if size is None:
-            edge_index, _ = remove_self_loops(edge_index)
-            # edge_index, _ = add_self_loops(edge_index, num_nodes=x.size(0))
-        x = x.unsqueeze(-1) if x.dim() == 1 else x
-        # pdb.set_trace()
-        return self.propagate(edge_index, size=(x.size(0), x.size(0)), x=x)
-
-    def message(self, x_j, edge_index, size):
-        if self.aggr == 'add':
-            # pdb.set_trace()
-            row, col = edge_index
-            deg = degree(row, size[0], dtype=x_j.dtype)
-            deg_inv_sqrt = deg.pow(-0.5)
-            norm = deg_inv_sqrt[row] * deg_inv_sqrt[col]
-            return norm.view(-1, 1) * x_j
-        return x_j
-
-    def update(self, aggr_out):
-        return aggr_out
-
-    def __repr(self):
-        return '{}({},{})'.format(self.__class__.__name__, self.in_channels, self.out_channels)
+        return F.normalize(x).to(self.device)
+
+
+class GraphOperator(object):
+    r"""Self-loop-free, symmetrically normalized adjacency of a fixed edge set, stored as a CSR tensor.
+
+    Its weights are ``deg^-1/2[row] * deg^-1/2[col]``, so ``graph @ x`` is one propagation of a LightGCN-style
+    layer over ``edge_index``.
+    """
+    def __init__(self, edge_index, num_nodes):
+        self.num_nodes = num_nodes
+        edge_index, _ = remove_self_loops(edge_index)
+        row, col = edge_index
+        deg = degree(row, num_nodes, dtype=torch.float32)
+        deg_inv_sqrt = deg.pow(-0.5)
+        norm = deg_inv_sqrt[row] * deg_inv_sqrt[col]
+        # messages flow from edge_index[0] to edge_index[1]
+        adj = torch.sparse_coo_tensor(torch.stack((col, row)), norm, (num_nodes, num_nodes)).coalesce()
+        self.adj = adj.to_sparse_csr()
+        self.values = self.adj.values()
+
+    @classmethod
+    def from_csr(cls, indptr, indices, values, device=None, size=None):
+        r"""Rebuild the operator from the arrays of :meth:`csr`, or wrap a ``size`` block of sampled rows of it.
+
+        On CPU the tensor shares the memory of ``indices`` and ``values``, e.g. memory-mapped arrays of the
+        artifact cache; only ``indptr``, one entry per row, is cast to the dtype of ``indices``.
+        """
+        graph = cls.__new__(cls)
+        graph.num_nodes = len(indptr) - 1
+        index_dtype = np.int32 if np.asarray(indices).dtype == np.int32 and len(indices) < 2 ** 31 else np.int64
+        graph.adj = torch.sparse_csr_tensor(torch.from_numpy(np.asarray(indptr, dtype=index_dtype)),
+                                            torch.from_numpy(np.asarray(indices, dtype=index_dtype)),
+                                            torch.from_numpy(np.asarray(values)),
+                                            size or (graph.num_nodes, graph.num_nodes)).to(device)
+        graph.values = graph.adj.values()
+        return graph
+
+    def csr(self):
+        r"""``(indptr, indices, values)`` numpy arrays of the adjacency."""
+        return (self.adj.crow_indices().cpu().numpy(), self.adj.col_indices().cpu().numpy(),
+                self.values.cpu().numpy())
+
+    def __matmul__(self, x):
+        return torch.sparse.mm(self.adj, x)
+
+    def to(self, device):
+        self.adj = self.adj.to(device)
+        self.values = self.adj.values()
+        return self
+
+
+class MultiViewPropagation(object):
+    r"""Propagates several GCN views over one shared normalized adjacency.
+
+    The views are stacked column-wise so that every layer is a single CSR product instead of one
+    message-passing pass per view. The noise of perturbed views is added per view after each layer.
+    :meth:`GCN.embed` gives the input rows of a view.
+    """
+    def __init__(self, graph, n_layers=2, eps=0.1):
+        self.graph = graph
+        self.n_layers = n_layers
+        self.eps = eps
+
+    def perturb(self, h, widths, perturbed):
+        blocks = list(torch.split(h, widths, dim=1))
+        for i, flag in enumerate(perturbed):
+            if flag:
+                random_noise = torch.rand_like(blocks[i])
+                blocks[i] = blocks[i] + torch.sign(blocks[i]) * F.normalize(random_noise, dim=-1) * self.eps
+        return torch.cat(blocks, dim=1)
+
+    def __call__(self, xs, perturbed, blocks=None):
+        r"""Propagate over the whole graph, or over the sampled ``blocks`` of a subgraph, outermost first, whose
+        targets are the leading rows of ``xs`` and of every block's input."""
+        widths = [x.size(1) for x in xs]
+        x = torch.cat(xs, dim=1)
+        layers = [self.graph] * self.n_layers if blocks is None else blocks
+        n_out = x.shape[0] if blocks is None else blocks[-1].adj.shape[0]
+        x_hat, h = x[:n_out], x
+        for graph in layers:
+            h = graph @ h
+            if any(perturbed):
+                h = self.perturb(h, widths, perturbed)
+            x_hat = x_hat + h[:n_out]
+        return torch.split(x_hat, widths, dim=1)
 
 
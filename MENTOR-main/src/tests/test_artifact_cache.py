@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+import numpy as np
+import torch
+from utils_package.artifact_cache import ArtifactCache, file_digest, sparse_to_csr, csr_to_sparse
+from utils_package.user_graph import save_user_graph, read_train_edges, inter_matrix, build_user_graph
+from tests.toy import write_toy_dataset, build_mentor
+
+
+def random_csr(n=50, nnz=300, seed=0):
+    rng = np.random.RandomState(seed)
+    adj = torch.sparse_coo_tensor(torch.from_numpy(rng.randint(n, size=(2, nnz))),
+                                  torch.from_numpy(rng.rand(nnz).astype(np.float32)), (n, n))
+    return sparse_to_csr(adj)
+
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_hit_equals_miss(self):
+        cache = ArtifactCache(self.path)
+        key = cache.key('graph', source='abc', k=10)
+        self.assertIsNone(cache.load_csr(key))
+        csr = random_csr()
+        cache.save_csr(key, *csr, inputs={'source': 'abc', 'k': 10})
+        loaded = cache.load_csr(key)
+        for array, cached in zip(csr, loaded):
+            np.testing.assert_array_equal(cached, array)
+        self.assertEqual((loaded[0].dtype, loaded[1].dtype, loaded[2].dtype), (np.int64, np.int32, np.float32))
+        # the sparse tensor rebuilt from the cache is the one the arrays came from
+        self.assertTrue(torch.equal(csr_to_sparse(*loaded).to_dense(), csr_to_sparse(*csr).to_dense()))
+
+    def test_key_covers_inputs(self):
+        cache = ArtifactCache(self.path)
+        self.assertEqual(cache.key('graph', a=1, b=2), cache.key('graph', b=2, a=1))
+        self.assertNotEqual(cache.key('graph', a=1, b=2), cache.key('graph', a=1, b=3))
+        self.assertNotEqual(cache.key('graph', a=1), cache.key('other', a=1))
+
+    def test_eviction(self):
+        csr = random_csr(n=2000, nnz=100000)
+        cache = ArtifactCache(self.path)
+        keys = [cache.key('graph', i=i) for i in range(3)]
+        cache.save_csr(keys[0], *csr)
+        entry = cache.path(keys[0])
+        entry_size = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry)) / 2 ** 20
+        # room for two entries
+        cache.max_size = 2.5 * entry_size
+        time.sleep(0.01)
+        cache.save_csr(keys[1], *csr)
+        self.assertEqual(len(os.listdir(self.path)), 2)
+        # reading the first entry makes the second the least recently used
+        time.sleep(0.01)
+        cache.load_csr(keys[0])
+        time.sleep(0.01)
+        cache.save_csr(keys[2], *csr)
+        self.assertEqual(sorted(os.listdir(self.path)), sorted([keys[0], keys[2]]))
+
+
+class UserGraphCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+        self.dataset_path = os.path.join(self.path, 'toy')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_rebuilt_and_reused(self):
+        model, _ = build_mentor(self.path)
+        edges, n_users, n_items = read_train_edges(os.path.join(self.dataset_path, 'toy.inter'), 'userID', 'itemID')
+        for array, built in zip((model.user_graph_indptr, model.user_graph_indices, model.user_graph_weights),
+                                build_user_graph(inter_matrix(edges, n_users, n_items), 200)):
+            np.testing.assert_array_equal(array, built)
+        # a second model hits the cache for every derived graph
+        entries = sorted(os.listdir(os.path.join(self.path, 'artifacts')))
+        cached, _ = build_mentor(self.path)
+        self.assertEqual(sorted(os.listdir(os.path.join(self.path, 'artifacts'))), entries)
+        np.testing.assert_array_equal(cached.user_graph_indices, model.user_graph_indices)
+        self.assertTrue(torch.equal(cached.mm_adj.to_dense(), model.mm_adj.to_dense()))
+
+    def test_user_graph_file_needs_matching_inputs(self):
+        edges, n_users, n_items = read_train_edges(os.path.join(self.dataset_path, 'toy.inter'), 'userID', 'itemID')
+        indptr, indices, weights = build_user_graph(inter_matrix(edges, n_users, n_items), 200)
+        # a graph with every weight doubled tells whether the file or a rebuild was used
+        user_graph_file = os.path.join(self.dataset_path, 'user_graph_csr')
+        save_user_graph(user_graph_file, indptr, indices, 2 * weights, inputs={'interactions': 'other', 'topk': 200})
+        model, _ = build_mentor(self.path)
+        np.testing.assert_array_equal(model.user_graph_weights, weights)
+
+        shutil.rmtree(os.path.join(self.path, 'artifacts'))
+        inputs = {'interactions': file_digest(os.path.join(self.dataset_path, 'toy.inter')), 'topk': 200}
+        save_user_graph(user_graph_file, indptr, indices, 2 * weights, inputs=inputs)
+        model, _ = build_mentor(self.path)
+        np.testing.assert_array_equal(model.user_graph_weights, 2 * weights)
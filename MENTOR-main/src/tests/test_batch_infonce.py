@@ -0,0 +1,75 @@
+import shutil
+import tempfile
+import unittest
+from functools import partial
+from types import SimpleNamespace
+import torch
+import torch.nn.functional as F
+from models.mentor import MENTOR
+from tests.toy import write_toy_dataset, build_mentor
+
+
+def loop_infonce(view1, view2, temp, negatives):
+    # per-row reference, the positive of a row is its own row of view2
+    view1, view2, negatives = F.normalize(view1, dim=1), F.normalize(view2, dim=1), F.normalize(negatives, dim=1)
+    losses = []
+    for row in range(view1.shape[0]):
+        denominator = torch.exp(view2 @ view1[row] / temp).sum() + torch.exp(negatives @ view1[row] / temp).sum()
+        losses.append(-torch.log(torch.exp(view1[row] @ view2[row] / temp) / denominator))
+    return torch.stack(losses).mean()
+
+
+class BatchInfoNCETest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        # 10 user rows followed by 15 item rows, as in result_embed
+        self.model = SimpleNamespace(result_embed_n1=torch.randn(25, 8), result_embed_n2=torch.randn(25, 8),
+                                     temp=0.2, cl_num_negatives=0)
+        self.model.InfoNCE = partial(MENTOR.InfoNCE, None)
+
+    def test_unique_nodes(self):
+        model = self.model
+        nodes = torch.tensor([3, 1, 3, 7, 1])
+        rows = torch.tensor([1, 3, 7])
+        torch.testing.assert_close(MENTOR.batch_InfoNCE(model, nodes, 0, 10),
+                                   MENTOR.InfoNCE(None, model.result_embed_n1[rows], model.result_embed_n2[rows], 0.2))
+        # a batch covering every item is the full item loss
+        items = torch.randperm(15).repeat(2) + 10
+        torch.testing.assert_close(MENTOR.batch_InfoNCE(model, items, 10, 15),
+                                   MENTOR.InfoNCE(None, model.result_embed_n1[10:], model.result_embed_n2[10:], 0.2))
+
+    def test_negatives(self):
+        model = self.model
+        model.cl_num_negatives = 6
+        nodes = torch.tensor([12, 20, 12, 14])
+        torch.manual_seed(1)
+        loss = MENTOR.batch_InfoNCE(model, nodes, 10, 15)
+        # the same draw, negatives are item rows only
+        torch.manual_seed(1)
+        negatives = torch.randint(15, (6,)) + 10
+        rows = torch.tensor([12, 14, 20])
+        torch.testing.assert_close(loss, loop_infonce(model.result_embed_n1[rows], model.result_embed_n2[rows], 0.2,
+                                                      model.result_embed_n2[negatives]))
+
+
+class BatchModeTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_loss_and_gradients(self):
+        model, train_data = build_mentor(self.path, cl_mode='batch', cl_num_negatives=8, train_batch_size=16)
+        model.train()
+        loss = model.calculate_loss(next(iter(train_data)).clone())
+        loss.backward()
+        self.assertTrue(torch.isfinite(loss))
+        for name, param in model.named_parameters():
+            if param.grad is not None:
+                self.assertTrue(torch.isfinite(param.grad).all(), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import tempfile
+import unittest
+import torch
+from common.checkpoint import checkpoint_file, AsyncCheckpointWriter
+from utils_package.dataset import RecDataset
+from utils_package.dataloader import TrainDataLoader, EvalDataLoader
+from utils_package.utils import init_seed, get_model, get_trainer
+from tests.toy import write_toy_dataset, toy_config
+
+
+class Interrupt(Exception):
+    pass
+
+
+class InterruptAt(object):
+    # stands in for a sweep trial, consulted after every evaluation
+    def __init__(self, epoch_idx):
+        self.epoch_idx = epoch_idx
+
+    def should_stop(self, epoch_idx, best_score):
+        if epoch_idx == self.epoch_idx:
+            raise Interrupt()
+        return False
+
+
+def build_trainer(path, **config_dict):
+    config = toy_config(path, epochs=4, eval_step=1, stopping_step=100, topk=[5, 10], save_recommended_topk=False,
+                        **config_dict)
+    train_dataset, valid_dataset, test_dataset = RecDataset(config).split()
+    train_data = TrainDataLoader(config, train_dataset, batch_size=config['train_batch_size'], shuffle=True)
+    valid_data, test_data = (EvalDataLoader(config, dataset, additional_dataset=train_dataset, batch_size=64)
+                             for dataset in (valid_dataset, test_dataset))
+    init_seed(config['seed'])
+    train_data.pretrain_setup()
+    trainer = get_trainer()(config, get_model('MENTOR')(config, train_data))
+    return trainer, (train_data, valid_data, test_data)
+
+
+class CheckpointFileTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_key(self):
+        config = toy_config(self.path)
+        hyper_tuple = tuple(config[k] for k in config['hyper_parameters'])
+        latest = checkpoint_file(config, hyper_tuple)
+        self.assertNotEqual(checkpoint_file(config, hyper_tuple, 'best'), latest)
+        # run-only keys leave the checkpoint where resume looks for it
+        for key, value in (('resume', True), ('warm_start', True), ('checkpoint_step', 5), ('sweep_workers', 4)):
+            self.assertEqual(checkpoint_file(toy_config(self.path, **{key: value}), hyper_tuple), latest)
+        self.assertNotEqual(checkpoint_file(toy_config(self.path, knn_k=5), hyper_tuple), latest)
+        self.assertNotEqual(checkpoint_file(config, (0.5,) + hyper_tuple[1:]), latest)
+
+    def test_writer_keeps_newest(self):
+        writer = AsyncCheckpointWriter()
+        target = os.path.join(self.path, 'saved', 'state.pth')
+        for step in range(20):
+            writer.submit(target, {'step': step})
+        writer.close()
+        self.assertEqual(torch.load(target)['step'], 19)
+
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_round_trip(self):
+        trainer, loaders = build_trainer(self.path, checkpoint_dir=os.path.join(self.path, 'straight'),
+                                         checkpoint_step=1)
+        trainer.fit(*loaders, saved=True)
+        expected_state, expected_losses = trainer.model.state_dict(), trainer.train_loss_dict
+
+        checkpoint_dir = os.path.join(self.path, 'interrupted')
+        trainer, loaders = build_trainer(self.path, checkpoint_dir=checkpoint_dir, checkpoint_step=1)
+        trainer.sweep_trial = InterruptAt(2)
+        with self.assertRaises(Interrupt):
+            trainer.fit(*loaders, saved=True)
+        # a fresh process resumes after the last checkpoint, epoch 1, and trains epochs 2 and 3 again
+        trainer, loaders = build_trainer(self.path, checkpoint_dir=checkpoint_dir, checkpoint_step=1, resume=True)
+        trainer.fit(*loaders, saved=True)
+        self.assertEqual(trainer.start_epoch, 2)
+        self.assertEqual(trainer.train_loss_dict, expected_losses)
+        for name, tensor in trainer.model.state_dict().items():
+            self.assertTrue(torch.equal(tensor, expected_state[name]), name)
+
+        # a finished combination is not trained again
+        trainer, loaders = build_trainer(self.path, checkpoint_dir=checkpoint_dir, checkpoint_step=1, resume=True)
+        trainer.fit(*loaders, saved=True)
+        self.assertEqual(trainer.train_loss_dict, expected_losses)
+
+    def test_warm_start_writes_best(self):
+        trainer, loaders = build_trainer(self.path, warm_start=True)
+        trainer.fit(*loaders, saved=True)
+        self.assertTrue(os.path.isfile(trainer.best_checkpoint_file))
+        self.assertFalse(os.path.isfile(trainer.checkpoint_file))
+        # a combination with another embedding size starts from the tensors that still fit
+        other, _ = build_trainer(self.path, warm_start=True, embedding_size=32)
+        fresh = {name: tensor.clone() for name, tensor in other.model.state_dict().items()}
+        other.warm_start(trainer.best_checkpoint_file)
+        weights = torch.load(trainer.best_checkpoint_file)['model']
+        n_loaded = 0
+        for name, tensor in other.model.state_dict().items():
+            loaded = weights[name].shape == tensor.shape
+            self.assertTrue(torch.equal(tensor, weights[name] if loaded else fresh[name]), name)
+            n_loaded += loaded
+        self.assertTrue(0 < n_loaded < len(fresh))
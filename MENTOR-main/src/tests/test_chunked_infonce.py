@@ -0,0 +1,32 @@
+import unittest
+from types import SimpleNamespace
+import torch
+from models.mentor import MENTOR, ChunkedLogSumExp
+
+
+class ChunkedInfoNCETest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+
+    def test_gradcheck(self):
+        view1 = torch.randn(7, 5, dtype=torch.float64, requires_grad=True)
+        view2 = torch.randn(7, 5, dtype=torch.float64, requires_grad=True)
+        for tile in (1, 3, 7, 16):
+            self.assertTrue(torch.autograd.gradcheck(
+                lambda v1, v2: ChunkedLogSumExp.apply(v1, v2, 0.2, tile), (view1, view2)))
+
+    def test_matches_infonce(self):
+        n = 12
+        for tile in (3, 4, 5, 12, 64):     # dividing n, not dividing n, one tile, larger than n
+            leaves = [torch.randn(n, 8, requires_grad=True) for _ in range(2)]
+            full = MENTOR.InfoNCE(None, *leaves, 0.2)
+            full_grads = torch.autograd.grad(full, leaves)
+            chunked = MENTOR.chunked_InfoNCE(SimpleNamespace(cl_tile=tile), *leaves, 0.2)
+            chunked_grads = torch.autograd.grad(chunked, leaves)
+            torch.testing.assert_close(chunked, full)
+            for grad, full_grad in zip(chunked_grads, full_grads):
+                torch.testing.assert_close(grad, full_grad)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+from utils_package.dataset import RecDataset
+from utils_package.dataloader import TrainDataLoader
+from tests.toy import write_toy_dataset, toy_config
+
+
+class NegativeSamplingTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+        self.config = toy_config(self.path)
+        self.train_dataset = RecDataset(self.config).split()[0]
+        self.loader = TrainDataLoader(self.config, self.train_dataset, batch_size=16, shuffle=True)
+        users = self.train_dataset.get_field(self.train_dataset.uid_field)
+        items = self.train_dataset.get_field(self.train_dataset.iid_field)
+        self.history = set(zip(users.tolist(), items.tolist()))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_in_history(self):
+        n_users, n_items = self.train_dataset.user_num, self.train_dataset.item_num
+        u_ids, i_ids = (ids.ravel() for ids in np.meshgrid(np.arange(n_users), np.arange(n_items)))
+        expected = [(u, i) in self.history for u, i in zip(u_ids.tolist(), i_ids.tolist())]
+        np.testing.assert_array_equal(self.loader.in_history(u_ids, i_ids), expected)
+
+    def test_negatives_outside_history(self):
+        users = self.train_dataset.get_field(self.train_dataset.uid_field)
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            neg_ids = self.loader._sample_neg_ids(users, rng).numpy()
+            self.assertFalse(any((u, i) in self.history for u, i in zip(users.tolist(), neg_ids.tolist())))
+            self.assertTrue(np.isin(neg_ids, self.loader.all_item_ids).all())
+
+    def test_near_full_history(self):
+        # user 0 interacted with all training items but the first, so only that one can be drawn
+        all_items = self.loader.all_item_ids
+        keys = self.loader.history_keys
+        self.loader.history_keys = np.concatenate((all_items[1:], keys[keys >= self.train_dataset.item_num]))
+        neg_ids = self.loader._sample_neg_ids(np.zeros(200, dtype=np.int64), np.random.RandomState(0))
+        self.assertTrue((neg_ids.numpy() == all_items[0]).all())
+
+
+class PrefetchTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+        config = toy_config(self.path, prefetch_queue_depth=2)
+        self.loader = TrainDataLoader(config, RecDataset(config).split()[0], batch_size=16, shuffle=True)
+        self.loader.pretrain_setup()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_epoch_order_and_negatives(self):
+        for _ in range(2):
+            batches = list(self.loader)
+            self.assertEqual(len(batches), len(self.loader))
+            users, items, negs = (t.numpy() for t in torch.cat(batches, dim=1))
+            # the batches follow the epoch's shuffled order
+            np.testing.assert_array_equal(users, self.loader.dataset.get_field('userID'))
+            np.testing.assert_array_equal(items, self.loader.dataset.get_field('itemID'))
+            self.assertFalse(self.loader.in_history(users, negs).any())
+
+    def test_abandoned_epoch(self):
+        iter(self.loader)
+        next(self.loader)
+        stop = self.loader._prefetch_stop
+        # the next epoch retires the worker of the abandoned one and starts from its own first batch
+        self.loader.pr = 0
+        self.assertEqual(sum(batch.shape[1] for batch in self.loader), len(self.loader.dataset))
+        self.assertTrue(stop.is_set())
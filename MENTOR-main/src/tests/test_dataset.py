@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from utils_package.dataset import RecDataset
+from tests.toy import write_toy_dataset, toy_config
+
+
+class RecDatasetTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+        self.dataset = RecDataset(toy_config(self.path))
+        self.df = pd.read_csv(os.path.join(self.path, 'toy', 'toy.inter'), sep='\t')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_columns(self):
+        self.assertEqual(self.dataset.user_ids.dtype, np.int32)
+        self.assertEqual(self.dataset.item_ids.dtype, np.int32)
+        np.testing.assert_array_equal(self.dataset.get_field('userID'), self.df.userID)
+        np.testing.assert_array_equal(self.dataset.get_field('itemID'), self.df.itemID)
+
+    def test_split_views(self):
+        splits = self.dataset.split()
+        for label, split in enumerate(splits):
+            # views into the shared columns, rows in file order
+            self.assertIs(split.user_ids, self.dataset.user_ids)
+            rows = self.df[self.df.x_label == label]
+            np.testing.assert_array_equal(split.get_field('userID'), rows.userID)
+            np.testing.assert_array_equal(split.get_field('itemID'), rows.itemID)
+            np.testing.assert_array_equal(split[:5]['itemID'], rows.itemID[:5])
+
+    def test_shuffle_keeps_copies(self):
+        train = self.dataset.split()[0]
+        backup = train.copy(train.index)
+        np.random.seed(0)
+        train.shuffle()
+        np.testing.assert_array_equal(backup.get_field('itemID'), self.df[self.df.x_label == 0].itemID)
+        pairs = sorted(zip(train.get_field('userID').tolist(), train.get_field('itemID').tolist()))
+        self.assertEqual(pairs, sorted(zip(backup.get_field('userID').tolist(), backup.get_field('itemID').tolist())))
+
+    def test_group_by(self):
+        train = self.dataset.split()[0]
+        np.random.seed(0)
+        train.shuffle()
+        indptr, items = train.group_by('userID')
+        self.assertEqual(len(indptr), train.user_num + 1)
+        users, order_items = train.get_field('userID'), train.get_field('itemID')
+        for u in range(train.user_num):
+            # same items in the same (shuffled) order as a filter over the rows
+            np.testing.assert_array_equal(items[indptr[u]: indptr[u + 1]], order_items[users == u])
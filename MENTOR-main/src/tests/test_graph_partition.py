@@ -0,0 +1,78 @@
+import math
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import scipy.sparse as sp
+import torch
+from utils_package.graph_partition import partition_graph, load_partition
+from tests.toy import write_toy_dataset, build_mentor
+
+
+def random_bipartite(n_first, n_second, n_edges, seed=0):
+    rng = np.random.RandomState(seed)
+    rows = rng.randint(n_first, size=n_edges)
+    cols = rng.randint(n_second, size=n_edges) + n_first
+    n = n_first + n_second
+    adj = sp.coo_matrix((np.ones(n_edges), (rows, cols)), shape=(n, n)).tocsr()
+    adj = (adj + adj.T).tocsr()
+    return adj.indptr, adj.indices
+
+
+class PartitionGraphTest(unittest.TestCase):
+    def test_balance(self):
+        indptr, indices = random_bipartite(300, 200, 3000)
+        n = len(indptr) - 1
+        for n_parts in (1, 3, 8, 32):
+            for imbalance in (0.0, 0.05, 0.3):
+                for n_first in (None, 300):
+                    parts = partition_graph(indptr, indices, n_parts, n_first=n_first, imbalance=imbalance)
+                    self.assertEqual(parts.shape, (n,))
+                    self.assertTrue(((parts >= 0) & (parts < n_parts)).all())
+                    self.assertLessEqual(np.bincount(parts).max(), math.ceil((1 + imbalance) * n / n_parts))
+
+    def test_cached_per_arguments(self):
+        indptr, indices = random_bipartite(30, 20, 200)
+        path = tempfile.mkdtemp()
+        try:
+            parts = load_partition(path, 'graph', indptr, indices, 4, imbalance=0.1)
+            np.testing.assert_array_equal(load_partition(path, 'graph', indptr, indices, 4, imbalance=0.1), parts)
+            load_partition(path, 'graph', indptr, indices, 4, imbalance=0.2)
+            load_partition(path, 'graph', indptr, indices, 4, imbalance=0.1, seed=1)
+            load_partition(path, 'graph', indptr, indices, 4, imbalance=0.1, n_refine_iter=3)
+            self.assertEqual(len(os.listdir(path)), 4)
+        finally:
+            shutil.rmtree(path)
+
+
+class ClusterModeTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_one_part_matches_full_graph(self):
+        model, train_data = build_mentor(self.path, train_mode='cluster', cluster_parts=1, clusters_per_batch=1)
+        model.train()
+        steps = 0
+        for interaction in model.train_batches(train_data):
+            steps += 1
+            users, neg = interaction[0].numpy(), interaction[2].numpy()
+            self.assertFalse(train_data.in_history(users, neg).any())
+            with torch.no_grad():
+                cluster = model(interaction.clone())
+                cluster_embed = model.result_embed
+                model._subgraph, subgraph = None, model._subgraph
+                full = model(interaction.clone())
+                model._subgraph = subgraph
+            self.assertTrue(torch.equal(cluster_embed, model.result_embed))
+            for a, b in zip(cluster, full):
+                self.assertTrue(torch.equal(a, b))
+        self.assertEqual(steps, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import shutil
+import tempfile
+import unittest
+import torch
+from tests.toy import write_toy_dataset, build_mentor
+
+
+class InferenceTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+        self.model, train_data = build_mentor(self.path)
+        self.interaction = next(iter(train_data))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def assert_matches_forward(self):
+        model = self.model
+        with torch.no_grad():
+            model(self.interaction.clone())
+            user_rep, item_rep = model.inference()
+        self.assertTrue(torch.equal(user_rep, model.result_embed[:model.n_users]))
+        self.assertTrue(torch.equal(item_rep, model.result_embed[model.n_users:]))
+
+    def test_matches_forward(self):
+        self.model.eval()
+        self.assert_matches_forward()
+
+    def test_cached_until_parameters_change(self):
+        model = self.model
+        model.eval()
+        with torch.no_grad():
+            cached = model.inference()
+            self.assertIs(model.inference(), cached)
+            model.eval()
+            self.assertIs(model.inference(), cached)
+
+            # a training step
+            model.train()
+            self.assertIsNot(model.inference(), cached)
+        optimizer = torch.optim.SGD(model.parameters(), lr=1.0)
+        model.calculate_loss(self.interaction.clone()).backward()
+        optimizer.step()
+        model.post_step_processing()
+        model.eval()
+        self.assert_matches_forward()
+
+        # loading weights
+        cached = model.inference()
+        state = {k: v + 1 if k == 'weight_u' else v for k, v in model.state_dict().items()}
+        model.load_state_dict(state)
+        self.assertIsNot(model.inference(), cached)
+        self.assert_matches_forward()
+
+
+if __name__ == '__main__':
+    unittest.main()
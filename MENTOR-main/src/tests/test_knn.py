@@ -0,0 +1,50 @@
+import unittest
+import torch
+from utils_package.knn import knn_blockwise, knn_ivf, knn_recall
+
+
+def full_knn(embeddings, k):
+    # the former build: full n x n similarity, then top-k
+    context_norm = embeddings.div(torch.norm(embeddings, p=2, dim=-1, keepdim=True))
+    sim = torch.mm(context_norm, context_norm.transpose(1, 0))
+    return torch.topk(sim, k, dim=-1)[1]
+
+
+class KnnBlockwiseTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        self.embeddings = torch.randn(500, 24)
+
+    def test_matches_full(self):
+        expected = full_knn(self.embeddings, 10)
+        # budgets of one row, several uneven blocks and everything at once
+        for memory_budget in (1e-6, 0.05, 1024):
+            for n_threads in (1, 3):
+                knn_ind = knn_blockwise(self.embeddings, 10, memory_budget, n_threads)
+                self.assertTrue(torch.equal(knn_ind, expected))
+
+
+class KnnIvfTest(unittest.TestCase):
+    def setUp(self):
+        torch.manual_seed(0)
+        # clustered rows, as item features are
+        centers = torch.randn(20, 24)
+        self.embeddings = centers[torch.randint(20, (800,))] + 0.3 * torch.randn(800, 24)
+        self.exact = knn_blockwise(self.embeddings, 10)
+
+    def test_all_lists_probed_is_exact(self):
+        knn_ind = knn_ivf(self.embeddings, 10, n_lists=16, n_probe=16)
+        self.assertTrue(torch.equal(knn_ind, self.exact))
+
+    def test_recall(self):
+        knn_ind = knn_ivf(self.embeddings, 10, n_lists=32, n_probe=2)
+        self.assertTrue(torch.equal(knn_ind, knn_ivf(self.embeddings, 10, n_lists=32, n_probe=2)))
+        recall = knn_recall(self.embeddings, knn_ind, 10, n_samples=800)
+        self.assertGreater(recall, 0.95)
+        self.assertEqual(knn_recall(self.embeddings, self.exact, 10), 1.0)
+
+    def test_small_lists(self):
+        # lists with fewer candidates than k fall back to all rows
+        knn_ind = knn_ivf(self.embeddings[:30], 10, n_lists=30, n_probe=1)
+        self.assertEqual(knn_ind.shape, (30, 10))
+        self.assertTrue((knn_ind[:, 0] == torch.arange(30)).all())
@@ -0,0 +1,70 @@
+import shutil
+import tempfile
+import unittest
+from types import SimpleNamespace
+import torch
+import torch.nn.functional as F
+from models.mentor import MENTOR
+from tests.toy import write_toy_dataset, build_mentor
+
+
+class MaskRowsTest(unittest.TestCase):
+    def setUp(self):
+        self.model = SimpleNamespace(user_rep=torch.zeros(10, 4), item_rep=torch.zeros(15, 4), mask_sample_size=32)
+        self.users, self.items = torch.tensor([4, 2, 4, 9]), torch.tensor([0, 14, 3, 0, 3])
+
+    def test_modes(self):
+        model = self.model
+        model.mask_mode = 'full'
+        self.assertEqual(MENTOR.mask_rows(model, self.users, self.items), (None, None))
+        model.mask_mode = 'batch'
+        users, items = MENTOR.mask_rows(model, self.users, self.items)
+        self.assertEqual(users.tolist(), [2, 4, 9])
+        self.assertEqual(items.tolist(), [0, 3, 14])
+        model.mask_mode = 'sample'
+        users, items = MENTOR.mask_rows(model, self.users, self.items)
+        self.assertEqual((len(users), len(items)), (32, 32))
+        self.assertTrue(0 <= users.min() and users.max() < 10 and 0 <= items.min() and items.max() < 15)
+
+
+def mask_loss(rep, mlp):
+    return 1 - F.cosine_similarity(rep, mlp(rep)).mean()
+
+
+class MaskModeTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+        # without dropout only the rows change the mask-consistency term
+        self.model, train_data = build_mentor(self.path, dropout=0.0, train_batch_size=16)
+        self.model.train()
+        self.interaction = next(iter(train_data))
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def loss(self, mask_mode):
+        self.model.mask_mode = mask_mode
+        torch.manual_seed(0)
+        with torch.no_grad():
+            return self.model.calculate_loss(self.interaction.clone())
+
+    def test_batch_rows(self):
+        model = self.model
+        full, batch = self.loss('full'), self.loss('batch')
+        users, items = self.interaction[0].unique(), torch.cat((self.interaction[1], self.interaction[2])).unique()
+        with torch.no_grad():
+            expected = model.mask_weight_f * (
+                mask_loss(model.user_rep, model.mlp) + mask_loss(model.item_rep, model.mlp)
+                - mask_loss(model.user_rep[users], model.mlp) - mask_loss(model.item_rep[items], model.mlp))
+        torch.testing.assert_close(full - batch, expected)
+
+    def test_sample_estimates_full(self):
+        self.model.mask_sample_size = 100000
+        # the other terms cancel against the batch mode
+        batch = self.loss('batch')
+        torch.testing.assert_close(self.loss('sample') - batch, self.loss('full') - batch, rtol=2e-2, atol=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
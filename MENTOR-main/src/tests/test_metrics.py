@@ -0,0 +1,49 @@
+import unittest
+import numpy as np
+import torch
+from utils_package.metrics import metrics_dict, torch_metrics_dict
+
+
+def loop_ndcg(pos_index, pos_len):
+    # per-user reference, the ideal DCG is frozen after min(pos_len, k) positions
+    k = pos_index.shape[1]
+    discounts = 1.0 / np.log2(np.arange(1, k + 1) + 1)
+    result = np.zeros(pos_index.shape)
+    for row, hits in enumerate(pos_index):
+        idcg = np.cumsum(discounts)
+        n_ideal = min(pos_len[row], k)
+        idcg[n_ideal:] = idcg[n_ideal - 1]
+        result[row] = np.cumsum(np.where(hits, discounts, 0)) / idcg
+    return result.mean(axis=0)
+
+
+def loop_map(pos_index, pos_len):
+    k = pos_index.shape[1]
+    result = np.zeros(pos_index.shape)
+    for row, hits in enumerate(pos_index):
+        precision = np.cumsum(hits) / np.arange(1, k + 1)
+        ranges = np.arange(1, k + 1)
+        n_ideal = min(pos_len[row], k)
+        ranges[n_ideal:] = ranges[n_ideal - 1]
+        result[row] = np.cumsum(precision * hits) / ranges
+    return result.mean(axis=0)
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.pos_index = rng.rand(200, 20) < 0.2
+        # users with fewer, as many and more positives than k, and one without any
+        self.pos_len = rng.randint(1, 40, size=200)
+        self.pos_len[0] = 0
+
+    def test_matches_loops(self):
+        for name, reference in (('ndcg', loop_ndcg), ('map', loop_map)):
+            np.testing.assert_allclose(metrics_dict[name](self.pos_index, self.pos_len),
+                                       reference(self.pos_index, self.pos_len))
+
+    def test_torch_matches_numpy(self):
+        pos_index, pos_len = torch.from_numpy(self.pos_index), torch.from_numpy(self.pos_len)
+        for name in metrics_dict:
+            np.testing.assert_allclose(torch_metrics_dict[name](pos_index, pos_len).numpy(),
+                                       metrics_dict[name](self.pos_index, self.pos_len))
@@ -0,0 +1,93 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+from utils_package.subgraph_sampler import sample_neighbors, SubgraphSampler
+from tests.toy import write_toy_dataset, build_mentor
+
+
+class SampleNeighborsTest(unittest.TestCase):
+    # row 0 has four in-edges, row 1 one, row 2 none
+    indptr = np.array([0, 4, 5, 5])
+    indices = np.array([1, 2, 3, 4, 0])
+    values = np.array([1., 2., 3., 4., 5.], dtype=np.float32)
+
+    def test_all_edges(self):
+        for fanout in (None, -1, 4):
+            dst, src, weight = sample_neighbors(self.indptr, self.indices, self.values, np.array([0, 1, 2]), fanout)
+            np.testing.assert_array_equal(dst, [0, 0, 0, 0, 1])
+            np.testing.assert_array_equal(src, self.indices)
+            np.testing.assert_array_equal(weight, self.values)
+
+    def test_fanout_reweighting(self):
+        rng = np.random.RandomState(0)
+        totals = []
+        for _ in range(4000):
+            dst, src, weight = sample_neighbors(self.indptr, self.indices, self.values, np.array([2, 0, 1]), 2, rng)
+            np.testing.assert_array_equal(dst, [1, 1, 2])
+            self.assertEqual(len(set(src[:2])), 2)
+            # kept edges of row 0 are scaled by degree / fanout = 2, the single edge of row 1 keeps its weight
+            np.testing.assert_array_equal(weight[:2], 2 * self.values[src[:2] - 1])
+            self.assertEqual(weight[2], 5.)
+            totals.append(weight[:2].sum())
+        # unbiased: the sampled sum estimates the full one
+        self.assertAlmostEqual(np.mean(totals), self.values[:4].sum(), delta=0.1)
+
+
+class SampledModeTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_full_fanout_matches_full_graph(self):
+        model, train_data = build_mentor(self.path, train_mode='sampled', sample_fanouts=[-1, -1], sample_workers=0,
+                                         train_batch_size=8)
+        model.train()
+        batches = model.train_batches(train_data)
+        for interaction in batches:
+            self.assertIsNotNone(model._subgraph)
+            with torch.no_grad():
+                sampled = model(interaction.clone())
+                # the representations cover the targets of the subgraph only
+                self.assertLess(model.result_embed.shape[0], model.n_users + model.n_items)
+                user_rows, item_rows = model.batch_rows
+                sampled_guide = model.result_embed_guide[user_rows], model.result_embed_guide[item_rows]
+                subgraph, model._subgraph = model._subgraph, None
+                full = model(interaction.clone())
+                user_rows, item_rows = model.batch_rows
+                full_guide = model.result_embed_guide[user_rows], model.result_embed_guide[item_rows]
+                model._subgraph = subgraph
+            for a, b in zip(sampled + sampled_guide, full + full_guide):
+                torch.testing.assert_close(a, b)
+
+    def test_pool_reused_across_epochs(self):
+        model, train_data = build_mentor(self.path, train_mode='sampled', sample_workers=0)
+        inline = model.subgraph_sampler
+        sampler = SubgraphSampler(inline.ui_csr, inline.mm_csr, inline.n_users, inline.fanouts, inline.mm_layers,
+                                  n_workers=2, queue_depth=2)
+        batches = [interaction for interaction in train_data]
+        try:
+            pools = []
+            for epoch in range(2):
+                np.random.seed(epoch)
+                expected = [inline.sample(*inline._batch_ids(b), np.random.randint(2 ** 31)) for b in batches]
+                np.random.seed(epoch)
+                samples = [subgraph for _, subgraph in sampler.prefetch(batches)]
+                pools.append(sampler._pool)
+                self.assertEqual(len(samples), len(expected))
+                for sample, exp in zip(samples, expected):
+                    np.testing.assert_array_equal(sample['nodes'], exp['nodes'])
+                    np.testing.assert_array_equal(sample['ui_blocks'][0][1], exp['ui_blocks'][0][1])
+            self.assertIsNotNone(pools[0])
+            self.assertIs(pools[0], pools[1])
+        finally:
+            sampler.close()
+        self.assertIsNone(sampler._pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
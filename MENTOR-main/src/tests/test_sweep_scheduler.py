@@ -0,0 +1,49 @@
+import multiprocessing
+import unittest
+from utils_package.sweep_scheduler import ASHAScheduler
+
+
+def run_trial(scheduler, scores, eval_step=1):
+    r"""Epochs a combination trains for, given its validation score at every epoch."""
+    trial = scheduler.trial()
+    best = None
+    for epoch_idx in range(eval_step - 1, len(scores), eval_step):
+        best = scores[epoch_idx] if best is None else max(best, scores[epoch_idx])
+        if trial.should_stop(epoch_idx, best):
+            return epoch_idx + 1
+    return len(scores)
+
+
+class ASHASchedulerTest(unittest.TestCase):
+    def test_milestones(self):
+        self.assertEqual(ASHAScheduler(2, 3, 100).milestones, [2, 6, 18, 54])
+        self.assertEqual(ASHAScheduler(10, 3, 10).milestones, [])
+
+    def test_stops_weak_trials(self):
+        scheduler = ASHAScheduler(grace_period=2, reduction_factor=3, max_epochs=30)
+        # the first combination improves steadily and sets the bar at every rung
+        self.assertEqual(run_trial(scheduler, [(i + 1) / 30 for i in range(30)]), 30)
+        # a flat one is ahead at the first rung but behind at the second
+        self.assertEqual(run_trial(scheduler, [0.1] * 30), 6)
+        self.assertEqual(run_trial(scheduler, [0.01] * 30), 2)
+        self.assertEqual(run_trial(scheduler, [0.9] * 30), 30)
+
+    def test_smaller_is_better(self):
+        scheduler = ASHAScheduler(grace_period=2, reduction_factor=2, max_epochs=10, bigger=False)
+        self.assertEqual(run_trial(scheduler, [1.0] * 10), 10)
+        self.assertEqual(run_trial(scheduler, [2.0] * 10), 2)
+        self.assertEqual(run_trial(scheduler, [0.5] * 10), 10)
+
+    def test_skipped_rung(self):
+        # evaluated every 4 epochs, the first evaluation is past rungs 1 and 3 and counts for rung 3 only
+        scheduler = ASHAScheduler(grace_period=1, reduction_factor=3, max_epochs=30)
+        run_trial(scheduler, [0.5] * 30, eval_step=4)
+        self.assertEqual(sorted(scheduler.rung_scores), [3, 9, 27])
+
+    def test_shared_scores(self):
+        # manager proxies, as the sweep workers use them
+        with multiprocessing.Manager() as manager:
+            scheduler = ASHAScheduler(2, 3, 30, rung_scores=manager.dict(), lock=manager.Lock())
+            self.assertEqual(run_trial(scheduler, [0.5] * 30), 30)
+            self.assertEqual(run_trial(scheduler, [0.1] * 30), 2)
+            self.assertEqual(list(scheduler.rung_scores[2]), [0.5, 0.1])
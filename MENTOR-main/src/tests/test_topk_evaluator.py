@@ -0,0 +1,34 @@
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import torch
+from utils_package.dataset import RecDataset
+from utils_package.dataloader import EvalDataLoader
+from utils_package.topk_evaluator import TopKEvaluator
+from tests.toy import write_toy_dataset, toy_config
+
+
+class HitMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        write_toy_dataset(self.path)
+        self.config = toy_config(self.path)
+        train_dataset, valid_dataset, _ = RecDataset(self.config).split()
+        self.eval_data = EvalDataLoader(self.config, valid_dataset, additional_dataset=train_dataset,
+                                        batch_size=16)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_matches_isin(self):
+        n_users, n_items = len(self.eval_data.get_eval_users()), self.eval_data.dataset.get_item_num()
+        topk_index = torch.from_numpy(np.random.RandomState(0).randint(n_items, size=(n_users, 20)))
+        # eval items of the user placed at random top-k positions, so that there are hits
+        for row, items in enumerate(self.eval_data.get_eval_items()):
+            topk_index[row, row % 20] = int(items[0])
+        hits = TopKEvaluator(self.config)._hit_matrix(topk_index, self.eval_data)
+        expected = np.stack([np.isin(topk_index[row].numpy(), items)
+                             for row, items in enumerate(self.eval_data.get_eval_items())])
+        self.assertTrue(expected.any())
+        np.testing.assert_array_equal(hits.numpy(), expected)
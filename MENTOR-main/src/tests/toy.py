@@ -0,0 +1,52 @@
+import os
+import numpy as np
+import pandas as pd
+from utils_package.configurator import Config
+from utils_package.dataset import RecDataset
+from utils_package.dataloader import TrainDataLoader
+from utils_package.utils import init_seed, get_model
+
+
+def write_toy_dataset(path, n_users=60, n_items=40, seed=0):
+    r"""Random interactions and features of a small dataset ``toy`` under ``path/toy``; MENTOR builds its user graph
+    from the interactions."""
+    rng = np.random.RandomState(seed)
+    rows = []
+    for user in range(n_users):
+        items = rng.choice(n_items, rng.randint(5, 12), replace=False)
+        # all but the last two interactions train, then one validation and one test interaction
+        labels = [0] * (len(items) - 2) + [1, 2]
+        rows += [(user, item, label) for item, label in zip(items, labels)]
+    inter = pd.DataFrame(rows, columns=['userID', 'itemID', 'x_label'])
+    dataset_path = os.path.join(path, 'toy')
+    os.makedirs(dataset_path)
+    inter.to_csv(os.path.join(dataset_path, 'toy.inter'), sep='\t', index=False)
+    np.save(os.path.join(dataset_path, 'image_feat.npy'), rng.standard_normal((n_items, 32)).astype(np.float32))
+    np.save(os.path.join(dataset_path, 'text_feat.npy'), rng.standard_normal((n_items, 16)).astype(np.float32))
+
+
+def toy_config(path, **config_dict):
+    r"""CPU config of the toy dataset of :func:`write_toy_dataset` in ``path``, with the first value of every
+    hyper-parameter.
+    """
+    config_dict = dict({
+        'data_path': path + os.sep, 'use_gpu': False, 'train_batch_size': 64, 'inter_file_name': 'toy.inter',
+        'USER_ID_FIELD': 'userID', 'ITEM_ID_FIELD': 'itemID', 'vision_feature_file': 'image_feat.npy',
+        'text_feature_file': 'text_feat.npy', 'user_graph_file': 'user_graph_csr', 'field_separator': '\t',
+        'artifact_cache_dir': os.path.join(path, 'artifacts'), 'checkpoint_dir': os.path.join(path, 'saved'),
+    }, **config_dict)
+    config = Config('MENTOR', 'toy', config_dict)
+    for key in config['hyper_parameters']:
+        if isinstance(config[key], list):
+            config[key] = config[key][0]
+    return config
+
+
+def build_mentor(path, **config_dict):
+    r"""MENTOR and its training loader on the toy dataset of :func:`write_toy_dataset` in ``path``."""
+    config = toy_config(path, **config_dict)
+    init_seed(config['seed'])
+    train_dataset = RecDataset(config).split()[0]
+    train_data = TrainDataLoader(config, train_dataset, batch_size=config['train_batch_size'], shuffle=True)
+    train_data.pretrain_setup()
+    return get_model('MENTOR')(config, train_data), train_data
@@ -0,0 +1,122 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import torch
+
+_file_digests = {}
+
+
+def file_digest(path, chunk_size=1 << 24):
+    """sha1 of a file's content, remembered per (path, size, mtime) within the process."""
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_digests:
+        h = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                h.update(chunk)
+        _file_digests[memo_key] = h.hexdigest()
+    return _file_digests[memo_key]
+
+
+def array_digest(*arrays):
+    """sha1 of the dtypes, shapes and content of numpy arrays or tensors."""
+    h = hashlib.sha1()
+    for arr in arrays:
+        if isinstance(arr, torch.Tensor):
+            arr = arr.detach().cpu().numpy()
+        arr = np.ascontiguousarray(arr)
+        h.update('{}{}'.format(arr.dtype.str, arr.shape).encode())
+        h.update(arr.data)
+    return h.hexdigest()
+
+
+def sparse_to_csr(adj):
+    """``(indptr, indices, data)`` of a square torch sparse COO tensor, duplicates summed."""
+    adj = adj.coalesce()
+    row, col = adj.indices().cpu()
+    indptr = torch.cat((torch.zeros(1, dtype=torch.long), torch.cumsum(torch.bincount(row, minlength=adj.shape[0]), 0)))
+    return indptr.numpy(), col.numpy(), adj.values().cpu().numpy()
+
+
+def csr_to_sparse(indptr, indices, data, device=None):
+    """Torch sparse COO tensor of CSR arrays, the inverse of :func:`sparse_to_csr`.
+
+    COO needs int64 row and column indices, so the indices are always copied; the arrays are only read once.
+    """
+    n = len(indptr) - 1
+    indptr = torch.from_numpy(np.asarray(indptr, dtype=np.int64))
+    row = torch.repeat_interleave(torch.arange(n), indptr[1:] - indptr[:-1])
+    col = torch.from_numpy(np.asarray(indices, dtype=np.int64))
+    adj = torch.sparse_coo_tensor(torch.stack((row, col)), torch.from_numpy(np.asarray(data)), (n, n))
+    return adj.coalesce().to(device)
+
+
+class ArtifactCache(object):
+    r"""Content-addressed store of derived graphs (kNN graphs, user graph, normalized adjacencies).
+
+    An artifact lives under a key made of its name and the sha1 of every input that determines it, so a change
+    of feature file, ``knn_k``, weighting or normalization simply misses the cache instead of loading a stale
+    graph. Graphs are kept in CSR form, int64 ``indptr`` and int32 ``indices``, as ``.npy`` files that are
+    memory-mapped on load, copy-on-write so that tensors can wrap them. Entries are written to a temporary directory and renamed into place, and the least
+    recently used ones are evicted once the cache grows beyond ``max_size`` MB.
+    """
+    def __init__(self, root, max_size=None):
+        self.root = root
+        self.max_size = max_size
+        os.makedirs(root, exist_ok=True)
+
+    def key(self, name, **inputs):
+        digest = hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+        return '{}-{}'.format(name, digest[:20])
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+    def load_csr(self, key, mmap_mode='c'):
+        """``(indptr, indices, data)`` stored under ``key``, or ``None`` on a miss."""
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+        os.utime(path)  # recency for eviction
+        return tuple(np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                     for name in ('indptr', 'indices', 'data'))
+
+    def save_csr(self, key, indptr, indices, data, inputs=None):
+        """Store CSR arrays under ``key``; ``data`` keeps its dtype. ``inputs`` are kept alongside for reference."""
+        path = self.path(key)
+        tmp_path = '{}.tmp{}'.format(path, os.getpid())
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        np.save(os.path.join(tmp_path, 'indptr.npy'), np.asarray(indptr, dtype=np.int64))
+        np.save(os.path.join(tmp_path, 'indices.npy'), np.asarray(indices, dtype=np.int32))
+        np.save(os.path.join(tmp_path, 'data.npy'), np.asarray(data))
+        with open(os.path.join(tmp_path, 'inputs.json'), 'w') as f:
+            json.dump(inputs or {}, f, sort_keys=True, default=str)
+        if os.path.isdir(path):
+            # written concurrently by another process, the content is the same
+            shutil.rmtree(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        if not self.max_size:
+            return
+        entries = []
+        for key in os.listdir(self.root):
+            path = self.path(key)
+            if not os.path.isdir(path) or '.tmp' in key:
+                continue
+            size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, key))
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_size * 2 ** 20:
+                break
+            if key != keep:
+                shutil.rmtree(self.path(key), ignore_errors=True)
+                total -= size
@@ -1,7 +1,10 @@
 import math
+import queue
+import threading
 import torch
 import random
 import numpy as np
+from time import time
 from logging import getLogger
 from scipy.sparse import coo_matrix
 
@@ -33,7 +36,8 @@ class AbstractDataLoader(object):
         self.config = config
         self.logger = getLogger()
         self.dataset = dataset
-        self.dataset_bk = self.dataset.copy(self.dataset.df)
+        # shares the columns and the current row index, shuffling rebinds the index of self.dataset only
+        self.dataset_bk = self.dataset.copy(self.dataset.index)
         # if config['model_type'] == ModelType.GENERAL:
         #     self.dataset.df.drop(self.dataset.ts_id, inplace=True, axis=1)
         # elif config['model_type'] == ModelType.SEQUENTIAL:
@@ -56,6 +60,13 @@ class AbstractDataLoader(object):
         """
         pass
 
+    def state_dict(self):
+        """Order carried from one epoch to the next (the shuffled row index), kept in training checkpoints."""
+        return {'index': self.dataset.index}
+
+    def load_state_dict(self, state):
+        self.dataset = self.dataset.copy(state['index'])
+
     def data_preprocess(self):
         """This function is used to do some data preprocess, such as pre-neg-sampling and pre-data-augmentation.
         By default, it will do nothing.
@@ -107,8 +118,8 @@ class TrainDataLoader(AbstractDataLoader):
         # special for training dataloader
         self.history_items_per_u = dict()
         # full items in training.
-        self.all_items = self.dataset.df[self.dataset.iid_field].unique().tolist()
-        self.all_uids = self.dataset.df[self.dataset.uid_field].unique()
+        self.all_items = np.unique(self.dataset.get_field(self.dataset.iid_field)).tolist()
+        self.all_uids = np.unique(self.dataset.get_field(self.dataset.uid_field))
         self.all_items_set = set(self.all_items)
         self.all_users_set = set(self.all_uids)
         self.all_item_len = len(self.all_items)
@@ -123,14 +134,26 @@ class TrainDataLoader(AbstractDataLoader):
         else:
             self.sample_func = self._get_non_neg_sample
 
-        self._get_history_items_u()
+        # candidates for negative sampling, drawn as one array per batch
+        self.all_item_ids = np.sort(np.asarray(self.all_items, dtype=np.int64))
+        self._build_history_index()
         self.neighborhood_loss_required = config['use_neighborhood_loss']
         if self.neighborhood_loss_required:
+            self._get_history_items_u()
             self.history_users_per_i = {}
             self._get_history_users_i()
             self.user_user_dict = self._get_my_neighbors(self.config['USER_ID_FIELD'])
             self.item_item_dict = self._get_my_neighbors(self.config['ITEM_ID_FIELD'])
 
+        # batches assembled ahead by a background thread, only for the [user, pos(, neg)] layouts
+        self.prefetch_depth = config['prefetch_queue_depth'] or 0
+        if self.use_full_sampling or self.neighborhood_loss_required:
+            self.prefetch_depth = 0
+        self.pin_memory = self.prefetch_depth > 0 and self.device.type == 'cuda'
+        self.stall_time = 0.0
+        self._prefetch_queue = None
+        self._prefetch_stop = None
+
     def pretrain_setup(self):
         """
         Reset dataloader. Outputing the same positive & negative samples with each training.
@@ -138,7 +161,7 @@ class TrainDataLoader(AbstractDataLoader):
         """
         # sort & random
         if self.shuffle:
-            self.dataset = self.dataset_bk.copy(self.dataset_bk.df)
+            self.dataset = self.dataset_bk.copy(self.dataset_bk.index)
         self.all_items.sort()
         if self.use_full_sampling:
             self.all_uids.sort()
@@ -146,6 +169,15 @@ class TrainDataLoader(AbstractDataLoader):
         # reorder dataset as default (chronological order)
         #self.dataset.sort_by_chronological()
 
+    def state_dict(self):
+        state = super().state_dict()
+        state['all_uids'] = self.all_uids
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        self.all_uids = state['all_uids']
+
     def inter_matrix(self, form='coo', value_field=None):
         """Get sparse matrix that describe interactions between user_id and item_id.
 
@@ -164,36 +196,33 @@ class TrainDataLoader(AbstractDataLoader):
         """
         if not self.dataset.uid_field or not self.dataset.iid_field:
             raise ValueError('dataset doesn\'t exist uid/iid, thus can not converted to sparse matrix')
-        return self._create_sparse_matrix(self.dataset.df, self.dataset.uid_field,
+        return self._create_sparse_matrix(self.dataset, self.dataset.uid_field,
                                           self.dataset.iid_field, form, value_field)
 
-    def _create_sparse_matrix(self, df_feat, source_field, target_field, form='coo', value_field=None):
+    def _create_sparse_matrix(self, dataset, source_field, target_field, form='coo', value_field=None):
         """Get sparse matrix that describe relations between two fields.
 
         Source and target should be token-like fields.
 
         Sparse matrix has shape (``self.num(source_field)``, ``self.num(target_field)``).
 
-        For a row of <src, tgt>, ``matrix[src, tgt] = 1`` if ``value_field`` is ``None``,
-        else ``matrix[src, tgt] = df_feat[value_field][src, tgt]``.
+        For a row of <src, tgt>, ``matrix[src, tgt] = 1``. The array-backed dataset only keeps the id columns,
+        so ``value_field`` must be ``None``.
 
         Args:
-            df_feat (pandas.DataFrame): Feature where src and tgt exist.
+            dataset (RecDataset): Dataset where src and tgt exist.
             form (str, optional): Sparse matrix format. Defaults to ``coo``.
-            value_field (str, optional): Data of sparse matrix, which should exist in ``df_feat``.
-                Defaults to ``None``.
+            value_field (str, optional): Data of sparse matrix. Defaults to ``None``.
 
         Returns:
             scipy.sparse: Sparse matrix in form ``coo`` or ``csr``.
         """
-        src = df_feat[source_field].values
-        tgt = df_feat[target_field].values
+        src = dataset.get_field(source_field)
+        tgt = dataset.get_field(target_field)
         if value_field is None:
-            data = np.ones(len(df_feat))
+            data = np.ones(len(dataset))
         else:
-            if value_field not in df_feat.columns:
-                raise ValueError('value_field [{}] should be one of `df_feat`\'s features.'.format(value_field))
-            data = df_feat[value_field].values
+            raise ValueError('value_field [{}] should be one of `dataset`\'s features.'.format(value_field))
         mat = coo_matrix((data, (src, tgt)), shape=(self.dataset.user_num, self.dataset.item_num))
 
         if form == 'coo':
@@ -214,15 +243,77 @@ class TrainDataLoader(AbstractDataLoader):
         if self.use_full_sampling:
             np.random.shuffle(self.all_uids)
 
+    def __iter__(self):
+        super().__iter__()
+        self.stall_time = 0.0
+        if self.prefetch_depth > 0:
+            self._start_prefetch()
+        return self
+
     def _next_batch_data(self):
-        return self.sample_func()
+        if self._prefetch_queue is None:
+            return self.sample_func()
+        wait_start = time()
+        batch_tensor = self._prefetch_queue.get()
+        self.stall_time += time() - wait_start
+        if isinstance(batch_tensor, Exception):
+            raise batch_tensor
+        self.pr += self.step
+        return batch_tensor.to(self.device, non_blocking=self.pin_memory)
+
+    def _start_prefetch(self):
+        """Start a thread filling a queue of ``prefetch_depth`` batches for the current epoch order.
+        The id columns are converted to int64 tensors once per epoch; batches are slices of them.
+        """
+        self._stop_prefetch()
+        user_tensor = torch.from_numpy(self.dataset.get_field(self.dataset.uid_field).astype(np.int64))
+        item_tensor = torch.from_numpy(self.dataset.get_field(self.dataset.iid_field).astype(np.int64))
+        if self.pin_memory:
+            user_tensor, item_tensor = user_tensor.pin_memory(), item_tensor.pin_memory()
+        # own random state so that sampling does not race with the training thread, seeded from the global one
+        rng = np.random.RandomState(np.random.randint(2 ** 31))
+        self._prefetch_queue = queue.Queue(maxsize=self.prefetch_depth)
+        self._prefetch_stop = threading.Event()
+        threading.Thread(target=self._prefetch_worker, daemon=True,
+                         args=(user_tensor, item_tensor, rng, self._prefetch_queue, self._prefetch_stop)).start()
+
+    def _stop_prefetch(self):
+        # unblock and retire a worker left over from an epoch that did not run to the end
+        if self._prefetch_stop is not None:
+            self._prefetch_stop.set()
+        self._prefetch_queue, self._prefetch_stop = None, None
+
+    def _prefetch_worker(self, user_tensor, item_tensor, rng, batch_queue, stop):
+        try:
+            for start in range(0, len(user_tensor), self.step):
+                batch_tensor = torch.stack((user_tensor[start: start + self.step],
+                                            item_tensor[start: start + self.step]))
+                if self.sample_func == self._get_neg_sample:
+                    neg_ids = self._sample_neg_ids(batch_tensor[0].numpy(), rng)
+                    batch_tensor = torch.cat((batch_tensor, neg_ids.unsqueeze(0)))
+                if self.pin_memory:
+                    batch_tensor = batch_tensor.pin_memory()
+                if not self._put(batch_queue, batch_tensor, stop):
+                    return
+        except Exception as e:
+            self._put(batch_queue, e, stop)
+
+    @staticmethod
+    def _put(batch_queue, item, stop):
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
 
     def _get_neg_sample(self):
         cur_data = self.dataset[self.pr: self.pr + self.step]
         self.pr += self.step
         # to tensor
-        user_tensor = torch.tensor(cur_data[self.config['USER_ID_FIELD']].values).type(torch.LongTensor).to(self.device)
-        item_tensor = torch.tensor(cur_data[self.config['ITEM_ID_FIELD']].values).type(torch.LongTensor).to(self.device)
+        user_tensor = torch.from_numpy(cur_data[self.config['USER_ID_FIELD']]).type(torch.LongTensor).to(self.device)
+        item_tensor = torch.from_numpy(cur_data[self.config['ITEM_ID_FIELD']]).type(torch.LongTensor).to(self.device)
         batch_tensor = torch.cat((torch.unsqueeze(user_tensor, 0),
                                   torch.unsqueeze(item_tensor, 0)))
         u_ids = cur_data[self.config['USER_ID_FIELD']]
@@ -247,8 +338,8 @@ class TrainDataLoader(AbstractDataLoader):
         cur_data = self.dataset[self.pr: self.pr + self.step]
         self.pr += self.step
         # to tensor
-        user_tensor = torch.tensor(cur_data[self.config['USER_ID_FIELD']].values).type(torch.LongTensor).to(self.device)
-        item_tensor = torch.tensor(cur_data[self.config['ITEM_ID_FIELD']].values).type(torch.LongTensor).to(self.device)
+        user_tensor = torch.from_numpy(cur_data[self.config['USER_ID_FIELD']]).type(torch.LongTensor).to(self.device)
+        item_tensor = torch.from_numpy(cur_data[self.config['ITEM_ID_FIELD']]).type(torch.LongTensor).to(self.device)
         batch_tensor = torch.cat((torch.unsqueeze(user_tensor, 0),
                                   torch.unsqueeze(item_tensor, 0)))
         return batch_tensor
@@ -258,15 +349,26 @@ class TrainDataLoader(AbstractDataLoader):
         self.pr += self.step
         return user_tensor
 
-    def _sample_neg_ids(self, u_ids):
-        neg_ids = []
-        for u in u_ids:
-            # random 1 item
-            iid = self._random()
-            while iid in self.history_items_per_u[u]:
-                iid = self._random()
-            neg_ids.append(iid)
-        return torch.tensor(neg_ids).type(torch.LongTensor)
+    def _sample_neg_ids(self, u_ids, rng=np.random):
+        """Draw one negative item per user, uniformly over training items not in the user's history.
+        Candidates for the whole batch are drawn at once and only the collisions are redrawn.
+        """
+        u_ids = np.asarray(u_ids, dtype=np.int64)
+        neg_ids = self.all_item_ids[rng.randint(self.all_item_len, size=len(u_ids))]
+        rejected = np.arange(len(u_ids))
+        while True:
+            rejected = rejected[self.in_history(u_ids[rejected], neg_ids[rejected])]
+            if len(rejected) == 0:
+                break
+            neg_ids[rejected] = self.all_item_ids[rng.randint(self.all_item_len, size=len(rejected))]
+        return torch.from_numpy(neg_ids).type(torch.LongTensor)
+
+    def in_history(self, u_ids, i_ids):
+        """Whether each (user, item) pair of two arrays is a training interaction."""
+        keys = u_ids * self.dataset.item_num + i_ids
+        pos = np.searchsorted(self.history_keys, keys)
+        pos[pos == len(self.history_keys)] = 0
+        return self.history_keys[pos] == keys
 
     def _get_my_neighbors(self, id_str):
         ret_dict = {}
@@ -302,22 +404,25 @@ class TrainDataLoader(AbstractDataLoader):
         rd_id = random.sample(self.all_items, 1)[0]
         return rd_id
 
+    def _build_history_index(self):
+        """Sorted ``user * item_num + item`` keys of the training interactions, for :meth:`in_history`.
+        """
+        users = self.dataset.get_field(self.dataset.uid_field).astype(np.int64)
+        items = self.dataset.get_field(self.dataset.iid_field).astype(np.int64)
+        self.history_keys = np.sort(users * self.dataset.item_num + items)
+
     def _get_history_items_u(self):
-        uid_field = self.dataset.uid_field
-        iid_field = self.dataset.iid_field
         # load avail items for all uid
-        uid_freq = self.dataset.df.groupby(uid_field)[iid_field]
-        for u, u_ls in uid_freq:
-            self.history_items_per_u[u] = set(u_ls.values)
+        indptr, items = self.dataset.group_by(self.dataset.uid_field)
+        for u in np.flatnonzero(np.diff(indptr)):
+            self.history_items_per_u[u] = set(items[indptr[u]: indptr[u + 1]])
         return self.history_items_per_u
 
     def _get_history_users_i(self):
-        uid_field = self.dataset.uid_field
-        iid_field = self.dataset.iid_field
-        # load avail items for all uid
-        iid_freq = self.dataset.df.groupby(iid_field)[uid_field]
-        for i, u_ls in iid_freq:
-            self.history_users_per_i[i] = set(u_ls.values)
+        # load avail users for all iid
+        indptr, users = self.dataset.group_by(self.dataset.iid_field)
+        for i in np.flatnonzero(np.diff(indptr)):
+            self.history_users_per_i[i] = set(users[indptr[i]: indptr[i + 1]])
         return self.history_users_per_i
 
 
@@ -336,7 +441,7 @@ class EvalDataLoader(AbstractDataLoader):
         self.eval_len_list = []
         self.train_pos_len_list = []
 
-        self.eval_u = self.dataset.df[self.dataset.uid_field].unique()
+        self.eval_u = np.unique(self.dataset.get_field(self.dataset.uid_field))
         # special for eval dataloader
         self.pos_items_per_u = self._get_pos_items_per_u(self.eval_u).to(self.device)
         self._get_eval_items_per_u(self.eval_u)
@@ -370,34 +475,33 @@ class EvalDataLoader(AbstractDataLoader):
         [[0, 0, ... , 1, ...],
          [0, 1, ... , 0, ...]]
         """
-        uid_field = self.additional_dataset.uid_field
-        iid_field = self.additional_dataset.iid_field
         # load avail items for all uid
-        uid_freq = self.additional_dataset.df.groupby(uid_field)[iid_field]
-        u_ids = []
-        i_ids = []
-        for i, u in enumerate(eval_users):
-            u_ls = uid_freq.get_group(u).values
-            i_len = len(u_ls)
-            self.train_pos_len_list.append(i_len)
-            u_ids.extend([i]*i_len)
-            i_ids.extend(u_ls)
-        return torch.tensor([u_ids, i_ids]).type(torch.LongTensor)
+        indptr, items = self.additional_dataset.group_by(self.additional_dataset.uid_field)
+        starts, ends = indptr[eval_users], indptr[eval_users + 1]
+        self.train_pos_len_list = ends - starts
+        u_ids = np.repeat(np.arange(len(eval_users)), self.train_pos_len_list)
+        # position of every (user, item) pair inside the grouped items
+        offsets = np.arange(len(u_ids)) - np.repeat(np.cumsum(self.train_pos_len_list) - self.train_pos_len_list,
+                                                     self.train_pos_len_list)
+        i_ids = items[starts[u_ids] + offsets]
+        return torch.from_numpy(np.stack((u_ids, i_ids.astype(np.int64)))).type(torch.LongTensor)
 
     def _get_eval_items_per_u(self, eval_users):
         """
         get evaluated items for each u
         :return:
         """
-        uid_field = self.dataset.uid_field
-        iid_field = self.dataset.iid_field
         # load avail items for all uid
-        uid_freq = self.dataset.df.groupby(uid_field)[iid_field]
+        indptr, items = self.dataset.group_by(self.dataset.uid_field)
         for u in eval_users:
-            u_ls = uid_freq.get_group(u).values
+            u_ls = items[indptr[u]: indptr[u + 1]]
             self.eval_len_list.append(len(u_ls))
             self.eval_items_per_u.append(u_ls)
         self.eval_len_list = np.asarray(self.eval_len_list)
+        # CSR of the evaluated items flattened to sorted (row, item) keys, for vectorized hit lookup
+        rows = np.repeat(np.arange(len(eval_users), dtype=np.int64), self.eval_len_list)
+        items = np.concatenate(self.eval_items_per_u).astype(np.int64) if len(rows) else rows
+        self.eval_items_keys = torch.from_numpy(np.sort(rows * self.dataset.item_num + items)).to(self.device)
 
     # return pos_items for each u
     def get_eval_items(self):
@@ -406,6 +510,9 @@ class EvalDataLoader(AbstractDataLoader):
     def get_eval_len_list(self):
         return self.eval_len_list
 
+    def get_eval_items_keys(self):
+        return self.eval_items_keys
+
     def get_eval_users(self):
         return self.eval_u.cpu()
 
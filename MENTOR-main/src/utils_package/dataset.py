@@ -9,7 +9,12 @@ import lmdb
 
 
 class RecDataset(object):
-    def __init__(self, config, df=None):
+    """Interactions kept as contiguous int32 user / item columns plus the split label.
+
+    The columns are loaded once and shared: a split or a shuffled dataset only holds an index array into them
+    (``index is None`` means all rows in file order).
+    """
+    def __init__(self, config, base=None, index=None):
         self.config = config
         self.logger = getLogger()
 
@@ -17,13 +22,15 @@ class RecDataset(object):
         self.dataset_name = config['dataset']
         self.dataset_path = os.path.abspath(config['data_path']+self.dataset_name)
 
-        # dataframe
+        # columns
         self.uid_field = self.config['USER_ID_FIELD']
         self.iid_field = self.config['ITEM_ID_FIELD']
         self.splitting_label = self.config['inter_splitting_label']
 
-        if df is not None:
-            self.df = df
+        if base is not None:
+            self.user_ids, self.item_ids, self.labels = base.user_ids, base.item_ids, base.labels
+            self.index = index
+            self.inter_num = len(self)
             return
         # if all files exists
         check_file_list = [self.config['inter_file_name']]
@@ -34,46 +41,50 @@ class RecDataset(object):
 
         # load rating file from data path?
         self.load_inter_graph(config['inter_file_name'])
-        self.item_num = int(max(self.df[self.iid_field].values)) + 1
-        self.user_num = int(max(self.df[self.uid_field].values)) + 1
+        self.index = None
+        self.inter_num = len(self)
+        self.item_num = int(self.item_ids.max()) + 1
+        self.user_num = int(self.user_ids.max()) + 1
 
     def load_inter_graph(self, file_name):
         inter_file = os.path.join(self.dataset_path, file_name)
         cols = [self.uid_field, self.iid_field, self.splitting_label]
-        self.df = pd.read_csv(inter_file, usecols=cols, sep=self.config['field_separator'])
-        if not self.df.columns.isin(cols).all():
+        df = pd.read_csv(inter_file, usecols=cols, sep=self.config['field_separator'])
+        if not df.columns.isin(cols).all():
             raise ValueError('File {} lost some required columns.'.format(inter_file))
+        self.user_ids = np.ascontiguousarray(df[self.uid_field].values, dtype=np.int32)
+        self.item_ids = np.ascontiguousarray(df[self.iid_field].values, dtype=np.int32)
+        self.labels = np.ascontiguousarray(df[self.splitting_label].values, dtype=np.int8)
 
     def split(self):
-        dfs = []
+        idxs = []
         # splitting into training/validation/test
+        labels = self.labels if self.index is None else self.labels[self.index]
         for i in range(3):
-            temp_df = self.df[self.df[self.splitting_label] == i].copy()
-            temp_df.drop(self.splitting_label, inplace=True, axis=1)        # no use again
-            dfs.append(temp_df)
+            idx = np.flatnonzero(labels == i)
+            idxs.append(idx if self.index is None else self.index[idx])
         if self.config['filter_out_cod_start_users']:
             # filtering out new users in val/test sets
-            train_u = set(dfs[0][self.uid_field].values)
+            train_u = np.unique(self.user_ids[idxs[0]])
             for i in [1, 2]:
-                dropped_inter = pd.Series(True, index=dfs[i].index)
-                dropped_inter ^= dfs[i][self.uid_field].isin(train_u)
-                dfs[i].drop(dfs[i].index[dropped_inter], inplace=True)
+                idxs[i] = idxs[i][np.isin(self.user_ids[idxs[i]], train_u)]
 
         # wrap as RecDataset
-        full_ds = [self.copy(_) for _ in dfs]
+        full_ds = [self.copy(_) for _ in idxs]
         return full_ds
 
-    def copy(self, new_df):
-        """Given a new interaction feature, return a new :class:`Dataset` object,
-                whose interaction feature is updated with ``new_df``, and all the other attributes the same.
+    def copy(self, new_index):
+        """Given a new row index, return a new :class:`Dataset` object sharing the interaction columns,
+                whose rows are those of ``new_index``, and all the other attributes the same.
 
                 Args:
-                    new_df (pandas.DataFrame): The new interaction feature need to be updated.
+                    new_index (numpy.ndarray): Rows of the shared interaction columns, in order.
+                        ``None`` stands for all rows.
 
                 Returns:
-                    :class:`~Dataset`: the new :class:`~Dataset` object, whose interaction feature has been updated.
+                    :class:`~Dataset`: the new :class:`~Dataset` object, viewing rows ``new_index``.
                 """
-        nxt = RecDataset(self.config, new_df)
+        nxt = RecDataset(self.config, base=self, index=new_index)
 
         nxt.item_num = self.item_num
         nxt.user_num = self.user_num
@@ -85,26 +96,51 @@ class RecDataset(object):
     def get_item_num(self):
         return self.item_num
 
+    def get_field(self, field):
+        """Values of ``field`` (user or item id) for all interactions, in the current order.
+        """
+        col = self.user_ids if field == self.uid_field else self.item_ids
+        return col if self.index is None else col[self.index]
+
+    def group_by(self, field):
+        """Group interactions by ``field``, keeping their current order within each group.
+
+        Returns:
+            tuple: ``(indptr, values)``, the CSR index over all ids of ``field`` and the ids of the other field.
+        """
+        other = self.iid_field if field == self.uid_field else self.uid_field
+        keys = self.get_field(field)
+        num = self.user_num if field == self.uid_field else self.item_num
+        order = np.argsort(keys, kind='stable')
+        indptr = np.zeros(num + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=num), out=indptr[1:])
+        return indptr, self.get_field(other)[order]
+
     def shuffle(self):
-        """Shuffle the interaction records inplace.
+        """Shuffle the interaction records. Only the row index is permuted, rebound rather than written
+        in place, so copies sharing the previous index keep their order.
         """
-        self.df = self.df.sample(frac=1, replace=False).reset_index(drop=True)
+        index = np.arange(len(self)) if self.index is None else self.index
+        self.index = index[np.random.permutation(len(index))]
 
     def __len__(self):
-        return len(self.df)
+        return len(self.user_ids) if self.index is None else len(self.index)
 
     def __getitem__(self, idx):
-        # Series result
-        return self.df.iloc[idx]
+        # array slices keyed by field
+        if self.index is None:
+            return {self.uid_field: self.user_ids[idx], self.iid_field: self.item_ids[idx]}
+        rows = self.index[idx]
+        return {self.uid_field: self.user_ids[rows], self.iid_field: self.item_ids[rows]}
 
     def __repr__(self):
         return self.__str__()
 
     def __str__(self):
         info = [self.dataset_name]
-        self.inter_num = len(self.df)
-        uni_u = pd.unique(self.df[self.uid_field])
-        uni_i = pd.unique(self.df[self.iid_field])
+        self.inter_num = len(self)
+        uni_u = np.unique(self.get_field(self.uid_field))
+        uni_i = np.unique(self.get_field(self.iid_field))
         tmp_user_num, tmp_item_num = 0, 0
         if self.uid_field:
             tmp_user_num = len(uni_u)
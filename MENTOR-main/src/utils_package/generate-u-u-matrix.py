@@ -1,47 +1,64 @@
 import numpy as np
-from collections import defaultdict
 from tqdm import tqdm
-import torch
-import pandas as pd
+from multiprocessing import Pool
 import os
+import shutil
 import yaml
 import argparse
+# run from utils_package, next to this script
+from user_graph import save_user_graph, read_train_edges, inter_matrix, block_topk
+from artifact_cache import file_digest
 
 
-def gen_user_matrix(all_edge, no_users):
-    edge_dict = defaultdict(set)
+_inter_mat = None
 
-    for edge in all_edge:
-        user, item = edge
-        edge_dict[user].add(item)
 
-    min_user = 0             # 0
-    num_user = no_users      # in our case, users/items ids start from 1
-    user_graph_matrix = torch.zeros(num_user, num_user)
-    key_list = list(edge_dict.keys())
-    key_list.sort()
-    bar = tqdm(total=len(key_list))
-    for head in range(len(key_list)):
-        bar.update(1)
-        for rear in range(head+1, len(key_list)):
-            head_key = key_list[head]
-            rear_key = key_list[rear]
-            # print(head_key, rear_key)
-            item_head = edge_dict[head_key]
-            item_rear = edge_dict[rear_key]
-            # print(len(user_head.intersection(user_rear)))
-            inter_len = len(item_head.intersection(item_rear))
-            if inter_len > 0:
-                user_graph_matrix[head_key-min_user][rear_key-min_user] = inter_len
-                user_graph_matrix[rear_key-min_user][head_key-min_user] = inter_len
+def _init_worker(inter_mat):
+    global _inter_mat
+    _inter_mat = inter_mat
+
+
+def _block_topk(args):
+    start, end, topk = args
+    return (start,) + block_topk(_inter_mat, start, end, topk)
+
+
+def gen_user_graph(inter_mat, out_dir, topk=200, block_size=1024, workers=None):
+    """Stream the top-k user-user graph to ``out_dir`` as raw CSR parts: ``counts.bin`` (int64 per user),
+    ``indices.bin`` and ``values.bin`` (int32 per neighbor). Blocks are written in user order as they complete,
+    so memory stays proportional to ``block_size``.
+    """
+    num_user = inter_mat.shape[0]
+    tasks = [(start, min(start + block_size, num_user), topk) for start in range(0, num_user, block_size)]
+    os.makedirs(out_dir, exist_ok=True)
+    files = [open(os.path.join(out_dir, name), 'wb') for name in ('counts.bin', 'indices.bin', 'values.bin')]
+    bar = tqdm(total=num_user)
+    with Pool(workers, initializer=_init_worker, initargs=(inter_mat,)) as pool:
+        for start, counts, indices, values in pool.imap(_block_topk, tasks):
+            for f, arr in zip(files, (counts, indices, values)):
+                arr.tofile(f)
+            bar.update(len(counts))
     bar.close()
+    for f in files:
+        f.close()
 
-    return user_graph_matrix
+
+def load_user_graph_parts(out_dir):
+    counts = np.fromfile(os.path.join(out_dir, 'counts.bin'), dtype=np.int64)
+    indices = np.memmap(os.path.join(out_dir, 'indices.bin'), dtype=np.int32, mode='r') \
+        if counts.sum() else np.zeros(0, dtype=np.int32)
+    values = np.memmap(os.path.join(out_dir, 'values.bin'), dtype=np.int32, mode='r') \
+        if counts.sum() else np.zeros(0, dtype=np.int32)
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    return indptr, indices, values
 
 
 if __name__ == 	'__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--dataset', '-d', type=str, default='baby', help='name of dataset')
+    parser.add_argument('--topk', type=int, default=200, help='neighbors kept per user')
+    parser.add_argument('--block_size', type=int, default=1024, help='users per A.A^T block')
+    parser.add_argument('--workers', type=int, default=None, help='processes, defaults to the number of cores')
     args = parser.parse_args()
     dataset_name = args.dataset
     print(f'Generating u-u matrix for {dataset_name} ...\n')
@@ -60,41 +77,17 @@ if __name__ == 	'__main__':
                 config.update(tmp_d)
 
     dataset_path = os.path.abspath('../' + config['data_path'] + dataset_name)
-    uid_field = config['USER_ID_FIELD']
-    iid_field = config['ITEM_ID_FIELD']
-    train_df = pd.read_csv(os.path.join(dataset_path, config['inter_file_name']), sep='\t')
-    num_user = len(pd.unique(train_df[uid_field]))
-    train_df = train_df[train_df['x_label'] == 0].copy()
-    train_data = train_df[[uid_field, iid_field]].to_numpy()
-    # item_item_pairs =[]
-    user_graph_matrix = gen_user_matrix(train_data, num_user)
+    inter_file = os.path.join(dataset_path, config['inter_file_name'])
+    train_data, num_user, num_item = read_train_edges(inter_file, config['USER_ID_FIELD'], config['ITEM_ID_FIELD'])
     #####################################################################generate user-user matrix
-    # pdb.set_trace()
-    user_graph = user_graph_matrix
-    # user_num = torch.zeros(num_user)
-    user_num = torch.zeros(num_user)
-
-    user_graph_dict = {}
-    item_graph_dict = {}
-    edge_list_i = []
-    edge_list_j = []
-
-    for i in range(num_user):
-        user_num[i] = len(torch.nonzero(user_graph[i]))
-        print("this is ", i, "num", user_num[i])
+    inter_mat = inter_matrix(train_data, num_user, num_item)
+    user_graph_path = os.path.join(dataset_path, config['user_graph_file'])
+    parts_dir = user_graph_path + '.parts'
+    gen_user_graph(inter_mat, parts_dir, topk=args.topk, block_size=args.block_size, workers=args.workers)
 
-    for i in range(num_user):
-        if user_num[i] <= 200:
-            user_i = torch.topk(user_graph[i],int(user_num[i]))
-            edge_list_i =user_i.indices.numpy().tolist()
-            edge_list_j =user_i.values.numpy().tolist()
-            edge_list = [edge_list_i, edge_list_j]
-            user_graph_dict[i] = edge_list
-        else:
-            user_i = torch.topk(user_graph[i], 200)
-            edge_list_i = user_i.indices.numpy().tolist()
-            edge_list_j = user_i.values.numpy().tolist()
-            edge_list = [edge_list_i, edge_list_j]
-            user_graph_dict[i] = edge_list
-    # pdb.set_trace()
-    np.save(os.path.join(dataset_path, config['user_graph_dict_file']), user_graph_dict, allow_pickle=True)
+    # neighbors in descending co-interaction count, CSR per user
+    indptr, indices, values = load_user_graph_parts(parts_dir)
+    # recorded so that MENTOR uses this graph only for the same interactions and topk
+    save_user_graph(user_graph_path, indptr, indices, values,
+                    inputs={'interactions': file_digest(inter_file), 'topk': args.topk})
+    shutil.rmtree(parts_dir)
@@ -0,0 +1,93 @@
+import os
+import math
+import inspect
+import numpy as np
+import scipy.sparse as sp
+
+
+def _label_propagation(adj, labels, n_labels, capacity, n_iter, n_first, rng):
+    # size-constrained label propagation: nodes move to the label most of their neighbors hold, best gains first,
+    # while that label has fewer than capacity nodes
+    n = adj.shape[0]
+    rows = np.arange(n)
+    idle = 0
+    for it in range(n_iter):
+        counts = (adj @ sp.csr_matrix((np.ones(n, dtype=np.float32), (rows, labels)), shape=(n, n_labels))).tocsr()
+        entry_row = np.repeat(rows, np.diff(counts.indptr))
+        # the label of most neighbors is the first entry of its row once sorted by descending count
+        nonempty = np.flatnonzero(np.diff(counts.indptr))
+        first = np.lexsort((-counts.data, entry_row))[counts.indptr[nonempty]]
+        best, gain = labels.copy(), np.zeros(n, dtype=np.float32)
+        best[nonempty] = counts.indices[first]
+        gain[nonempty] = counts.data[first]
+        current = counts.indices == labels[entry_row]
+        gain[entry_row[current]] -= counts.data[current]
+        # neighbors moving in the same round would keep trading labels: only one side of a bipartite graph, or a
+        # random half of the nodes, moves per round
+        active = (rows < n_first) == (it % 2 == 0) if n_first is not None else rng.random_sample(n) < 0.5
+        movers = np.flatnonzero((gain > 0) & active)
+        # grouped by target label, best gains first; a label takes as many as fit in its free capacity
+        movers = movers[np.lexsort((rng.random_sample(len(movers)), -gain[movers], best[movers]))]
+        target = best[movers]
+        rank = np.arange(len(movers)) - np.searchsorted(target, target)
+        free = np.maximum(capacity - np.bincount(labels, minlength=n_labels), 0)
+        accepted = movers[rank < free[target]]
+        labels[accepted] = best[accepted]
+        idle = idle + 1 if len(accepted) == 0 else 0
+        if idle == 2:
+            break
+    return labels
+
+
+def partition_graph(indptr, indices, n_parts, n_first=None, n_cluster_iter=20, n_refine_iter=10, imbalance=0.05,
+                    seed=0):
+    r"""Balanced ``n_parts``-way partition of an undirected graph given as a symmetric CSR adjacency.
+
+    Clusters are first grown from single nodes by size-constrained label propagation, none larger than a part.
+    The nodes, ordered by cluster, are then cut into ``n_parts`` ranges of equal size, which splits at most
+    ``n_parts - 1`` clusters. Size-constrained label propagation over the parts finally moves nodes to the part
+    holding most of their neighbors while it has fewer than ``(1 + imbalance) * n / n_parts`` nodes.
+
+    Args:
+        indptr (numpy.ndarray): CSR row pointers.
+        indices (numpy.ndarray): CSR column indices, every edge stored in both directions.
+        n_parts (int): number of parts.
+        n_first (int, optional): for a bipartite graph between the first ``n_first`` nodes and the others, e.g.
+            users and items, rounds of label propagation alternate between the two sides.
+        n_cluster_iter (int): label propagation rounds of the clustering.
+        n_refine_iter (int): label propagation rounds of the refinement.
+        imbalance (float): allowed excess of a part over the average size.
+        seed (int): seed of the tie breaking, independent of the global RNG.
+
+    Returns:
+        numpy.ndarray: the part of every node, int64.
+    """
+    n = len(indptr) - 1
+    n_parts = max(1, min(n_parts, n))
+    adj = sp.csr_matrix((np.ones(len(indices), dtype=np.float32), np.asarray(indices), np.asarray(indptr)),
+                        shape=(n, n))
+    capacity = int(math.ceil((1 + imbalance) * n / n_parts))
+    rng = np.random.RandomState(seed)
+    clusters = _label_propagation(adj, np.arange(n), n, capacity, n_cluster_iter, n_first, rng)
+    parts = np.empty(n, dtype=np.int64)
+    parts[np.argsort(clusters, kind='stable')] = np.arange(n) * n_parts // n
+    return _label_propagation(adj, parts, n_parts, capacity, n_refine_iter, n_first, rng)
+
+
+def load_partition(directory, graph_digest, indptr, indices, n_parts, **kwargs):
+    r"""Partition of :func:`partition_graph`, computed on the first call and stored in ``directory`` under a name
+    made of ``graph_digest``, a digest of the graph, and all other arguments of :func:`partition_graph`.
+    """
+    arguments = inspect.signature(partition_graph).bind(indptr, indices, n_parts, **kwargs)
+    arguments.apply_defaults()
+    tag = '-'.join('{}{}'.format(k, v) for k, v in arguments.arguments.items() if k not in ('indptr', 'indices'))
+    path = os.path.join(directory, 'partition-{}-{}.npy'.format(graph_digest, tag))
+    if os.path.isfile(path):
+        return np.load(path)
+    parts = partition_graph(indptr, indices, n_parts, **kwargs)
+    # write next to the target and rename, concurrent runs only race on identical content
+    tmp_path = '{}.tmp{}'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, parts)
+    os.replace(tmp_path, path)
+    return parts
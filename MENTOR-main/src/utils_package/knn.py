@@ -0,0 +1,125 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+import torch
+import torch.nn.functional as F
+
+
+def _block_rows(n_cols, element_size, memory_budget, n_threads=1):
+    # rows of an (rows x n_cols) similarity block so that n_threads blocks fit in memory_budget MB
+    return max(1, int(memory_budget * 2 ** 20 / (n_threads * n_cols * element_size)))
+
+
+def _map_blocks(fn, starts, n_threads):
+    if n_threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(n_threads) as executor:
+            return list(executor.map(fn, starts))
+    return [fn(start) for start in starts]
+
+
+def _topk_rows(queries, base, k, memory_budget, n_threads=1):
+    # exact top-k of queries against base, both normalized, one block of query rows at a time
+    block_rows = min(_block_rows(len(base), base.element_size(), memory_budget, n_threads), len(queries))
+
+    def _block_topk(start):
+        sim = torch.mm(queries[start: start + block_rows], base.transpose(1, 0))
+        return torch.topk(sim, k, dim=-1)[1]
+
+    return torch.cat(_map_blocks(_block_topk, range(0, len(queries), block_rows), n_threads), dim=0)
+
+
+def knn_blockwise(embeddings, k, memory_budget=1024, n_threads=1):
+    r"""Exact cosine kNN of the rows of ``embeddings``, without materializing the ``n x n`` similarity.
+
+    Similarities are computed for one block of rows at a time against all rows and reduced to their top-k
+    right away, so at most ``memory_budget`` MB of similarity blocks are alive at once. The blocks can be spread
+    over ``n_threads`` threads, the matmul and topk kernels release the GIL.
+
+    Args:
+        embeddings (torch.Tensor): ``n x d`` features.
+        k (int): neighbors per row, the row itself included as with ``torch.topk`` over the full matrix.
+        memory_budget (float): MB for the similarity blocks held at once.
+        n_threads (int): blocks computed concurrently. Each block's kernels already use all torch threads, so
+            more than one only pays off on CPU with ``torch.get_num_threads()`` lowered to keep
+            ``n_threads * torch.get_num_threads()`` within the core count.
+
+    Returns:
+        torch.LongTensor: ``n x k`` indices of the most similar rows, in descending similarity.
+    """
+    context_norm = embeddings.div(torch.norm(embeddings, p=2, dim=-1, keepdim=True))
+    return _topk_rows(context_norm, context_norm, k, memory_budget, n_threads)
+
+
+def knn_ivf(embeddings, k, memory_budget=1024, n_threads=1, n_lists=None, n_probe=8, n_iter=10,
+            n_train=256, seed=0):
+    r"""Approximate cosine kNN with an IVF coarse quantizer and exact re-ranking.
+
+    Rows are clustered by spherical k-means into ``n_lists`` inverted lists. The queries of one list are
+    re-ranked exactly against the rows of the ``n_probe`` lists closest to its centroid, so the cost is about
+    ``n * n_probe / n_lists`` of the exact search. Takes the same ``memory_budget`` / ``n_threads`` as
+    :func:`knn_blockwise`, list groups are spread over the threads.
+
+    Args:
+        n_lists (int, optional): inverted lists, defaults to ``4 * sqrt(n)``.
+        n_probe (int): lists searched per query list.
+        n_iter (int): k-means iterations.
+        n_train (int): k-means training rows per list.
+        seed (int): seed of the k-means sampling, independent of the global RNG.
+
+    Returns:
+        torch.LongTensor: ``n x k`` indices of the most similar rows found, in descending similarity.
+    """
+    x = embeddings.div(torch.norm(embeddings, p=2, dim=-1, keepdim=True))
+    n, device = x.shape[0], x.device
+    n_lists = min(n_lists or max(1, int(4 * math.sqrt(n))), n)
+    n_probe = min(n_probe, n_lists)
+    generator = torch.Generator(device=device).manual_seed(seed)
+
+    # spherical k-means on a sample
+    train = x[torch.randperm(n, generator=generator, device=device)[:min(n, n_train * n_lists)]]
+    centroids = train[torch.randperm(len(train), generator=generator, device=device)[:n_lists]].clone()
+    for _ in range(n_iter):
+        assign = _topk_rows(train, centroids, 1, memory_budget).squeeze(1)
+        sums = torch.zeros_like(centroids).index_add_(0, assign, train)
+        counts = torch.bincount(assign, minlength=n_lists).unsqueeze(1)
+        centroids = torch.where(counts > 0, F.normalize(sums, dim=1), centroids)    # empty lists stay put
+
+    assign = _topk_rows(x, centroids, 1, memory_budget).squeeze(1)
+    order = torch.argsort(assign)
+    list_ptr = torch.cat((torch.zeros(1, dtype=torch.long, device=device),
+                          torch.cumsum(torch.bincount(assign, minlength=n_lists), 0))).tolist()
+    probe = _topk_rows(centroids, centroids, n_probe, memory_budget).tolist()
+
+    def _list_knn(c):
+        queries = order[list_ptr[c]: list_ptr[c + 1]]
+        if len(queries) == 0:
+            return queries, None
+        cand = torch.cat([order[list_ptr[p]: list_ptr[p + 1]] for p in probe[c]])
+        if len(cand) < k:
+            cand = torch.arange(n, device=device)
+        return queries, cand[_topk_rows(x[queries], x[cand], k, memory_budget)]
+
+    knn_ind = torch.empty((n, k), dtype=torch.long, device=device)
+    for queries, neighbors in _map_blocks(_list_knn, range(n_lists), n_threads):
+        if neighbors is not None:
+            knn_ind[queries] = neighbors
+    return knn_ind
+
+
+def knn_recall(embeddings, knn_ind, k, n_samples=1000, memory_budget=1024, seed=0):
+    r"""Recall@k of ``knn_ind`` against the exact cosine kNN, measured on ``n_samples`` random rows.
+    """
+    x = embeddings.div(torch.norm(embeddings, p=2, dim=-1, keepdim=True))
+    generator = torch.Generator(device=x.device).manual_seed(seed)
+    rows = torch.randperm(x.shape[0], generator=generator, device=x.device)[:n_samples]
+    exact = _topk_rows(x[rows], x, k, memory_budget)
+    hits = (knn_ind[rows].unsqueeze(2) == exact.unsqueeze(1)).any(dim=2).sum().item()
+    return hits / (len(rows) * k)
+
+
+"""Backend name and kNN builder mapper, selected by ``knn_backend``.
+All builders take ``(embeddings, k, memory_budget, n_threads, **knn_backend_params)``.
+"""
+knn_backends = {
+    'exact': knn_blockwise,
+    'ivf': knn_ivf,
+}
@@ -3,7 +3,7 @@ import os
 from utils_package.utils import get_local_time
 
 
-def init_logger(config):
+def init_logger(config, logfilepath=None):
     """
     A logger that can show a message on standard output and write it into the
     file named `filename` simultaneously.
@@ -11,15 +11,18 @@ def init_logger(config):
 
     Args:
         config (Config): An instance object of Config, used to record parameter information.
+        logfilepath (str, optional): log file of the run to append to, e.g. from a sweep worker process.
+            Defaults to a new file under ``./log/``.
     """
-    LOGROOT = './log/'
-    dir_name = os.path.dirname(LOGROOT)
-    if not os.path.exists(dir_name):
-        os.makedirs(dir_name)
+    if logfilepath is None:
+        LOGROOT = './log/'
+        dir_name = os.path.dirname(LOGROOT)
+        if not os.path.exists(dir_name):
+            os.makedirs(dir_name)
 
-    logfilename = '{}-{}-{}.log'.format(config['model'], config['dataset'], get_local_time())
+        logfilename = '{}-{}-{}.log'.format(config['model'], config['dataset'], get_local_time())
 
-    logfilepath = os.path.join(LOGROOT, logfilename)
+        logfilepath = os.path.join(LOGROOT, logfilename)
 
     filefmt = "%(asctime)-15s %(levelname)s %(message)s"
     filedatefmt = "%a %d %b %Y %H:%M:%S"
@@ -41,7 +44,8 @@ def init_logger(config):
     else:
         level = logging.INFO
     # comment following 3 lines and handlers = [sh, fh] to cancel file dump.
-    fh = logging.FileHandler(logfilepath, 'w', 'utf-8')
+    # appended by every process of a sweep, each write lands at the current end
+    fh = logging.FileHandler(logfilepath, 'a', 'utf-8')
     fh.setLevel(level)
     fh.setFormatter(fileformatter)
 
@@ -1,6 +1,16 @@
 from logging import getLogger
+from functools import lru_cache
 
 import numpy as np
+import torch
+
+
+@lru_cache(maxsize=None)
+def _idcg_table(max_k):
+    r"""Ideal DCG of a list of length ``max_k`` with the first ``i + 1`` positions relevant, for every ``i``.
+    Computed once per ``max_k``; callers must not modify the returned array.
+    """
+    return np.cumsum(1.0 / np.log2(np.arange(1, max_k + 1) + 1))
 
 
 def recall_(pos_index, pos_len):
@@ -39,14 +49,13 @@ def ndcg_(pos_index, pos_len):
     :math:`2^{rel_i}` equals to 1 if the item hits otherwise 0.
     :math:`U^{te}` is for all users in the test set.
     """
-    len_rank = np.full_like(pos_len, pos_index.shape[1])
+    max_k = pos_index.shape[1]
+    len_rank = np.full_like(pos_len, max_k)
     idcg_len = np.where(pos_len > len_rank, len_rank, pos_len)
 
-    iranks = np.zeros_like(pos_index, dtype=np.float64)
-    iranks[:, :] = np.arange(1, pos_index.shape[1] + 1)
-    idcg = np.cumsum(1.0 / np.log2(iranks + 1), axis=1)
-    for row, idx in enumerate(idcg_len):
-        idcg[row, idx:] = idcg[row, idx - 1]
+    # the ideal DCG stops growing after idcg_len positions; users without positives take the full-length value
+    idcg_pos = np.minimum(np.arange(max_k), idcg_len.reshape(-1, 1) - 1) % max_k
+    idcg = _idcg_table(max_k)[idcg_pos]
 
     ranks = np.zeros_like(pos_index, dtype=np.float64)
     ranks[:, :] = np.arange(1, pos_index.shape[1] + 1)
@@ -75,11 +84,10 @@ def map_(pos_index, pos_len):
     sum_pre = np.cumsum(pre * pos_index.astype(np.float64), axis=1)
     len_rank = np.full_like(pos_len, pos_index.shape[1])
     actual_len = np.where(pos_len > len_rank, len_rank, pos_len)
-    result = np.zeros_like(pos_index, dtype=np.float64)
-    for row, lens in enumerate(actual_len):
-        ranges = np.arange(1, pos_index.shape[1]+1)
-        ranges[lens:] = ranges[lens - 1]
-        result[row] = sum_pre[row] / ranges
+    # normalization min(m, N) per position; users without positives take N
+    ranges = np.minimum(np.arange(1, pos_index.shape[1] + 1), actual_len.reshape(-1, 1))
+    ranges = np.where(actual_len.reshape(-1, 1) > 0, ranges, pos_index.shape[1])
+    result = sum_pre / ranges
     return result.mean(axis=0)
 
 
@@ -99,6 +107,49 @@ def precision_(pos_index, pos_len):
     return rec_ret.mean(axis=0)
 
 
+def recall_torch_(pos_index, pos_len):
+    rec_ret = torch.cumsum(pos_index, dim=1, dtype=torch.float64) / pos_len.double().view(-1, 1)
+    return rec_ret.mean(dim=0)
+
+
+def recall2_torch_(pos_index, pos_len):
+    rec_cum = torch.cumsum(pos_index, dim=1, dtype=torch.float64)
+    return rec_cum.sum(dim=0) / pos_len.double().sum()
+
+
+def ndcg_torch_(pos_index, pos_len):
+    r"""Same as :func:`ndcg_` on a torch bool ``pos_index``, computed on its device.
+    """
+    max_k = pos_index.shape[1]
+    ranks = torch.arange(max_k, device=pos_index.device)
+    idcg_len = pos_len.clamp(max=max_k)
+    idcg_pos = torch.minimum(ranks.unsqueeze(0), idcg_len.view(-1, 1) - 1) % max_k
+    idcg = torch.from_numpy(_idcg_table(max_k)).to(pos_index.device)[idcg_pos]
+
+    dcg = 1.0 / torch.log2(ranks.double() + 2)
+    dcg = torch.cumsum(torch.where(pos_index, dcg, torch.zeros_like(dcg)), dim=1)
+    return (dcg / idcg).mean(dim=0)
+
+
+def map_torch_(pos_index, pos_len):
+    r"""Same as :func:`map_` on a torch bool ``pos_index``, computed on its device.
+    """
+    max_k = pos_index.shape[1]
+    positions = torch.arange(1, max_k + 1, device=pos_index.device)
+    pre = torch.cumsum(pos_index, dim=1, dtype=torch.float64) / positions
+    sum_pre = torch.cumsum(pre * pos_index.double(), dim=1)
+    actual_len = pos_len.clamp(max=max_k).view(-1, 1)
+    ranges = torch.where(actual_len > 0, torch.minimum(positions.unsqueeze(0), actual_len),
+                         torch.full_like(actual_len, max_k))
+    return (sum_pre / ranges).mean(dim=0)
+
+
+def precision_torch_(pos_index, pos_len):
+    positions = torch.arange(1, pos_index.shape[1] + 1, device=pos_index.device)
+    rec_ret = torch.cumsum(pos_index, dim=1, dtype=torch.float64) / positions
+    return rec_ret.mean(dim=0)
+
+
 """Function name and function mapper.
 Useful when we have to serialize evaluation metric names
 and call the functions based on deserialized names
@@ -110,3 +161,12 @@ metrics_dict = {
     'precision': precision_,
     'map': map_,
 }
+
+# torch counterparts, taking a bool tensor ``pos_index`` and a tensor ``pos_len`` on the same device
+torch_metrics_dict = {
+    'ndcg': ndcg_torch_,
+    'recall': recall_torch_,
+    'recall2': recall2_torch_,
+    'precision': precision_torch_,
+    'map': map_torch_,
+}
@@ -5,8 +5,124 @@ from utils_package.dataloader import TrainDataLoader, EvalDataLoader
 from utils_package.logger import init_logger
 from utils_package.configurator import Config
 from utils_package.utils import init_seed, get_model, get_trainer, dict2str
+from utils_package.sweep_scheduler import ASHAScheduler
+from common.checkpoint import checkpoint_file
+from common.abstract_recommender import share_features, set_shared_features
 import platform
 import os
+import copy
+import logging
+import torch
+import torch.multiprocessing
+
+
+# loaders and config of a sweep worker process, set once by _init_sweep_worker
+_sweep_state = {}
+
+
+def _available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _build_loaders(config, train_dataset, valid_dataset, test_dataset):
+    train_data = TrainDataLoader(config, train_dataset, batch_size=config['train_batch_size'], shuffle=True)
+    (valid_data, test_data) = (
+        EvalDataLoader(config, valid_dataset, additional_dataset=train_dataset, batch_size=config['eval_batch_size']),
+        EvalDataLoader(config, test_dataset, additional_dataset=train_dataset, batch_size=config['eval_batch_size']))
+    return train_data, valid_data, test_data
+
+
+def _warm_start_candidates(combinators, idx):
+    # combinations listed before idx, closest first: fewest differing hyper-parameters, then most recent
+    def distance(j):
+        return sum(a != b for a, b in zip(combinators[j], combinators[idx])), idx - j
+    return [combinators[j] for j in sorted(range(idx), key=distance)]
+
+
+def _run_combination(config, loaders, idx, total_loops, hyper_tuple, save_model, scheduler=None, neighbors=()):
+    r"""Train one hyper-parameter combination, warm-started from the first of ``neighbors`` with a best checkpoint
+    when ``warm_start`` is set.
+
+    Returns:
+        tuple: ``(best_valid_result, best_test_upon_valid)``
+    """
+    logger = getLogger()
+    train_data, valid_data, test_data = loaders
+    # random seed reset
+    for j, k in zip(config['hyper_parameters'], hyper_tuple):
+        config[j] = k
+    init_seed(config['seed'])
+
+    logger.info('========={}/{}: Parameters:{}={}======='.format(
+        idx+1, total_loops, config['hyper_parameters'], hyper_tuple))
+
+    # set random state of dataloader
+    train_data.pretrain_setup()
+    # model loading and initialization
+    model = get_model(config['model'])(config, train_data).to(config['device'])
+    logger.info(model)
+
+    # trainer loading and initialization
+    trainer = get_trainer()(config, model)
+    if scheduler is not None:
+        trainer.sweep_trial = scheduler.trial()
+    if config['warm_start']:
+        for neighbor in neighbors:
+            neighbor_file = checkpoint_file(config, neighbor, 'best')
+            if os.path.isfile(neighbor_file):
+                trainer.warm_start(neighbor_file)
+                break
+    # debug
+    # model training
+    best_valid_score, best_valid_result, best_test_upon_valid = trainer.fit(train_data, valid_data=valid_data, test_data=test_data, saved=save_model)
+    return best_valid_result, best_test_upon_valid
+
+
+def _init_sweep_worker(config, datasets, features, n_threads, save_model, scheduler, worker_ids, log_file):
+    # forked (CPU): the datasets are the parent's arrays, shared copy-on-write; spawned (CUDA): they are copies,
+    # the features are shared-memory tensors either way
+    if not logging.getLogger().handlers:
+        init_logger(config, log_file)
+    torch.set_num_threads(n_threads)
+    set_shared_features(features)
+    with worker_ids.get_lock():
+        worker_id = worker_ids.value
+        worker_ids.value += 1
+    if config['device'].type == 'cuda':
+        # workers take the visible GPUs in turn
+        config['device'] = torch.device('cuda', worker_id % torch.cuda.device_count())
+        torch.cuda.set_device(config['device'])
+    _sweep_state['config'] = config
+    _sweep_state['loaders'] = _build_loaders(config, *datasets)
+    _sweep_state['save_model'] = save_model
+    _sweep_state['scheduler'] = scheduler
+
+
+def _sweep_worker(task):
+    idx, total_loops, hyper_tuple, neighbors = task
+    return _run_combination(_sweep_state['config'], _sweep_state['loaders'], idx, total_loops, hyper_tuple,
+                            _sweep_state['save_model'], _sweep_state['scheduler'], neighbors)
+
+
+def _build_sweep_scheduler(config, rung_scores=None, lock=None):
+    if config['sweep_scheduler'].lower() != 'asha':
+        raise ValueError('sweep_scheduler [{}] is not supported, use asha'.format(config['sweep_scheduler']))
+    return ASHAScheduler(config['sweep_grace_period'] or 10, config['sweep_reduction_factor'] or 3,
+                         config['epochs'], config['valid_metric_bigger'], rung_scores, lock)
+
+
+def _warm_artifact_cache(config, datasets, hyper_tuple):
+    # build the derived graphs of the first combination once, on CPU, so that the workers only load them
+    # from the memory-mapped artifact cache instead of all building them at the same time
+    warm_config = copy.deepcopy(config)
+    warm_config['device'] = torch.device('cpu')
+    for j, k in zip(warm_config['hyper_parameters'], hyper_tuple):
+        warm_config[j] = k
+    init_seed(warm_config['seed'])
+    train_data = TrainDataLoader(warm_config, datasets[0], batch_size=warm_config['train_batch_size'], shuffle=True)
+    get_model(warm_config['model'])(warm_config, train_data)
 
 
 def quick_start(model, dataset, config_dict, save_model=True):
@@ -32,12 +148,6 @@ def quick_start(model, dataset, config_dict, save_model=True):
     logger.info('\n====Validation====\n' + str(valid_dataset))
     logger.info('\n====Testing====\n' + str(test_dataset))
 
-    # wrap into dataloader
-    train_data = TrainDataLoader(config, train_dataset, batch_size=config['train_batch_size'], shuffle=True)
-    (valid_data, test_data) = (
-        EvalDataLoader(config, valid_dataset, additional_dataset=train_dataset, batch_size=config['eval_batch_size']),
-        EvalDataLoader(config, test_dataset, additional_dataset=train_dataset, batch_size=config['eval_batch_size']))
-
     ############ Dataset loadded, run model
     hyper_ret = []
     val_metric = config['valid_metric'].lower()
@@ -55,40 +165,72 @@ def quick_start(model, dataset, config_dict, save_model=True):
     # combinations
     combinators = list(product(*hyper_ls))
     total_loops = len(combinators)
-    for hyper_tuple in combinators:
-        # random seed reset
-        for j, k in zip(config['hyper_parameters'], hyper_tuple):
-            config[j] = k
-        init_seed(config['seed'])
-
-        logger.info('========={}/{}: Parameters:{}={}======='.format(
-            idx+1, total_loops, config['hyper_parameters'], hyper_tuple))
-
-        # set random state of dataloader
-        train_data.pretrain_setup()
-        # model loading and initialization
-        model = get_model(config['model'])(config, train_data).to(config['device'])
-        logger.info(model)
-
-        # trainer loading and initialization
-        trainer = get_trainer()(config, model)
-        # debug
-        # model training
-        best_valid_score, best_valid_result, best_test_upon_valid = trainer.fit(train_data, valid_data=valid_data, test_data=test_data, saved=save_model)
-        #########
-        hyper_ret.append((hyper_tuple, best_valid_result, best_test_upon_valid))
-
-        # save best test
-        if best_test_upon_valid[val_metric] > best_test_value:
-            best_test_value = best_test_upon_valid[val_metric]
-            best_test_idx = idx
-        idx += 1
-
-        logger.info('best valid result: {}'.format(dict2str(best_valid_result)))
-        logger.info('test result: {}'.format(dict2str(best_test_upon_valid)))
-        logger.info('████Current BEST████:\nParameters: {}={},\n'
-                    'Valid: {},\nTest: {}\n\n\n'.format(config['hyper_parameters'],
-            hyper_ret[best_test_idx][0], dict2str(hyper_ret[best_test_idx][1]), dict2str(hyper_ret[best_test_idx][2])))
+    n_workers = config['sweep_workers'] if config['sweep_workers'] is not None else 1
+    n_threads = config['sweep_threads']
+    if n_workers == 0:
+        n_workers = max(1, _available_cores() // (n_threads or 1))
+    n_workers = min(n_workers, total_loops)
+    datasets = (train_dataset, valid_dataset, test_dataset)
+    if n_workers > 1:
+        n_threads = n_threads or max(1, _available_cores() // n_workers)
+        logger.info('Sweep: {} combinations on {} worker processes, {} threads each'.format(
+            total_loops, n_workers, n_threads))
+        _warm_artifact_cache(config, datasets, combinators[0])
+        features = share_features(config)
+        # CUDA is already initialized here and cannot be used in a forked child
+        context = torch.multiprocessing.get_context('spawn' if config['device'].type == 'cuda' else 'fork')
+        scheduler = manager = None
+        if config['sweep_scheduler']:
+            # rung scores shared by all workers
+            manager = context.Manager()
+            scheduler = _build_sweep_scheduler(config, manager.dict(), manager.Lock())
+        log_file = next((h.baseFilename for h in logging.getLogger().handlers
+                         if isinstance(h, logging.FileHandler)), None)
+        pool = context.Pool(n_workers, initializer=_init_sweep_worker,
+                            initargs=(config, datasets, features, n_threads, save_model, scheduler,
+                                      context.Value('i', 0), log_file))
+        tasks = [(i, total_loops, hyper_tuple, _warm_start_candidates(combinators, i))
+                 for i, hyper_tuple in enumerate(combinators)]
+        results = pool.imap(_sweep_worker, tasks)
+    else:
+        # wrap into dataloader
+        loaders = _build_loaders(config, *datasets)
+        pool = manager = None
+        scheduler = _build_sweep_scheduler(config) if config['sweep_scheduler'] else None
+        results = (_run_combination(config, loaders, i, total_loops, hyper_tuple, save_model, scheduler,
+                                    _warm_start_candidates(combinators, i))
+                   for i, hyper_tuple in enumerate(combinators))
+
+    try:
+        # results come back in combination order, so the bookkeeping matches a sequential sweep
+        for hyper_tuple, (best_valid_result, best_test_upon_valid) in zip(combinators, results):
+            hyper_ret.append((hyper_tuple, best_valid_result, best_test_upon_valid))
+
+            # save best test
+            if best_test_upon_valid[val_metric] > best_test_value:
+                best_test_value = best_test_upon_valid[val_metric]
+                best_test_idx = idx
+            idx += 1
+
+            logger.info('best valid result: {}'.format(dict2str(best_valid_result)))
+            logger.info('test result: {}'.format(dict2str(best_test_upon_valid)))
+            logger.info('████Current BEST████:\nParameters: {}={},\n'
+                        'Valid: {},\nTest: {}\n\n\n'.format(config['hyper_parameters'],
+                hyper_ret[best_test_idx][0], dict2str(hyper_ret[best_test_idx][1]),
+                dict2str(hyper_ret[best_test_idx][2])))
+    except BaseException:
+        if pool is not None:
+            # the combinations not run yet are abandoned
+            pool.terminate()
+        raise
+    else:
+        if pool is not None:
+            pool.close()
+    finally:
+        if pool is not None:
+            pool.join()
+        if manager is not None:
+            manager.shutdown()
 
     # log info
     logger.info('\n============All Over=====================')
@@ -0,0 +1,259 @@
+import multiprocessing
+from collections import deque
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+# sampler of a prefetch worker process, set once by _init_sample_worker
+_worker_sampler = {}
+
+
+def sample_neighbors(indptr, indices, values, nodes, fanout=None, rng=np.random):
+    r"""Sampled in-edges of ``nodes`` in a CSR adjacency whose rows are the destination nodes.
+
+    Rows with more than ``fanout`` edges keep a uniform random subset of ``fanout`` of them, and their weights are
+    scaled by ``degree / fanout`` so that the sampled aggregation is an unbiased estimate of the full one.
+
+    Args:
+        nodes (numpy.ndarray): destination rows.
+        fanout (int, optional): edges kept per row, all edges when ``None`` or negative.
+
+    Returns:
+        tuple: ``(dst, src, weight)`` of the kept edges, grouped by ``dst``: the position of the row in ``nodes``,
+        the global id of the source node and the edge weight.
+    """
+    starts = np.asarray(indptr[nodes], dtype=np.int64)
+    deg = np.asarray(indptr[nodes + 1], dtype=np.int64) - starts
+    row_offset = np.repeat(np.cumsum(deg) - deg, deg)
+    dst = np.repeat(np.arange(len(nodes)), deg)
+    edge = np.arange(len(dst)) - row_offset + np.repeat(starts, deg)
+    weight = np.asarray(values[edge], dtype=np.float32)
+    if fanout is not None and 0 <= fanout < (deg.max() if len(deg) else 0):
+        # random order within each row, then keep the first fanout edges of every row
+        order = np.lexsort((rng.random_sample(len(dst)), dst))
+        keep = np.sort(order[np.arange(len(dst)) - row_offset < fanout])
+        scale = (deg / np.maximum(np.minimum(deg, fanout), 1)).astype(np.float32)
+        dst, edge, weight = dst[keep], edge[keep], weight[keep] * scale[dst[keep]]
+    return dst, np.asarray(indices[edge], dtype=np.int64), weight
+
+
+def extend_nodes(nodes, src):
+    r"""``nodes`` followed by the ids of ``src`` not in it, in order of first appearance, and the positions of
+    ``src`` in the result. ``nodes`` must be unique; it stays a prefix, so the rows of a block are its first nodes.
+    """
+    uniq, first = np.unique(np.concatenate((nodes, src)), return_index=True)
+    order = np.argsort(first, kind='stable')
+    local = np.empty(len(uniq), dtype=np.int64)
+    local[order] = np.arange(len(uniq))
+    return uniq[order], local[np.searchsorted(uniq, src)]
+
+
+def sample_blocks(csr, nodes, fanouts, rng=np.random):
+    r"""Computation graph of ``nodes`` over ``len(fanouts)`` hops.
+
+    Returns:
+        tuple: ``(nodes, blocks)``: the node ids it reads, ``nodes`` first, and one ``(indptr, indices, values,
+        shape)`` CSR block per hop, outermost first, mapping the nodes of hop ``l + 1`` to those of hop ``l``.
+    """
+    blocks = []
+    for fanout in fanouts:
+        dst, src, weight = sample_neighbors(*csr, nodes, fanout, rng)
+        src_nodes, src_local = extend_nodes(nodes, src)
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(dst, minlength=len(nodes)))))
+        blocks.append((indptr, src_local, weight, (len(nodes), len(src_nodes))))
+        nodes = src_nodes
+    return nodes, blocks[::-1]
+
+
+class SubgraphSampler(object):
+    r"""Samples the part of the user-item and item-item graphs that a training batch reads.
+
+    The items of the batch are first extended by their ``mm_layers``-hop neighborhood in the item-item graph,
+    taken in full since its rows have ``knn_k`` entries. These items and the batch users are the targets of the
+    user-item propagation, whose computation graph is sampled with ``fanouts[l]`` neighbors per node at hop ``l``.
+    Samples are plain numpy arrays, drawn ahead of training by :meth:`prefetch` in a pool of ``n_workers``
+    processes, started on the first epoch and kept until :meth:`close`.
+
+    Args:
+        ui_csr (tuple): ``(indptr, indices, values)`` of the normalized user-item adjacency, users first.
+        mm_csr (tuple): ``(indptr, indices, values)`` of the item-item adjacency.
+        n_users (int): number of users, the offset of item ids in the user-item graph.
+        fanouts (list): neighbors per node at each user-item hop, ``None`` or ``-1`` for all of them.
+        mm_layers (int): hops of the item-item graph.
+        n_workers (int): sampling processes, ``0`` samples in the training process.
+        queue_depth (int): batches sampled ahead.
+        start_method (str): how the pool starts its processes, ``forkserver`` once the parent initialized CUDA.
+    """
+    def __init__(self, ui_csr, mm_csr, n_users, fanouts, mm_layers, n_workers=2, queue_depth=4, start_method='fork'):
+        self.ui_csr = ui_csr
+        self.mm_csr = mm_csr
+        self.n_users = n_users
+        self.fanouts = list(fanouts)
+        self.mm_layers = mm_layers
+        self.n_workers = n_workers
+        self.queue_depth = max(queue_depth, 1)
+        self.start_method = start_method
+        self._pool = None
+
+    def __getstate__(self):
+        # a forkserver worker gets the sampler pickled, without the pool
+        state = self.__dict__.copy()
+        state['_pool'] = None
+        return state
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+    def sample(self, users, items, seed=None):
+        r"""Subgraph of one batch.
+
+        Args:
+            users (numpy.ndarray): user ids of the batch.
+            items (numpy.ndarray): item ids of the batch, positives and negatives.
+            seed (int, optional): seed of the neighbor sampling.
+
+        Returns:
+            dict: ``nodes`` the user-item node ids to embed, ``n_users`` the number of batch users (they lead the
+            targets, followed by the ``items`` of the item-item hops), ``ui_blocks`` and ``mm_blocks`` the CSR blocks
+            of both graphs, ``user_rows`` / ``item_rows`` the rows of ``users`` / ``items`` among the targets.
+        """
+        rng = np.random.RandomState(seed)
+        batch_users, user_rows = np.unique(users, return_inverse=True)
+        batch_items, item_rows = np.unique(items, return_inverse=True)
+        mm_items, mm_blocks = sample_blocks(self.mm_csr, batch_items, [None] * self.mm_layers, rng)
+        targets = np.concatenate((batch_users, mm_items + self.n_users))
+        nodes, ui_blocks = sample_blocks(self.ui_csr, targets, self.fanouts, rng)
+        return {'nodes': nodes, 'n_users': len(batch_users), 'items': mm_items, 'ui_blocks': ui_blocks,
+                'mm_blocks': mm_blocks, 'user_rows': user_rows, 'item_rows': item_rows}
+
+    def prefetch(self, batches):
+        r"""Yield ``(interaction, subgraph)`` for the ``[user, pos, neg]`` batches of a training loader, keeping
+        ``queue_depth`` subgraphs in flight. Each batch's seed is drawn from the global numpy RNG right after the
+        batch is read, as in the single-process path, so the samples do not depend on ``n_workers``.
+        """
+        # a daemonic process, e.g. a sweep worker, may not fork
+        if self.n_workers <= 0 or multiprocessing.current_process().daemon:
+            for interaction in batches:
+                yield interaction, self.sample(*self._batch_ids(interaction), np.random.randint(2 ** 31))
+            return
+        if self._pool is None:
+            self._pool = multiprocessing.get_context(self.start_method).Pool(
+                self.n_workers, initializer=_init_sample_worker, initargs=(self,))
+        pending = deque()
+        for interaction in batches:
+            pending.append((interaction, self._pool.apply_async(
+                _sample_worker, (*self._batch_ids(interaction), np.random.randint(2 ** 31)))))
+            if len(pending) > self.queue_depth:
+                interaction, result = pending.popleft()
+                yield interaction, result.get()
+        while pending:
+            interaction, result = pending.popleft()
+            yield interaction, result.get()
+
+    @staticmethod
+    def _batch_ids(interaction):
+        # copies: the model shifts the item rows of the interaction in place
+        interaction = interaction.cpu().numpy()
+        return interaction[0].copy(), np.concatenate((interaction[1], interaction[2]))
+
+
+class ClusterSampler(object):
+    r"""Cluster-GCN batches over a partition of the user-item graph.
+
+    Each step trains on the union of ``clusters_per_batch`` parts, drawn without replacement in a random order
+    every epoch: the positive pairs are the training interactions inside the union, each with a negative item of
+    the union outside the user's history, and propagation runs over the subgraphs of the user-item and item-item
+    graphs induced by the union, with the weights of the full graphs. :meth:`prefetch` yields the same
+    ``(interaction, subgraph)`` pairs as :meth:`SubgraphSampler.prefetch`, so memory per step is bounded by the
+    size of ``clusters_per_batch`` parts.
+
+    Args:
+        ui_csr (tuple): ``(indptr, indices, values)`` of the normalized user-item adjacency, users first.
+        mm_csr (tuple): ``(indptr, indices, values)`` of the item-item adjacency.
+        n_users (int): number of users, the offset of item ids in the user-item graph.
+        parts (numpy.ndarray): part of every user-item node.
+        interactions (numpy.ndarray): ``n x 2`` training (user, item) pairs.
+        clusters_per_batch (int): parts per step.
+        ui_layers (int): hops of the user-item graph.
+        mm_layers (int): hops of the item-item graph.
+    """
+    def __init__(self, ui_csr, mm_csr, n_users, parts, interactions, clusters_per_batch, ui_layers, mm_layers):
+        indptr, indices, values = ui_csr
+        self.ui_adj = sp.csr_matrix((values, indices, indptr), shape=(len(indptr) - 1, len(indptr) - 1))
+        indptr, indices, values = mm_csr
+        self.mm_adj = sp.csr_matrix((values, indices, indptr), shape=(len(indptr) - 1, len(indptr) - 1))
+        self.n_users = n_users
+        self.parts = np.asarray(parts, dtype=np.int64)
+        self.n_parts = int(self.parts.max()) + 1
+        self.clusters_per_batch = max(1, clusters_per_batch)
+        self.ui_layers = ui_layers
+        self.mm_layers = mm_layers
+        # nodes and interactions grouped by part, interactions by the part of their user
+        self.part_nodes = np.argsort(self.parts, kind='stable')
+        self.part_ptr = np.concatenate(([0], np.cumsum(np.bincount(self.parts, minlength=self.n_parts))))
+        users, items = np.asarray(interactions[:, 0], dtype=np.int64), np.asarray(interactions[:, 1], dtype=np.int64)
+        user_parts = self.parts[users]
+        order = np.argsort(user_parts, kind='stable')
+        self.users, self.items = users[order], items[order]
+        self.inter_ptr = np.concatenate(([0], np.cumsum(np.bincount(user_parts, minlength=self.n_parts))))
+
+    def sample(self, group, in_history, rng=np.random):
+        r"""``(interaction, subgraph)`` of the parts in ``group``, ``None`` when they hold no interaction.
+
+        Args:
+            group (numpy.ndarray): parts of the step.
+            in_history (callable): whether each ``(user, item)`` pair of two arrays is a training interaction.
+        """
+        nodes = np.sort(np.concatenate([self.part_nodes[self.part_ptr[p]: self.part_ptr[p + 1]] for p in group]))
+        n_users = int(np.searchsorted(nodes, self.n_users))
+        items = nodes[n_users:] - self.n_users
+        in_group = np.zeros(self.n_parts, dtype=bool)
+        in_group[group] = True
+        edges = np.concatenate([np.arange(self.inter_ptr[p], self.inter_ptr[p + 1]) for p in group])
+        edges = edges[in_group[self.parts[self.items[edges] + self.n_users]]]
+        users, pos = self.users[edges], self.items[edges]
+        # negatives among the items of the group outside the user's history, redrawn until none is in it; the
+        # interactions of a user holding every item of the group have no negative and are left out
+        has_negative = np.bincount(users, minlength=self.n_users)[users] < len(items)
+        users, pos = users[has_negative], pos[has_negative]
+        if len(users) == 0:
+            return None
+        neg = items[rng.randint(len(items), size=len(users))]
+        rejected = np.arange(len(users))
+        while True:
+            rejected = rejected[in_history(users[rejected], neg[rejected])]
+            if len(rejected) == 0:
+                break
+            neg[rejected] = items[rng.randint(len(items), size=len(rejected))]
+
+        def induced(adj, rows):
+            block = adj[rows][:, rows].tocsr()
+            block.sort_indices()
+            return block.indptr, block.indices, block.data, block.shape
+
+        ui_block, mm_block = induced(self.ui_adj, nodes), induced(self.mm_adj, items)
+        subgraph = {'nodes': nodes, 'n_users': n_users, 'items': items, 'ui_blocks': [ui_block] * self.ui_layers,
+                    'mm_blocks': [mm_block] * self.mm_layers, 'user_rows': np.searchsorted(nodes[:n_users], users),
+                    'item_rows': np.searchsorted(items, np.concatenate((pos, neg)))}
+        return torch.from_numpy(np.stack((users, pos, neg))), subgraph
+
+    def prefetch(self, train_data):
+        r"""Yield the ``(interaction, subgraph)`` steps of one epoch; ``train_data`` only provides the training
+        history for the negatives.
+        """
+        order = np.random.permutation(self.n_parts)
+        for start in range(0, self.n_parts, self.clusters_per_batch):
+            step = self.sample(order[start: start + self.clusters_per_batch], train_data.in_history)
+            if step is not None:
+                yield step
+
+
+def _init_sample_worker(sampler):
+    # forked: the graph arrays are the parent's, shared copy-on-write; from a forkserver: a copy
+    _worker_sampler['sampler'] = sampler
+
+
+def _sample_worker(users, items, seed):
+    return _worker_sampler['sampler'].sample(users, items, seed)
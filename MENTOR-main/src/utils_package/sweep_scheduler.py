@@ -0,0 +1,63 @@
+import math
+import threading
+import numpy as np
+
+
+class ASHAScheduler(object):
+    r"""Asynchronous successive halving (ASHA) over the combinations of a hyper-parameter sweep.
+
+    Rungs are placed at ``grace_period * reduction_factor ** k`` epochs. When a combination first evaluates at or
+    past a rung, its best validation score so far is recorded there and it keeps training only if that score is
+    in the top ``1 / reduction_factor`` of all scores recorded at the rung, otherwise it is stopped and its budget
+    goes to the remaining combinations. Decisions only use the scores recorded so far, so combinations never wait
+    for each other; ``rung_scores`` and ``lock`` may be manager proxies shared by worker processes.
+
+    Args:
+        grace_period (int): epochs of the first rung, no combination is stopped before.
+        reduction_factor (int): ``1 / reduction_factor`` of the combinations pass each rung.
+        max_epochs (int): training budget of one combination, no rung is placed at or past it.
+        bigger (bool): whether a bigger validation score is better.
+    """
+    def __init__(self, grace_period=10, reduction_factor=3, max_epochs=1000, bigger=True, rung_scores=None,
+                 lock=None):
+        if grace_period < 1 or reduction_factor < 2:
+            raise ValueError('ASHA needs grace_period >= 1 and reduction_factor >= 2, got {} and {}'.format(
+                grace_period, reduction_factor))
+        self.reduction_factor = reduction_factor
+        self.bigger = bigger
+        n_rungs = int(math.log(max(max_epochs / grace_period, 1), reduction_factor) + 1e-9) + 1
+        self.milestones = [grace_period * reduction_factor ** k for k in range(n_rungs)
+                           if grace_period * reduction_factor ** k < max_epochs]
+        self.rung_scores = rung_scores if rung_scores is not None else {}
+        self.lock = lock if lock is not None else threading.Lock()
+
+    def trial(self):
+        r"""Rung tracker of one combination, consulted by :class:`~common.trainer.Trainer` after each validation."""
+        return ASHATrial(self)
+
+    def record(self, milestone, score):
+        r"""Record ``score`` at ``milestone`` and return whether it passes the rung."""
+        with self.lock:
+            scores = list(self.rung_scores.get(milestone, [])) + [score]
+            self.rung_scores[milestone] = scores
+        signed = np.asarray(scores, dtype=np.float64) * (1 if self.bigger else -1)
+        cutoff = np.percentile(signed, (1 - 1 / self.reduction_factor) * 100)
+        return signed[-1] >= cutoff
+
+
+class ASHATrial(object):
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.next_rung = 0
+
+    def should_stop(self, epoch_idx, best_score):
+        r"""Whether to stop after evaluating epoch ``epoch_idx`` with the best validation score ``best_score``."""
+        milestones = self.scheduler.milestones
+        if self.next_rung >= len(milestones) or epoch_idx + 1 < milestones[self.next_rung]:
+            return False
+        # an evaluation may skip a rung when eval_step does not divide it, it counts for the last rung reached
+        while self.next_rung + 1 < len(milestones) and epoch_idx + 1 >= milestones[self.next_rung + 1]:
+            self.next_rung += 1
+        milestone = milestones[self.next_rung]
+        self.next_rung += 1
+        return not self.scheduler.record(milestone, best_score)
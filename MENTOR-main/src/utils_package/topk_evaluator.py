@@ -2,7 +2,7 @@ import os
 import numpy as np
 import pandas as pd
 import torch
-from utils_package.metrics import metrics_dict
+from utils_package.metrics import metrics_dict, torch_metrics_dict
 from torch.nn.utils.rnn import pad_sequence
 from utils_package.utils import get_local_time
 
@@ -11,6 +11,50 @@ from utils_package.utils import get_local_time
 topk_metrics = {metric.lower(): metric for metric in ['Recall', 'Recall2', 'Precision', 'NDCG', 'MAP']}
 
 
+def full_sort_topk(user_tensor, item_tensor, k, masked_items=None, tile_size=65536, mask_value=-1e10):
+    r"""Top-k items of each user under dot-product scores, walking the items in tiles of ``tile_size``.
+
+    Only a ``users x tile_size`` score block exists at a time: the masked (training) items of the tile are set to
+    ``mask_value`` inside the block and its top-k is merged into the running top-k, so peak memory does not grow
+    with the catalog. With a single tile this is ``torch.topk`` over the masked full score matrix.
+
+    Args:
+        user_tensor (torch.Tensor): ``n_users x d`` user representations.
+        item_tensor (torch.Tensor): ``n_items x d`` item representations.
+        k (int): items kept per user.
+        masked_items (tuple, optional): ``(rows, items)`` of the entries to exclude.
+        tile_size (int): items scored per block.
+
+    Returns:
+        tuple: ``(scores, index)``, both ``n_users x k``, in descending score.
+    """
+    n_items = item_tensor.shape[0]
+    tile_size = min(tile_size, n_items) if tile_size else n_items
+    starts = range(0, n_items, tile_size)
+    if masked_items is not None:
+        # excluded entries sorted by item, so that each tile takes a contiguous slice
+        rows, cols = masked_items
+        order = torch.argsort(cols)
+        rows, cols = rows[order], cols[order]
+        tile_bounds = torch.arange(0, n_items + tile_size, tile_size, device=cols.device)
+        tile_bounds = torch.searchsorted(cols, tile_bounds).tolist()
+    top_scores = top_index = None
+    for t, start in enumerate(starts):
+        scores = torch.matmul(user_tensor, item_tensor[start: start + tile_size].t())
+        if masked_items is not None:
+            lo, hi = tile_bounds[t], tile_bounds[t + 1]
+            scores[rows[lo:hi], cols[lo:hi] - start] = mask_value
+        tile_scores, tile_index = torch.topk(scores, min(k, scores.shape[1]), dim=-1)
+        tile_index += start
+        if top_scores is not None:
+            tile_scores = torch.cat((top_scores, tile_scores), dim=1)
+            tile_index = torch.cat((top_index, tile_index), dim=1)
+            tile_scores, pos = torch.topk(tile_scores, min(k, tile_scores.shape[1]), dim=-1)
+            tile_index = torch.gather(tile_index, 1, pos)
+        top_scores, top_index = tile_scores, tile_index
+    return top_scores, top_index
+
+
 class TopKEvaluator(object):
     r"""TopK Evaluator is mainly used in ranking tasks. Now, we support six topk metrics which
     contain `'Hit', 'Recall', 'MRR', 'Precision', 'NDCG', 'MAP'`.
@@ -62,9 +106,8 @@ class TopKEvaluator(object):
             dict: such as ``{'Hit@20': 0.3824, 'Recall@20': 0.0527, 'Hit@10': 0.3153, 'Recall@10': 0.0329}``
 
         """
-        pos_items = eval_data.get_eval_items()
         pos_len_list = eval_data.get_eval_len_list()
-        topk_index = torch.cat(batch_matrix_list, dim=0).cpu().numpy()
+        topk_index = torch.cat(batch_matrix_list, dim=0)
         # if save recommendation result?
         if self.save_recom_result and is_test:
             dataset_name = self.config['dataset']
@@ -75,17 +118,16 @@ class TopKEvaluator(object):
                 os.makedirs(dir_name)
             file_path = os.path.join(dir_name, '{}-{}-idx{}-top{}-{}.csv'.format(
                 model_name, dataset_name, idx, max_k, get_local_time()))
-            x_df = pd.DataFrame(topk_index)
+            x_df = pd.DataFrame(topk_index.cpu().numpy())
             x_df.insert(0, 'id', eval_data.get_eval_users())
             x_df.columns = ['id']+['top_'+str(i) for i in range(max_k)]
             x_df = x_df.astype(int)
             x_df.to_csv(file_path, sep='\t', index=False)
         assert len(pos_len_list) == len(topk_index)
-        # if recom right?
-        bool_rec_matrix = []
-        for m, n in zip(pos_items, topk_index):
-            bool_rec_matrix.append([True if i in m else False for i in n])
-        bool_rec_matrix = np.asarray(bool_rec_matrix)
+        # if recom right? kept on the GPU, where the torch metric kernels take over
+        bool_rec_matrix = self._hit_matrix(topk_index, eval_data)
+        if not bool_rec_matrix.is_cuda:
+            bool_rec_matrix = bool_rec_matrix.numpy()
 
         # get metrics
         metric_dict = {}
@@ -96,6 +138,23 @@ class TopKEvaluator(object):
                 metric_dict[key] = round(value[k - 1], 4)
         return metric_dict
 
+    def _hit_matrix(self, topk_index, eval_data):
+        """Mark which of the top-k items of each user are evaluated items, on the device of ``topk_index``.
+
+        Every ``(row, item)`` pair is encoded as ``row * n_items + item`` and looked up with one
+        ``searchsorted`` in the sorted keys of the evaluated items.
+
+        Returns:
+            torch.Tensor: bool matrix of the same shape and on the same device as ``topk_index``
+        """
+        keys = eval_data.get_eval_items_keys().to(topk_index.device)
+        if len(keys) == 0:
+            return torch.zeros_like(topk_index, dtype=torch.bool)
+        rows = torch.arange(topk_index.shape[0], device=topk_index.device).unsqueeze(1)
+        query = rows * eval_data.dataset.get_item_num() + topk_index
+        pos = torch.searchsorted(keys, query).clamp_(max=len(keys) - 1)
+        return keys[pos] == query
+
     def _check_args(self):
         # Check metrics
         if isinstance(self.metrics, (str, list)):
@@ -126,14 +185,19 @@ class TopKEvaluator(object):
 
         Args:
             pos_len_list (list): a list of users' positive items
-            topk_index (np.ndarray): a matrix which contains the index of the topk items for users
+            topk_index (np.ndarray or torch.Tensor): a bool matrix marking the hits in the topk items of users,
+                a tensor is evaluated on its own device
         Returns:
             np.ndarray: a matrix which contains the metrics result
         """
         result_list = []
+        if torch.is_tensor(topk_index):
+            pos_len_list = torch.from_numpy(np.asarray(pos_len_list)).to(topk_index.device)
         for metric in self.metrics:
-            metric_fuc = metrics_dict[metric.lower()]
-            result = metric_fuc(topk_index, pos_len_list)
+            if torch.is_tensor(topk_index):
+                result = torch_metrics_dict[metric.lower()](topk_index, pos_len_list).cpu().numpy()
+            else:
+                result = metrics_dict[metric.lower()](topk_index, pos_len_list)
             result_list.append(result)
         return np.stack(result_list, axis=0)
 
@@ -0,0 +1,133 @@
+import os
+import json
+import shutil
+import argparse
+from itertools import chain
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+def save_user_graph(path, indptr, indices, weights, inputs=None):
+    """Write the top-k user-user graph in CSR form: ``indptr`` (int64, num_user + 1), neighbor ``indices``
+    (int32) and co-interaction ``weights`` (int32), one ``.npy`` file each so that they can be memory-mapped.
+    ``inputs`` (see :func:`read_user_graph_inputs`) are recorded in ``inputs.json`` when given.
+    The directory is written next to ``path`` first and renamed into place when complete.
+    """
+    tmp_path = path + '.tmp'
+    if os.path.isdir(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, 'indptr.npy'), np.asarray(indptr, dtype=np.int64))
+    np.save(os.path.join(tmp_path, 'indices.npy'), np.asarray(indices, dtype=np.int32))
+    np.save(os.path.join(tmp_path, 'weights.npy'), np.asarray(weights, dtype=np.int32))
+    if inputs is not None:
+        with open(os.path.join(tmp_path, 'inputs.json'), 'w') as f:
+            json.dump(inputs, f, sort_keys=True)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+
+
+def load_user_graph(path, mmap_mode='r'):
+    """Load a graph written by :func:`save_user_graph`.
+
+    Returns:
+        tuple: ``(indptr, indices, weights)``, memory-mapped unless ``mmap_mode`` is ``None``
+    """
+    return tuple(np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                 for name in ('indptr', 'indices', 'weights'))
+
+
+def read_user_graph_inputs(path):
+    """``{'interactions': sha1 of the interaction file, 'topk': neighbors per user}`` recorded with a graph by
+    :func:`save_user_graph`, or ``None`` for a graph written without them."""
+    inputs_file = os.path.join(path, 'inputs.json')
+    if not os.path.isfile(inputs_file):
+        return None
+    with open(inputs_file) as f:
+        return json.load(f)
+
+
+def read_train_edges(inter_file, uid_field, iid_field, sep='\t', splitting_label='x_label'):
+    """Training ``(user, item)`` pairs of an interaction file, with the number of users and items.
+
+    Returns:
+        tuple: ``(edges, num_user, num_item)``
+    """
+    df = pd.read_csv(inter_file, sep=sep)
+    num_user = len(pd.unique(df[uid_field]))
+    num_item = int(df[iid_field].max()) + 1
+    df = df[df[splitting_label] == 0]
+    return df[[uid_field, iid_field]].to_numpy(), num_user, num_item
+
+
+def inter_matrix(edges, num_user, num_item):
+    # binary user-item matrix, repeated interactions count once as in a set intersection
+    users, items = edges[:, 0], edges[:, 1]
+    inter_mat = sp.csr_matrix((np.ones(len(users), dtype=np.int32), (users, items)), shape=(num_user, num_item))
+    inter_mat.data[:] = 1
+    return inter_mat
+
+
+def block_topk(inter_mat, start, end, topk):
+    """Co-interaction counts of users [start, end) with all users, keeping the top-k neighbors of each row.
+    Ties are broken by the smaller neighbor id.
+
+    Returns:
+        tuple: ``(counts, indices, values)``, neighbors per user and their ids and counts in rank order
+    """
+    block = (inter_mat[start:end] @ inter_mat.T).tocoo()
+    # drop self pairs, the diagonal of A.A^T
+    keep = block.row + start != block.col
+    rows, cols, vals = block.row[keep], block.col[keep], block.data[keep]
+    order = np.lexsort((cols, -vals, rows))
+    rows, cols, vals = rows[order], cols[order], vals[order]
+    counts = np.bincount(rows, minlength=end - start)
+    rank = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+    keep = rank < topk
+    return np.minimum(counts, topk).astype(np.int64), cols[keep].astype(np.int32), vals[keep].astype(np.int32)
+
+
+def build_user_graph(inter_mat, topk=200, block_size=1024):
+    """CSR ``(indptr, indices, weights)`` of the top-k user-user graph, built in memory by one process; the
+    same graph that generate-u-u-matrix.py streams to disk."""
+    num_user = inter_mat.shape[0]
+    parts = [block_topk(inter_mat, start, min(start + block_size, num_user), topk)
+             for start in range(0, num_user, block_size)]
+    counts, indices, weights = (np.concatenate(arrays) for arrays in zip(*parts))
+    return np.concatenate(([0], np.cumsum(counts))), indices, weights
+
+
+def user_graph_from_dict(dict_file):
+    """CSR ``(indptr, indices, weights)`` of a pickled ``{user: [neighbor ids, weights]}`` dict (the former
+    ``user_graph_dict.npy``)."""
+    user_graph_dict = np.load(dict_file, allow_pickle=True).item()
+    num_user = len(user_graph_dict)
+    counts = np.fromiter((len(user_graph_dict[i][0]) for i in range(num_user)), dtype=np.int64, count=num_user)
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    indices = np.fromiter(chain.from_iterable(user_graph_dict[i][0] for i in range(num_user)),
+                          dtype=np.int64, count=indptr[-1])
+    weights = np.fromiter(chain.from_iterable(user_graph_dict[i][1] for i in range(num_user)),
+                          dtype=np.float64, count=indptr[-1])
+    return indptr, indices.astype(np.int32), np.rint(weights).astype(np.int32)
+
+
+def convert_user_graph_dict(dict_file, path, inputs=None):
+    """Convert a pickled user graph dict to the CSR directory of :func:`save_user_graph`."""
+    save_user_graph(path, *user_graph_from_dict(dict_file), inputs=inputs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dict_file', type=str, help='pickled user_graph_dict.npy')
+    parser.add_argument('path', type=str, help='output directory of the CSR graph')
+    parser.add_argument('--inter_file', type=str, default=None,
+                        help='interaction file the dict was built from, recorded so that MENTOR uses the graph')
+    parser.add_argument('--topk', type=int, default=200, help='neighbors per user the dict was built with')
+    args = parser.parse_args()
+    inputs = None
+    if args.inter_file:
+        from artifact_cache import file_digest
+        inputs = {'interactions': file_digest(args.inter_file), 'topk': args.topk}
+    convert_user_graph_dict(args.dict_file, args.path, inputs)